@@ -0,0 +1,184 @@
+# テキスト抽出のバックエンド（Gemini・ローカルのスタブ・2つのバックエンドの競争）
+#
+# バックエンドはアップロード済みのファイル（と元の画像のパス）を受け取り、
+# figure_name / token の辞書のリスト（figure_token の構造）を返す。
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Optional, Protocol
+
+import pages
+import tracing
+from cascade import schema_errors
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCancelled(Exception):
+    """競争に負けたため抽出をやめた（sent: リクエストを送信済みだったか）"""
+
+    def __init__(self, sent: bool):
+        super().__init__("競争に負けたため抽出をやめました")
+        self.sent = sent
+
+
+class ExtractionBackend(Protocol):
+    """テキスト抽出のバックエンド"""
+
+    name: str
+
+    def extract(self, files, image_paths=None, model=None, cancel=None) -> list[dict]:
+        """figure_name / token の辞書のリストを返す（失敗した場合は例外）
+
+        Args:
+            files: アップロード済みのファイル
+            image_paths: files の元の画像（分からない場合はNone）
+            model: 使用するモデル（Noneの場合はバックエンドの既定）
+            cancel: セットされたら結果は不要（threading.Event、Noneの場合は最後まで実行）。
+                やめた場合は ExtractionCancelled を送出する
+        """
+        ...
+
+
+class GeminiBackend:
+    """パイプラインの設定（キープール・キャッシュ・ヘッジ）でGeminiに問い合わせる
+
+    model を指定した場合は、呼び出し側のモデルの指定より優先する
+    （競争の相手に別のモデルを使う場合など）。
+    """
+
+    def __init__(self, pipeline, model: Optional[str] = None):
+        self.pipeline = pipeline
+        self.model = model
+
+    @property
+    def name(self) -> str:
+        return f"gemini:{self.model}" if self.model else "gemini"
+
+    def extract(self, files, image_paths=None, model=None, cancel=None) -> list[dict]:
+        return self.pipeline.generate_with_gemini(
+            files, model=self.model or model, cancel=cancel
+        )
+
+
+class StubBackend:
+    """APIを呼ばずに画像ごとに1つの図を返す（動作確認・テスト用）"""
+
+    name = "stub"
+
+    def __init__(self, tokens=()):
+        self.tokens = list(tokens)
+
+    def extract(self, files, image_paths=None, model=None, cancel=None) -> list[dict]:
+        if image_paths:
+            names = [pages.display_name(path) for path in image_paths]
+        else:
+            names = [
+                getattr(file, "display_name", None) or getattr(file, "name", "")
+                for file in files
+            ]
+        return [{"figure_name": name, "token": list(self.tokens)} for name in names]
+
+
+class RaceBackend:
+    """2つのバックエンドに同じリクエストを送り、先に返った有効な結果を使う
+
+    figure_token の構造になっていない結果と例外は無視して、もう一方を待つ。
+    勝負がついたら負けた方に cancel で知らせ、完了まで待たずに戻る。負けた方は
+    送信前ならリクエストを送らずにやめるが、送信済みのリクエストは中断できない
+    ため、その結果は捨てて無駄になったリクエストとして数える。
+    """
+
+    def __init__(self, primary: ExtractionBackend, secondary: ExtractionBackend):
+        self.primary = primary
+        self.secondary = secondary
+        # バックエンドごとの勝った回数
+        self.wins: Counter = Counter()
+        # 負けて送信前にやめた回数と、送信済みで結果を捨てた（無駄になった）回数
+        self.cancelled: Counter = Counter()
+        self.wasted: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"race({self.primary.name}, {self.secondary.name})"
+
+    def _count_loser(self, backend, future):
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or (
+            isinstance(error, ExtractionCancelled) and not error.sent
+        ):
+            counter, message = self.cancelled, "送信前にやめました"
+        elif error is None or isinstance(error, ExtractionCancelled):
+            counter, message = (
+                self.wasted,
+                "結果を捨てました（リクエストは無駄になりました）",
+            )
+        else:
+            return
+        with self._lock:
+            counter[backend.name] += 1
+        logger.info("競争に負けた %s は%s", backend.name, message)
+
+    def extract(self, files, image_paths=None, model=None, cancel=None) -> list[dict]:
+        errors = []
+        lost = threading.Event()
+        futures = {}
+        settled = set()
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="race")
+        try:
+            for backend in (self.primary, self.secondary):
+                future = executor.submit(
+                    tracing.wrap(backend.extract), files, image_paths, model, lost
+                )
+                futures[future] = backend
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    settled.add(future)
+                    backend = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.info("%s での抽出に失敗しました: %s", backend.name, e)
+                        errors.append(e)
+                        continue
+                    problems = schema_errors(result)
+                    if problems:
+                        logger.info(
+                            "%s の結果が不正です: %s", backend.name, "; ".join(problems)
+                        )
+                        errors.append(ValueError("; ".join(problems)))
+                        continue
+                    with self._lock:
+                        self.wins[backend.name] += 1
+                    logger.debug("%s の結果を使います", backend.name)
+                    return result
+        finally:
+            # 負けた方には結果が不要になったことを知らせ、終わった時点で数える
+            lost.set()
+            for future, backend in futures.items():
+                if future not in settled:
+                    future.add_done_callback(partial(self._count_loser, backend))
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise errors[0]
+
+
+def _create(name: str, pipeline, model: Optional[str]) -> ExtractionBackend:
+    if name == "stub":
+        return StubBackend()
+    if name == "gemini":
+        return GeminiBackend(pipeline, model=model)
+    raise ValueError(f"不明な抽出バックエンドです: {name}")
+
+
+def create_backend(settings, pipeline) -> ExtractionBackend:
+    """[BACKEND] の設定からバックエンドを作る（race_with があれば競争させる）"""
+    primary = _create(settings.name, pipeline, None)
+    if not settings.race_with:
+        return primary
+    secondary = _create(settings.race_with, pipeline, settings.race_model or None)
+    return RaceBackend(primary, secondary)
@@ -0,0 +1,163 @@
+# カスケード抽出：高速なモデルの結果が疑わしい画像だけを通常のモデルで抽出し直す
+#
+# main から起動時にimportされるため、numpy・Pillow は使うときにimportする。
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+from image_cache import grayscale
+
+logger = logging.getLogger(__name__)
+
+# 複雑さを測るときの縮小サイズ（長辺の画素数）
+THUMBNAIL_SIZE = 256
+# 隣の画素との明るさの差がこれ以上の画素を「エッジ」とみなす（0〜255）
+EDGE_LEVEL = 32
+
+
+def image_complexity(path) -> float:
+    """画像の複雑さ（縮小したグレースケール画像のエッジ画素の割合、0.0〜1.0）
+
+    読み込めない場合は0.0（トークン数による判定を行わない）。
+    """
+    import numpy as np
+    from PIL import Image
+
+    try:
+        small, _ = grayscale(path, THUMBNAIL_SIZE)
+        small.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
+    except Exception as e:
+        logger.debug("画像の複雑さを計算できませんでした: %s (%s)", path, e)
+        return 0.0
+    gray = np.asarray(small, dtype=np.int16)
+    if gray.shape[0] < 2 or gray.shape[1] < 2:
+        return 0.0
+    edges = np.zeros(gray.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(gray, axis=1)) >= EDGE_LEVEL
+    edges[1:, :] |= np.abs(np.diff(gray, axis=0)) >= EDGE_LEVEL
+    return float(edges.mean())
+
+
+def schema_errors(result) -> list[str]:
+    """抽出結果が figure_name / token の辞書のリストになっていない箇所"""
+    if not isinstance(result, list):
+        return ["結果がリストではありません"]
+    errors = []
+    for index, figure in enumerate(result):
+        if not isinstance(figure, dict):
+            errors.append(f"{index} 番目の図が辞書ではありません")
+            continue
+        if not isinstance(figure.get("figure_name"), str):
+            errors.append(f"{index} 番目の図に figure_name がありません")
+        tokens = figure.get("token")
+        if not isinstance(tokens, list) or not all(isinstance(t, str) for t in tokens):
+            errors.append(f"{index} 番目の図の token が文字列のリストではありません")
+    return errors
+
+
+def _is_unclassified(text: str) -> bool:
+    return "unclassified" in text.lower()
+
+
+def escalation_reasons(
+    result,
+    image_paths,
+    max_unclassified_ratio: float = 0.3,
+    tokens_per_complexity: float = 100.0,
+) -> list[str]:
+    """高速なモデルの結果を通常のモデルで抽出し直すべき理由（問題がなければ空）
+
+    Args:
+        result: 高速なモデルの抽出結果
+        image_paths: 抽出した画像（複雑さの計算に使う）
+        max_unclassified_ratio: 「Unclassified」のトークンの割合の上限
+        tokens_per_complexity: 複雑さ1.0あたりに期待する最低トークン数
+    """
+    errors = schema_errors(result)
+    if errors:
+        return errors
+    if not result:
+        return ["図が1つも抽出されていません"]
+
+    reasons = []
+    empty = [f["figure_name"] for f in result if not f["token"]]
+    if empty:
+        reasons.append(f"トークンのない図があります: {', '.join(empty)}")
+    tokens = [t for f in result for t in f["token"]]
+    unclassified = sum(_is_unclassified(t) for t in tokens) + sum(
+        len(f["token"]) for f in result if _is_unclassified(f["figure_name"])
+    )
+    if tokens and unclassified / len(tokens) > max_unclassified_ratio:
+        reasons.append(
+            f"Unclassified の割合が高すぎます ({unclassified}/{len(tokens)})"
+        )
+    if tokens_per_complexity > 0:
+        complexity = sum(image_complexity(path) for path in image_paths)
+        expected = complexity * tokens_per_complexity
+        if len(tokens) < expected:
+            reasons.append(
+                f"画像の複雑さに対してトークンが少なすぎます "
+                f"({len(tokens)} < {expected:.0f})"
+            )
+    return reasons
+
+
+@dataclass
+class CascadeStats:
+    """カスケード抽出の集計（再抽出した割合と短縮できた時間の見積もり）"""
+
+    images: int = 0
+    escalated: int = 0
+    fast_seconds: float = 0.0
+    strong_seconds: float = 0.0
+    # 抽出にかかった実際の時間（並列に実行した場合は各リクエストの合計より短い）
+    wall_seconds: Optional[float] = None
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(self, images: int, fast_seconds: float, strong_seconds: Optional[float]):
+        """1リクエスト分を記録する（再抽出しなかった場合 strong_seconds はNone）"""
+        with self._lock:
+            self.images += images
+            self.fast_seconds += fast_seconds
+            if strong_seconds is not None:
+                self.escalated += images
+                self.strong_seconds += strong_seconds
+
+    def record_wall(self, seconds: float):
+        """抽出全体の経過時間を記録する"""
+        with self._lock:
+            self.wall_seconds = (self.wall_seconds or 0.0) + seconds
+
+    @property
+    def escalated_ratio(self) -> float:
+        return self.escalated / self.images if self.images else 0.0
+
+    def latency_saved(self) -> Optional[float]:
+        """カスケードなしのバッチ抽出と比べて短縮できた時間（秒、負の場合は遅くなった）
+
+        カスケードなしでは同じ画像をバッチにまとめて通常のモデルで順に抽出するため、
+        その所要時間を「再抽出した画像の1画像あたりの時間 × 画像数」と見積もり、
+        実際の経過時間（記録がなければ各リクエストの合計）と比べる。
+        再抽出が1件もない場合は見積もれないためNone。
+        """
+        if not self.escalated:
+            return None
+        baseline = self.images * self.strong_seconds / self.escalated
+        actual = self.wall_seconds
+        if actual is None:
+            actual = self.fast_seconds + self.strong_seconds
+        return baseline - actual
+
+    def as_dict(self) -> dict:
+        return {
+            "images": self.images,
+            "escalated": self.escalated,
+            "escalated_ratio": self.escalated_ratio,
+            "fast_seconds": self.fast_seconds,
+            "strong_seconds": self.strong_seconds,
+            "wall_seconds": self.wall_seconds,
+            "latency_saved": self.latency_saved(),
+        }
@@ -1,9 +1,19 @@
 import configparser
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 BASE = Path(__file__).resolve().parent  # この.pyがある場所
 
+ROTATION_WHEN = ("S", "M", "H", "D", "MIDNIGHT") + tuple(f"W{d}" for d in range(7))
+
+logger = logging.getLogger(__name__)
+
 
 def load_config(config_path: Optional[Path] = None) -> configparser.ConfigParser:
     """
@@ -29,6 +39,552 @@ def load_config(config_path: Optional[Path] = None) -> configparser.ConfigParser
     return config_ini
 
 
+class SettingsError(ValueError):
+    """設定値が不正な場合の例外（不正な項目をすべて列挙する）"""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("設定ファイルに不正な値があります: " + "; ".join(errors))
+        self.errors = errors
+
+
+@dataclass(frozen=True)
+class GeminiSettings:
+    api_key: str
+    api_keys: tuple[str, ...]
+    model: str
+    batch_size: int
+    rpm_limit: int
+    tpm_limit: int
+    cache_ttl: float
+    request_timeout: float
+    hedge_percentile: float
+    hedge_max_ratio: float
+    max_retries: int
+    retry_backoff: float
+
+
+@dataclass(frozen=True)
+class GuiSettings:
+    window_size: str
+    icon_name: str
+    max_parallel_jobs: int
+    max_concurrent_requests: int
+    prefetch_uploads: bool
+    restore_session: bool
+    session_dir: str
+
+
+@dataclass(frozen=True)
+class LoggingSettings:
+    log_file: str
+    level: int
+    encoding: str
+    format: str
+    rotation: str
+    max_bytes: int
+    backup_count: int
+    when: str
+    json: bool
+
+
+@dataclass(frozen=True)
+class PptxSettings:
+    output_dir: str
+    font_name: str
+    font_size: int
+    char_width_in: float
+    min_w_in: float
+    min_h_in: float
+    wrap_padding_in: float
+    layout_num: int
+    margin_l: float
+    margin_r: float
+    margin_t: float
+    margin_b: float
+    heading_h: float
+
+    @property
+    def line_height_in(self) -> float:
+        return 1.3 * (self.font_size / 72.0)
+
+
+@dataclass(frozen=True)
+class InputSettings:
+    pdf_dpi: int
+    max_decoded_pages: int
+    decode_cache_mb: int
+
+
+@dataclass(frozen=True)
+class DedupeSettings:
+    enabled: bool
+    similarity: float
+    hash_size: int
+
+
+@dataclass(frozen=True)
+class PanelSettings:
+    enabled: bool
+    min_gap_ratio: float
+    min_panel_ratio: float
+    max_panels: int
+
+
+@dataclass(frozen=True)
+class TileSettings:
+    enabled: bool
+    max_side: int
+    overlap_ratio: float
+    max_tiles: int
+
+
+@dataclass(frozen=True)
+class CascadeSettings:
+    enabled: bool
+    model: str
+    max_unclassified_ratio: float
+    tokens_per_complexity: float
+
+
+@dataclass(frozen=True)
+class ProfileSettings:
+    enabled: bool
+    output_dir: str
+    top: int
+
+
+@dataclass(frozen=True)
+class TraceSettings:
+    enabled: bool
+    output_dir: str
+    format: str
+
+
+@dataclass(frozen=True)
+class BackendSettings:
+    name: str
+    race_with: str
+    race_model: str
+
+
+@dataclass(frozen=True)
+class WatchSettings:
+    directory: str
+    patterns: tuple[str, ...]
+    settle_seconds: float
+    poll_interval: float
+    max_batch_size: int
+    max_latency: float
+    deck_mode: str
+    deck_name: str
+    process_existing: bool
+
+
+@dataclass(frozen=True)
+class ServiceSettings:
+    host: str
+    port: int
+    workers: int
+    queue_size: int
+    job_dir: str
+    max_images: int
+    max_image_bytes: int
+    max_total_bytes: int
+    job_retention: float
+
+
+class _Reader:
+    """ConfigParserから型変換しつつ値を読み、エラーをまとめて記録する"""
+
+    def __init__(self, config_ini):
+        self.config_ini = config_ini
+        self.errors: list[str] = []
+
+    def str(self, section, option, fallback):
+        value = self.config_ini.get(section, option, fallback=None)
+        return fallback if value is None else value
+
+    def _convert(self, section, option, fallback, convert, minimum, maximum):
+        raw = self.config_ini.get(section, option, fallback=None)
+        if raw is None or (isinstance(raw, str) and not raw.strip()):
+            return fallback
+        try:
+            value = convert(raw)
+        except (TypeError, ValueError):
+            self.errors.append(f"[{section}] {option} = {raw!r} は数値ではありません")
+            return fallback
+        if minimum is not None and value < minimum:
+            self.errors.append(f"[{section}] {option} は {minimum} 以上にしてください")
+        if maximum is not None and value > maximum:
+            self.errors.append(f"[{section}] {option} は {maximum} 以下にしてください")
+        return value
+
+    def int(self, section, option, fallback, minimum=None, maximum=None):
+        return self._convert(section, option, fallback, int, minimum, maximum)
+
+    def float(self, section, option, fallback, minimum=None, maximum=None):
+        return self._convert(section, option, fallback, float, minimum, maximum)
+
+    def bool(self, section, option, fallback):
+        raw = self.config_ini.get(section, option, fallback=None)
+        if raw is None:
+            return fallback
+        lowered = str(raw).strip().lower()
+        if lowered in ("1", "yes", "true", "on"):
+            return True
+        if lowered in ("0", "no", "false", "off", ""):
+            return False
+        self.errors.append(f"[{section}] {option} = {raw!r} は真偽値ではありません")
+        return fallback
+
+    def choice(self, section, option, fallback, choices):
+        value = self.str(section, option, fallback)
+        if value not in choices:
+            self.errors.append(
+                f"[{section}] {option} は {', '.join(choices)} のいずれかにしてください"
+            )
+            return fallback
+        return value
+
+
+@dataclass(frozen=True)
+class Settings:
+    """検証済みの型付き設定（不変）"""
+
+    gemini: GeminiSettings
+    gui: GuiSettings
+    logging: LoggingSettings
+    pptx: PptxSettings
+    watch: WatchSettings
+    service: ServiceSettings
+    dedupe: DedupeSettings
+    panels: PanelSettings
+    input: InputSettings
+    cascade: CascadeSettings
+    profile: ProfileSettings
+    backend: BackendSettings
+    tiles: TileSettings
+    trace: TraceSettings
+
+    @classmethod
+    def from_config(cls, config_ini) -> "Settings":
+        """ConfigParserから設定を作成する。不正な値があればSettingsErrorを送出"""
+        r = _Reader(config_ini)
+
+        api_keys = tuple(
+            entry.strip()
+            for entry in r.str("GEMINI", "api_keys", "").split(",")
+            if entry.strip()
+        )
+        gemini = GeminiSettings(
+            api_key=r.str("GEMINI", "api_key", ""),
+            api_keys=api_keys,
+            model=r.str("GEMINI", "model", "gemini-2.5-flash"),
+            batch_size=r.int("GEMINI", "batch_size", 0, minimum=0),
+            rpm_limit=r.int("GEMINI", "rpm_limit", 0, minimum=0),
+            tpm_limit=r.int("GEMINI", "tpm_limit", 0, minimum=0),
+            cache_ttl=r.float("GEMINI", "cache_ttl", 3600.0, minimum=0.0),
+            request_timeout=r.float("GEMINI", "request_timeout", 300.0, minimum=0.0),
+            hedge_percentile=r.float(
+                "GEMINI", "hedge_percentile", 0.0, minimum=0.0, maximum=99.9
+            ),
+            hedge_max_ratio=r.float(
+                "GEMINI", "hedge_max_ratio", 0.1, minimum=0.0, maximum=1.0
+            ),
+            max_retries=r.int("GEMINI", "max_retries", 2, minimum=0),
+            retry_backoff=r.float("GEMINI", "retry_backoff", 2.0, minimum=0.0),
+        )
+
+        window_size = r.str("GUI_SETTINGS", "window_size", "1170x450")
+        if not re.fullmatch(r"\d+x\d+([+-]\d+[+-]\d+)?", window_size):
+            r.errors.append(f"[GUI_SETTINGS] window_size = {window_size!r} は不正です")
+        gui = GuiSettings(
+            window_size=window_size,
+            icon_name=r.str("GUI_SETTINGS", "icon_name", "favicon.ico"),
+            max_parallel_jobs=r.int("GUI_SETTINGS", "max_parallel_jobs", 2, minimum=1),
+            max_concurrent_requests=r.int(
+                "GUI_SETTINGS", "max_concurrent_requests", 10, minimum=1
+            ),
+            prefetch_uploads=r.bool("GUI_SETTINGS", "prefetch_uploads", True),
+            restore_session=r.bool("GUI_SETTINGS", "restore_session", True),
+            session_dir=r.str("GUI_SETTINGS", "session_dir", "session"),
+        )
+
+        level_name = r.str("LOGGING", "log-level", "INFO").upper()
+        level = logging.getLevelName(level_name)
+        if not isinstance(level, int):
+            r.errors.append(f"[LOGGING] log-level = {level_name!r} は不正です")
+            level = logging.INFO
+        # TimedRotatingFileHandler が受け付ける値（大文字・小文字は区別しない）
+        when = r.str("LOGGING", "when", "midnight")
+        if when.upper() not in ROTATION_WHEN:
+            r.errors.append(
+                f"[LOGGING] when は {', '.join(ROTATION_WHEN)} のいずれかにしてください"
+            )
+            when = "midnight"
+        logging_settings = LoggingSettings(
+            log_file=r.str("LOGGING", "log_file", "app.log"),
+            level=level,
+            encoding=r.str("LOGGING", "encoding", "utf-8"),
+            format=r.str(
+                "LOGGING",
+                "format",
+                "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+            ),
+            rotation=r.choice("LOGGING", "rotation", "size", ("none", "size", "time")),
+            max_bytes=r.int("LOGGING", "max_bytes", 10 * 1024 * 1024, minimum=1),
+            backup_count=r.int("LOGGING", "backup_count", 5, minimum=0),
+            when=when,
+            json=r.bool("LOGGING", "json", False),
+        )
+
+        section = "PPTX_SETTINGS"
+        pptx = PptxSettings(
+            output_dir=r.str(section, "output_dir", "pptx_output"),
+            font_name=r.str(section, "font_name", "Arial"),
+            font_size=r.int(section, "font_size", 14, minimum=1),
+            char_width_in=r.float(section, "char_width_in", 0.097, minimum=0.001),
+            min_w_in=r.float(section, "min_w_in", 0.45, minimum=0.0),
+            min_h_in=r.float(section, "min_h_in", 0.30, minimum=0.0),
+            wrap_padding_in=r.float(section, "wrap_padding_in", 0.20, minimum=0.0),
+            layout_num=r.int(section, "layout_num", 6, minimum=0),
+            margin_l=r.float(section, "margin_l", 0.4, minimum=0.0),
+            margin_r=r.float(section, "margin_r", 0.4, minimum=0.0),
+            margin_t=r.float(section, "margin_t", 0.5, minimum=0.0),
+            margin_b=r.float(section, "margin_b", 0.4, minimum=0.0),
+            heading_h=r.float(section, "heading_h", 0.4, minimum=0.0),
+        )
+
+        section = "WATCH"
+        watch = WatchSettings(
+            directory=r.str(section, "directory", "watch"),
+            patterns=tuple(
+                p.lower()
+                for p in r.str(
+                    section, "patterns", "*.jpg *.jpeg *.png *.pdf *.tif *.tiff"
+                ).split()
+            ),
+            settle_seconds=r.float(section, "settle_seconds", 2.0, minimum=0.0),
+            poll_interval=r.float(section, "poll_interval", 1.0, minimum=0.01),
+            max_batch_size=r.int(section, "max_batch_size", 20, minimum=1),
+            max_latency=r.float(section, "max_latency", 60.0, minimum=0.0),
+            deck_mode=r.choice(
+                section, "deck_mode", "rolling", ("rolling", "append", "per_batch")
+            ),
+            deck_name=r.str(section, "deck_name", "watch"),
+            process_existing=r.bool(section, "process_existing", False),
+        )
+
+        section = "SERVICE"
+        service = ServiceSettings(
+            host=r.str(section, "host", "127.0.0.1"),
+            port=r.int(section, "port", 8765, minimum=0, maximum=65535),
+            workers=r.int(section, "workers", 2, minimum=1),
+            queue_size=r.int(section, "queue_size", 16, minimum=1),
+            job_dir=r.str(section, "job_dir", "service_jobs"),
+            max_images=r.int(section, "max_images", 50, minimum=1),
+            max_image_bytes=r.int(
+                section, "max_image_bytes", 20 * 1024 * 1024, minimum=1
+            ),
+            max_total_bytes=r.int(
+                section, "max_total_bytes", 200 * 1024 * 1024, minimum=1
+            ),
+            job_retention=r.float(section, "job_retention", 3600.0, minimum=0.0),
+        )
+
+        section = "DEDUPE"
+        dedupe = DedupeSettings(
+            enabled=r.bool(section, "enabled", False),
+            similarity=r.float(section, "similarity", 0.97, minimum=0.5, maximum=1.0),
+            hash_size=r.int(section, "hash_size", 16, minimum=4, maximum=64),
+        )
+
+        section = "PANELS"
+        panels = PanelSettings(
+            enabled=r.bool(section, "enabled", False),
+            min_gap_ratio=r.float(
+                section, "min_gap_ratio", 0.02, minimum=0.0, maximum=0.5
+            ),
+            min_panel_ratio=r.float(
+                section, "min_panel_ratio", 0.15, minimum=0.0, maximum=1.0
+            ),
+            max_panels=r.int(section, "max_panels", 12, minimum=2),
+        )
+
+        section = "INPUT"
+        input_settings = InputSettings(
+            pdf_dpi=r.int(section, "pdf_dpi", 200, minimum=36, maximum=1200),
+            max_decoded_pages=r.int(section, "max_decoded_pages", 4, minimum=1),
+            decode_cache_mb=r.int(section, "decode_cache_mb", 256, minimum=0),
+        )
+
+        section = "CASCADE"
+        cascade = CascadeSettings(
+            enabled=r.bool(section, "enabled", False),
+            model=r.str(section, "model", "gemini-2.5-flash"),
+            max_unclassified_ratio=r.float(
+                section, "max_unclassified_ratio", 0.3, minimum=0.0, maximum=1.0
+            ),
+            tokens_per_complexity=r.float(
+                section, "tokens_per_complexity", 100.0, minimum=0.0
+            ),
+        )
+
+        section = "PROFILE"
+        profile = ProfileSettings(
+            enabled=r.bool(section, "enabled", False),
+            output_dir=r.str(section, "output_dir", "profiles"),
+            top=r.int(section, "top", 30, minimum=1),
+        )
+
+        section = "BACKEND"
+        backend = BackendSettings(
+            name=r.choice(section, "name", "gemini", ("gemini", "stub")),
+            race_with=r.choice(section, "race_with", "", ("", "gemini", "stub")),
+            race_model=r.str(section, "race_model", ""),
+        )
+        if backend.race_with and "stub" in (backend.name, backend.race_with):
+            # スタブは常にすぐ空の結果で勝つため、競争が意味をなさない
+            r.errors.append(f"[{section}] stub は競争（race_with）に使えません")
+        elif backend.race_with and (backend.race_model or gemini.model) == gemini.model:
+            # 同じモデル同士では、同じリクエストを2回送るだけになる
+            r.errors.append(
+                f"[{section}] race_model には [GEMINI] model と異なるモデルを指定してください"
+            )
+
+        section = "TILES"
+        tiles = TileSettings(
+            enabled=r.bool(section, "enabled", False),
+            max_side=r.int(section, "max_side", 3072, minimum=256),
+            overlap_ratio=r.float(
+                section, "overlap_ratio", 0.1, minimum=0.0, maximum=0.5
+            ),
+            max_tiles=r.int(section, "max_tiles", 16, minimum=2),
+        )
+
+        section = "TRACE"
+        trace = TraceSettings(
+            enabled=r.bool(section, "enabled", False),
+            output_dir=r.str(section, "output_dir", "traces"),
+            format=r.choice(section, "format", "chrome", ("chrome", "otlp")),
+        )
+
+        if r.errors:
+            raise SettingsError(r.errors)
+        return cls(
+            gemini,
+            gui,
+            logging_settings,
+            pptx,
+            watch,
+            service,
+            dedupe,
+            panels,
+            input_settings,
+            cascade,
+            profile,
+            backend,
+            tiles,
+            trace,
+        )
+
+
+def load_settings(config_path: Optional[Path] = None) -> Settings:
+    """設定ファイルを読み込み、検証済みの型付き設定を返す"""
+    return Settings.from_config(load_config(config_path))
+
+
+class SettingsWatcher:
+    """設定ファイルの更新時刻を監視し、変更があれば再読み込みする
+
+    再読み込みした設定が不正な場合はエラーをログに記録し、
+    直前の有効な設定を使い続ける。
+    """
+
+    def __init__(
+        self,
+        config_path: Optional[Path] = None,
+        check_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.config_path = Path(config_path or BASE / "config" / "config.ini")
+        self.check_interval = check_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[Settings, configparser.ConfigParser], None]] = (
+            []
+        )
+        self._mtime_ns = self._stat()
+        self.config_ini = load_config(self.config_path)
+        self._settings = Settings.from_config(self.config_ini)
+        self._last_check = self.clock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stat(self) -> Optional[int]:
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def subscribe(
+        self, callback: Callable[[Settings, configparser.ConfigParser], None]
+    ):
+        """設定が再読み込みされたときに呼ばれるコールバックを登録する"""
+        self._callbacks.append(callback)
+
+    def start(self):
+        """バックグラウンドで定期的に更新を確認する（デーモン・サービス用）"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="settings-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.reload_if_changed()
+
+    def get(self) -> Settings:
+        """現在の設定を返す（check_interval ごとに更新を確認する）"""
+        now = self.clock()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.reload_if_changed()
+        return self._settings
+
+    def reload_if_changed(self) -> bool:
+        """更新されていれば再読み込みし、反映した場合はTrueを返す"""
+        with self._lock:
+            mtime_ns = self._stat()
+            if mtime_ns is None or mtime_ns == self._mtime_ns:
+                return False
+            self._mtime_ns = mtime_ns
+            try:
+                config_ini = load_config(self.config_path)
+                settings = Settings.from_config(config_ini)
+            except (SettingsError, configparser.Error) as e:
+                logger.error(
+                    "設定の再読み込みに失敗しました（以前の設定を使用）: %s", e
+                )
+                return False
+            self.config_ini = config_ini
+            self._settings = settings
+        logger.info("設定を再読み込みしました: %s", self.config_path)
+        for callback in self._callbacks:
+            try:
+                callback(settings, config_ini)
+            except Exception:
+                logger.exception("設定変更の反映中にエラーが発生しました")
+        return True
+
+
 # モジュールレベルでの初期化（後方互換性のため）
 try:
     config_ini = load_config()
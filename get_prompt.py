@@ -1,9 +1,11 @@
 # システムプロンプトを取得する関数
-from os import path
+from os import path, stat
+
+INSTRUCTION_PATH = path.join("config", "system_instruction.md")
 
 
 def get_system_instructions():
-    instruction_path = path.join("config", "system_instruction.md")
+    instruction_path = INSTRUCTION_PATH
     if not path.exists(instruction_path):
         raise FileNotFoundError(
             f"System instruction file not found: {instruction_path}"
@@ -14,5 +16,13 @@ def get_system_instructions():
     return system_instructions
 
 
+def get_instruction_mtime():
+    """システムプロンプトのファイルの更新時刻（ファイルがない場合はNone）"""
+    try:
+        return stat(INSTRUCTION_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
 if __name__ == "__main__":
     print(get_system_instructions())
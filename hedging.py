@@ -0,0 +1,142 @@
+# リクエストの期限とヘッジ（遅いリクエストの複製）でテールレイテンシを抑える
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(TimeoutError):
+    """リクエストが期限までに完了しなかった"""
+
+
+class LatencyTracker:
+    """直近のリクエストの所要時間から、ヘッジを送るまでの待ち時間を決める
+
+    percentile パーセンタイルの所要時間を超えたリクエストを「遅い」とみなす。
+    サンプルが min_samples に満たない間はヘッジしない。
+    """
+
+    def __init__(self, percentile: float = 95.0, window: int = 100, min_samples=5):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def delay(self) -> Optional[float]:
+        """ヘッジまでの待ち時間（秒）。ヘッジしない場合はNone"""
+        with self._lock:
+            if self.percentile <= 0 or len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """ヘッジの回数を通常のリクエスト数の max_ratio 倍までに抑える
+
+    リクエストごとに max_ratio 個のトークンを貯め（上限 burst）、
+    ヘッジ1回でトークンを1つ使う。
+    """
+
+    def __init__(self, max_ratio: float = 0.1, burst: float = 2.0):
+        self.max_ratio = max_ratio
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.max_ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+def hedged_call(
+    attempt: Callable[[Optional[float]], T],
+    deadline: float = 0.0,
+    hedge_delay: Optional[float] = None,
+    allow_hedge: Optional[Callable[[], bool]] = None,
+) -> T:
+    """attempt を実行し、遅い場合は複製を送って先に完了した結果を返す
+
+    Args:
+        attempt: 1回分のリクエスト。引数は残り時間（秒、期限なしの場合はNone）で、
+            呼び出し側はこれをHTTPのタイムアウトに使う
+        deadline: 全体の期限（秒、0以下の場合は期限なし）
+        hedge_delay: この秒数を過ぎても完了しない場合に複製を1つ送る（Noneの場合は送らない）
+        allow_hedge: 複製を送る直前に呼ばれ、Falseの場合は送らない（クォータの確認など）
+
+    送信済みのリクエストは中断できないため（同期のHTTPクライアント）、負けた
+    リクエストは結果を使わずに、完了するか残り時間のタイムアウトまで実行される。
+    attempt が確保した枠（同時リクエスト数・キーの予約）は attempt の中で解放する。
+
+    Raises:
+        DeadlineExceeded: 期限までにどのリクエストも完了しなかった場合
+        Exception: すべてのリクエストが失敗した場合は最初の例外
+    """
+    if deadline <= 0 and hedge_delay is None:
+        return attempt(None)
+
+    start = time.monotonic()
+
+    def remaining() -> Optional[float]:
+        if deadline <= 0:
+            return None
+        return max(0.0, deadline - (time.monotonic() - start))
+
+    hedge_at = None if hedge_delay is None else start + hedge_delay
+    errors = []
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    futures = []
+    try:
+        futures.append(executor.submit(attempt, remaining()))
+        while futures:
+            now = time.monotonic()
+            limits = []
+            if deadline > 0:
+                limits.append(start + deadline - now)
+            if hedge_at is not None:
+                limits.append(hedge_at - now)
+            timeout = max(0.0, min(limits)) if limits else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(e)
+            now = time.monotonic()
+            if deadline > 0 and now - start >= deadline:
+                raise DeadlineExceeded(
+                    f"リクエストが {deadline:.0f} 秒以内に完了しませんでした"
+                )
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if futures and (allow_hedge is None or allow_hedge()):
+                    logger.info(
+                        "リクエストが %.1f 秒を超えたため複製を送ります", hedge_delay
+                    )
+                    futures.append(executor.submit(attempt, remaining()))
+    finally:
+        # 負けたリクエストの結果は使わない（HTTPのタイムアウトで終了する）
+        running = sum(not future.done() for future in futures)
+        if running:
+            logger.debug("採用しないリクエスト %d 件は完了まで実行されます", running)
+        executor.shutdown(wait=False, cancel_futures=True)
+    raise errors[0]
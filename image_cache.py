@@ -0,0 +1,298 @@
+# デコード済みの画像の共有キャッシュ
+#
+# プレビュー・前処理（近似重複・パネル分割・カスケード）・アップロードで
+# 同じ画像を何度もデコードしないよう、内容のハッシュごとに1回だけデコードし、
+# EXIFの向きと色の形式をそろえた画像を使い回す。保持する画像の合計サイズには
+# 上限を設け、超えた分は長く使われていないものから捨てる。PDF・TIFFのページは
+# [INPUT] max_decoded_pages の枚数までしか保持しない。
+#
+# main から起動時にimportされるため、Pillow は使うときにimportする。
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pages
+from image_registry import content_hash, file_digest
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_PAGES = 4
+# そのまま扱える色の形式（それ以外はRGB・RGBAに変換する）
+NORMAL_MODES = ("RGB", "RGBA", "L")
+# そのままアップロードできる形式と色の形式（それ以外は正規化した画像をPNGで送る）
+UPLOAD_FORMATS = ("JPEG", "PNG", "WEBP")
+UPLOAD_MODES = ("RGB", "RGBA", "L", "LA", "P", "1")
+_ORIENTATION = 0x0112
+
+
+def normalize(img):
+    """EXIFの向きを反映し、RGB・RGBA・L 以外の形式を変換した画像を返す"""
+    from PIL import ImageOps
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in NORMAL_MODES:
+        has_alpha = "A" in img.mode or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    return img
+
+
+def _image_bytes(img) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+class DecodedImageCache:
+    """内容のハッシュごとにデコード済みの画像と縮小画像を保持するLRUキャッシュ
+
+    返す画像は共有されるため、呼び出し側で変更してはならない
+    （変更する場合は copy・convert・resize などで新しい画像を作る）。
+
+    Args:
+        max_bytes: 保持する画像の合計サイズ（展開後のバイト数）の上限。
+            0の場合は保持しない（毎回デコードする）
+        max_pages: 保持するPDF・TIFFのページ（縮小画像を除く）の枚数の上限
+    """
+
+    def __init__(
+        self, max_bytes: int = DEFAULT_MAX_BYTES, max_pages: int = DEFAULT_MAX_PAGES
+    ):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        # 保持しているページのキー
+        self._pages: set = set()
+        self._lock = threading.Lock()
+        # 同じ画像を複数のスレッドが同時にデコードしないためのロック
+        self._decoding: dict = {}
+        # (パス, 更新時刻, サイズ) → ファイル内容のハッシュ
+        self._digests: dict = {}
+        self.decodes = 0
+        self.hits = 0
+
+    @property
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    @property
+    def retained_pages(self) -> int:
+        with self._lock:
+            return len(self._pages)
+
+    def set_max_bytes(self, max_bytes: int):
+        """上限を変更し、超えた分を捨てる"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def set_max_pages(self, max_pages: int):
+        """保持するページの枚数の上限を変更し、超えた分を捨てる"""
+        with self._lock:
+            self.max_pages = max_pages
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._pages.clear()
+            self._digests.clear()
+
+    def _file_id(self, path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def _key(self, ref) -> str:
+        """画像の内容のハッシュ（ファイルが更新されていなければ読み直さない）"""
+        path, _ = pages.split_ref(ref)
+        file_id = self._file_id(path)
+        with self._lock:
+            digest = self._digests.get(file_id)
+        if digest is None:
+            digest = file_digest(path)
+            with self._lock:
+                self._digests[file_id] = digest
+        return content_hash(ref, digest)
+
+    def _lookup(self, key):
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return img
+
+    def _known_key(self, ref):
+        """ファイルを読まずに分かる場合だけ内容のハッシュを返す（なければNone）"""
+        path, _ = pages.split_ref(ref)
+        try:
+            file_id = self._file_id(path)
+        except OSError:
+            return None
+        with self._lock:
+            digest = self._digests.get(file_id)
+        return None if digest is None else content_hash(ref, digest)
+
+    def _store(self, key, img, page: bool = False):
+        size = _image_bytes(img)
+        with self._lock:
+            if key in self._entries or size > self.max_bytes:
+                return
+            if page and self.max_pages <= 0:
+                return
+            self._entries[key] = img
+            self._bytes += size
+            if page:
+                self._pages.add(key)
+            self._evict()
+
+    def _evict(self):
+        # 長く使われていないものから捨てる（self._lock を取得した状態で呼ぶ）
+        while self._bytes > self.max_bytes and self._entries:
+            key, evicted = self._entries.popitem(last=False)
+            self._bytes -= _image_bytes(evicted)
+            self._pages.discard(key)
+        while len(self._pages) > self.max_pages:
+            key = next(key for key in self._entries if key in self._pages)
+            self._bytes -= _image_bytes(self._entries.pop(key))
+            self._pages.discard(key)
+
+    def _decode(self, ref):
+        """画像またはページをデコードして正規化する"""
+        with pages.open_image(ref) as img:
+            img.load()
+            return normalize(img)
+
+    def get(self, ref):
+        """正規化したデコード済みの画像（共有のため変更しないこと）"""
+        key = self._key(ref)
+        img = self._lookup(key)
+        if img is not None:
+            return img
+        with self._lock:
+            decoding = self._decoding.setdefault(key, threading.Lock())
+        try:
+            with decoding:
+                img = self._lookup(key)
+                if img is not None:
+                    return img
+                img = self._decode(ref)
+                with self._lock:
+                    self.decodes += 1
+                self._store(key, img, page=pages.split_ref(ref)[1] is not None)
+                return img
+        finally:
+            with self._lock:
+                self._decoding.pop(key, None)
+
+    @contextmanager
+    def open(self, ref):
+        """get と同じ画像を with 文で使う（pages.open_image と同じ使い方）"""
+        yield self.get(ref)
+
+    def thumbnail(self, ref, size: tuple[int, int]):
+        """縦横比を保って size に収めた縮小画像（共有のため変更しないこと）"""
+        from PIL import Image
+
+        key = f"{self._key(ref)}@{size[0]}x{size[1]}"
+        thumb = self._lookup(key)
+        if thumb is None:
+            thumb = self.get(ref).copy()
+            thumb.thumbnail(size, Image.Resampling.LANCZOS)
+            self._store(key, thumb)
+        return thumb
+
+    def peek_thumbnail(self, ref, size: tuple[int, int]):
+        """保持している縮小画像（ファイルの読み込みやデコードはしない、なければNone）"""
+        key = self._known_key(ref)
+        if key is None:
+            return None
+        with self._lock:
+            return self._entries.get(f"{key}@{size[0]}x{size[1]}")
+
+    def grayscale(self, ref, max_side: int):
+        """解析用のグレースケール画像と、向きを反映した元の大きさを返す
+
+        デコード済みの画像があればそれを使う。なければ画像は縮小しながら
+        デコードし（JPEGは長辺 max_side 程度まで縮小して展開する）、キャッシュには
+        入れない。ページは全体をデコードする必要があるため、キャッシュを使う。
+        返す画像は長辺が max_side 以上のことがある（呼び出し側で縮小する）。
+        """
+        from PIL import ImageOps
+
+        key = self._known_key(ref)
+        img = None if key is None else self._lookup(key)
+        if img is None and pages.split_ref(ref)[1] is not None:
+            img = self.get(ref)
+        if img is not None:
+            return img.convert("L"), img.size
+        with pages.open_image(ref) as img:
+            size = img.size
+            if img.getexif().get(_ORIENTATION, 1) in (5, 6, 7, 8):
+                size = size[::-1]
+            img.draft("L", (max_side, max_side))
+            return ImageOps.exif_transpose(img).convert("L"), size
+
+    @staticmethod
+    def _uploadable_as_is(path) -> bool:
+        """ファイルをそのまま送っても、正規化した画像と同じに見えるか"""
+        from PIL import Image
+
+        try:
+            with Image.open(path) as img:
+                return (
+                    img.format in UPLOAD_FORMATS
+                    and img.mode in UPLOAD_MODES
+                    and img.getexif().get(_ORIENTATION, 1) == 1
+                )
+        except Exception:
+            # 読み込めないファイルは判定できないため、そのまま送ってAPIに任せる
+            return True
+
+    @contextmanager
+    def upload_source(self, ref):
+        """アップロードできるファイルのパスを返す
+
+        そのまま送れる画像はファイルを返し（デコードしない）、ページ・EXIFで
+        回転した画像・特殊な色の形式の画像は、共有のデコード済み画像を
+        一時的なPNGに書き出してアップロード後に削除する。
+        """
+        path, page = pages.split_ref(ref)
+        if page is None and self._uploadable_as_is(path):
+            yield path
+            return
+        fd, temp_path = tempfile.mkstemp(prefix="upload_", suffix=".png")
+        os.close(fd)
+        try:
+            self.get(ref).save(temp_path, format="PNG")
+            yield temp_path
+        finally:
+            os.unlink(temp_path)
+
+
+shared_image_cache = DecodedImageCache()
+
+
+def configure(max_bytes: int, max_pages: int = DEFAULT_MAX_PAGES):
+    """共有キャッシュが保持する画像の合計サイズとページの枚数の上限を設定する"""
+    shared_image_cache.set_max_bytes(max_bytes)
+    shared_image_cache.set_max_pages(max_pages)
+
+
+def open_image(ref):
+    """共有キャッシュから画像を開く（pages.open_image の代わりに使う）"""
+    return shared_image_cache.open(ref)
+
+
+def grayscale(ref, max_side: int):
+    """共有キャッシュを使って解析用のグレースケール画像と元の大きさを返す"""
+    return shared_image_cache.grayscale(ref, max_side)
+
+
+def upload_source(ref):
+    """共有キャッシュを使ってアップロードできるファイルのパスを返す"""
+    return shared_image_cache.upload_source(ref)
@@ -0,0 +1,197 @@
+# 選択された画像の一覧（パスと内容のハッシュで重複を判定する）
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from pages import display_name, split_ref
+
+
+def file_digest(file_path) -> str:
+    """ファイル内容のSHA-256"""
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def content_hash(path, digest: Optional[str] = None) -> str:
+    """ファイル内容のSHA-256（PDF・TIFFのページの場合はページ番号を付ける）
+
+    digest を指定した場合はファイルを読み込まずにそれを使う。
+    """
+    file_path, page = split_ref(path)
+    if digest is None:
+        digest = file_digest(file_path)
+    return digest if page is None else f"{digest}#page={page}"
+
+
+def file_size(path) -> int:
+    return os.path.getsize(split_ref(path)[0])
+
+
+@dataclass(eq=False)
+class ImageEntry:
+    path: str
+    size: int
+    _hash: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def name(self) -> str:
+        return display_name(self.path)
+
+    @property
+    def content_hash(self) -> str:
+        """内容のハッシュ（必要になったときに一度だけ計算する）"""
+        if self._hash is None:
+            self._hash = content_hash(self.path)
+        return self._hash
+
+
+class ImageRegistry:
+    """画像の一覧（uploaded_images とリストボックスの元データ）
+
+    パス・サイズ・内容のハッシュを辞書で管理するため、追加と重複判定は
+    一覧の長さに関係なく一定時間で行える。ハッシュは同じサイズの画像が
+    既にある場合にだけ計算するので、大量に追加してもほとんどのファイルは
+    読み込まれない。PDF・TIFFのページはすべて同じサイズになるが、
+    ファイルのハッシュは1ファイルにつき1回だけ計算してページで共有する。
+    """
+
+    def __init__(self, paths: Iterable[str] = ()):
+        self._entries: dict[str, ImageEntry] = {}
+        self._by_size: dict[int, list[ImageEntry]] = {}
+        self._by_hash: dict[str, ImageEntry] = {}
+        # 登録済みの画像をすべてハッシュの索引に登録したサイズ（以降に追加する
+        # 同じサイズの画像は追加時にハッシュを計算するので、索引し直さない）
+        self._indexed_sizes: set[int] = set()
+        # ファイルのパス → (更新時刻, ハッシュ)
+        self._file_digests: dict[str, tuple[int, str]] = {}
+        self.replace(paths)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries.values()))
+
+    def __contains__(self, path) -> bool:
+        return self._key(path) in self._entries
+
+    @staticmethod
+    def _key(path) -> str:
+        file_path, page = split_ref(path)
+        key = os.path.abspath(file_path)
+        return key if page is None else f"{key}#page={page}"
+
+    @property
+    def paths(self) -> list[str]:
+        """追加した順のパス"""
+        return [entry.path for entry in self._entries.values()]
+
+    def _content_hash(self, path) -> str:
+        """内容のハッシュ（同じファイルのページではファイルを読み直さない）"""
+        file_path = os.path.abspath(split_ref(path)[0])
+        mtime = os.stat(file_path).st_mtime_ns
+        cached = self._file_digests.get(file_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, file_digest(file_path))
+            self._file_digests[file_path] = cached
+        return content_hash(path, cached[1])
+
+    def _index_hashes(self, size: int):
+        """同じサイズの登録済み画像のハッシュを索引に登録する"""
+        if size in self._indexed_sizes:
+            return
+        for entry in self._by_size.get(size, ()):
+            if entry._hash is None:
+                entry._hash = self._content_hash(entry.path)
+            self._by_hash.setdefault(entry._hash, entry)
+        self._indexed_sizes.add(size)
+
+    def _register(self, key: str, entry: ImageEntry):
+        self._entries[key] = entry
+        if entry.size >= 0:
+            self._by_size.setdefault(entry.size, []).append(entry)
+        if entry._hash is not None:
+            self._by_hash.setdefault(entry._hash, entry)
+
+    def add(self, path, dedupe_content: bool = True) -> Optional[ImageEntry]:
+        """画像を追加する（同じパス・同じ内容の画像が登録済みの場合はNone）
+
+        Raises:
+            OSError: ファイルを読み込めない場合
+        """
+        path = str(path)
+        key = self._key(path)
+        if key in self._entries:
+            return None
+        size = file_size(path)
+        digest = None
+        if self._by_size.get(size):
+            # 同じサイズの画像がある場合だけ内容を比較する
+            digest = self._content_hash(path)
+            self._index_hashes(size)
+            if dedupe_content and digest in self._by_hash:
+                return None
+        entry = ImageEntry(path, size, digest)
+        self._register(key, entry)
+        return entry
+
+    def add_many(self, paths: Iterable[str]) -> tuple[list[ImageEntry], int]:
+        """複数の画像を追加し、(追加した画像, スキップした数) を返す"""
+        added, skipped = [], 0
+        for path in paths:
+            try:
+                entry = self.add(path)
+            except OSError:
+                entry = None
+            if entry is None:
+                skipped += 1
+            else:
+                added.append(entry)
+        return added, skipped
+
+    def remove(self, path):
+        entry = self._entries.pop(self._key(path), None)
+        if entry is None:
+            return
+        same_size = self._by_size.get(entry.size, [])
+        if entry in same_size:
+            same_size.remove(entry)
+            if not same_size:
+                del self._by_size[entry.size]
+                self._indexed_sizes.discard(entry.size)
+        if entry._hash is not None and self._by_hash.get(entry._hash) is entry:
+            del self._by_hash[entry._hash]
+            for other in same_size:
+                if other._hash == entry._hash:
+                    self._by_hash[entry._hash] = other
+                    break
+
+    def clear(self):
+        self._entries.clear()
+        self._by_size.clear()
+        self._by_hash.clear()
+        self._indexed_sizes.clear()
+        self._file_digests.clear()
+
+    def restore(self, entries: Iterable[ImageEntry]):
+        """保存した一覧を復元する（ファイルは読み込まず、保存したサイズとハッシュを使う）"""
+        self.clear()
+        for entry in entries:
+            key = self._key(entry.path)
+            if key not in self._entries:
+                self._register(key, entry)
+
+    def replace(self, paths: Iterable[str]):
+        """一覧を置き換える（指定されたパスはそのまま使い、内容での重複判定はしない）"""
+        self.clear()
+        for path in paths:
+            path = str(path)
+            key = self._key(path)
+            if key in self._entries:
+                continue
+            try:
+                size = file_size(path)
+            except OSError:
+                size = -1
+            self._register(key, ImageEntry(path, size))
@@ -0,0 +1,274 @@
+# 複数のデッキのジョブキュー（GUIで使用）
+#
+# 優先度の高いジョブから順に、同時に max_parallel_jobs 個まで実行する。
+# 同じ優先度では画像の合計サイズが大きいジョブを先に始め（LPT）、
+# 全ジョブが終わるまでの時間（メイクスパン）を短くする。
+# アップロードと抽出のリクエスト数の上限は、パイプラインの request_slots で全ジョブが共有する。
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+from image_registry import file_size
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+STATUS_LABELS = {
+    STATUS_QUEUED: "待機中",
+    STATUS_RUNNING: "処理中",
+    STATUS_SUCCEEDED: "完了",
+    STATUS_FAILED: "失敗",
+    STATUS_CANCELLED: "取消",
+}
+
+
+def image_size(path) -> int:
+    """画像のファイルサイズ（バイト、PDF・TIFFのページは元のファイルのサイズ）
+
+    読み込めない場合は0。
+    """
+    try:
+        return file_size(path)
+    except OSError:
+        return 0
+
+
+@dataclass
+class DeckJob:
+    output_name: str
+    images: list[str]
+    priority: int = 0
+    resume: bool = False
+    append: bool = False
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    status: str = STATUS_QUEUED
+    total_bytes: int = 0
+    done: int = 0
+    total: int = 0
+    output_path: Optional[Path] = None
+    error: Optional[str] = None
+    failures: list = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    def describe(self) -> str:
+        """ジョブ一覧に表示する1行（優先度・ファイル名・状態・進捗）"""
+        text = f"[{self.priority}] {self.output_name}: {STATUS_LABELS[self.status]}"
+        if self.status == STATUS_RUNNING and self.total:
+            text += f" {self.done}/{self.total}"
+        elif self.status == STATUS_SUCCEEDED and self.failures:
+            text += f"（失敗 {len(self.failures)} 件）"
+        return text
+
+
+class DeckQueue:
+    """デッキごとのジョブを優先度順に実行するキュー
+
+    Args:
+        pipeline_factory: ジョブごとに新しいパイプラインを作る関数
+        max_parallel_jobs: 同時に実行するジョブ数
+        on_change: ジョブの状態・進捗が変わるたびに (job) で呼ばれる
+            （ワーカースレッドから呼ばれるため、GUIではTkのスレッドに渡すこと）
+    """
+
+    def __init__(
+        self,
+        pipeline_factory: Callable,
+        max_parallel_jobs: int = 2,
+        on_change: Optional[Callable[[DeckJob], None]] = None,
+    ):
+        self.pipeline_factory = pipeline_factory
+        self.max_parallel_jobs = max(1, max_parallel_jobs)
+        self.on_change = on_change
+        self._jobs: dict[str, DeckJob] = {}
+        # (-優先度, -合計サイズ, 追加順, ID) のヒープ
+        self._heap: list[tuple[int, int, int, str]] = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._running: dict[str, object] = {}
+        self._workers: list[threading.Thread] = []
+        self._stopping = False
+
+    def start(self):
+        """ワーカーを起動する（起動済みの場合は何もしない）"""
+        with self._cond:
+            if self._workers:
+                return
+            self._stopping = False
+            for index in range(self.max_parallel_jobs):
+                worker = threading.Thread(
+                    target=self._worker, name=f"deck-job-{index}", daemon=True
+                )
+                self._workers.append(worker)
+                worker.start()
+
+    def stop(self):
+        """待機中のジョブを実行せずに終了し、実行中のジョブに中断を要求する"""
+        with self._cond:
+            self._stopping = True
+            for pipeline in self._running.values():
+                pipeline.cancel_event.set()
+            self._cond.notify_all()
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.join()
+
+    def submit(
+        self, output_name: str, images, priority: int = 0, resume=False, append=False
+    ) -> DeckJob:
+        """ジョブを追加する
+
+        Raises:
+            ValueError: 画像がない場合、または同じファイル名のジョブが未完了の場合
+        """
+        images = list(images)
+        if not images:
+            raise ValueError("ジョブに画像がありません")
+        job = DeckJob(
+            output_name=output_name,
+            images=images,
+            priority=priority,
+            resume=resume,
+            append=append,
+            total=len(images),
+            total_bytes=sum(image_size(p) for p in images),
+        )
+        with self._cond:
+            # 同じファイル名のジョブはジャーナルと出力先を共有してしまう
+            if any(
+                j.output_name == output_name and not j.finished
+                for j in self._jobs.values()
+            ):
+                raise ValueError(
+                    f"同じファイル名のジョブが処理待ちまたは処理中です: {output_name}"
+                )
+            self._jobs[job.id] = job
+            heapq.heappush(
+                self._heap, (-priority, -job.total_bytes, next(self._order), job.id)
+            )
+            self._cond.notify()
+        logger.info(
+            "ジョブを追加しました: %s (%s, 優先度 %d, %d files)",
+            job.id,
+            output_name,
+            priority,
+            len(images),
+        )
+        self._notify(job)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """待機中のジョブを取り消し、実行中のジョブに中断を要求する
+
+        Returns:
+            取り消し・中断を要求できた場合はTrue（完了済み・不明なジョブはFalse）
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            pipeline = self._running.get(job_id)
+            if pipeline is not None:
+                pipeline.cancel_event.set()
+                return True
+            job.status = STATUS_CANCELLED
+            job.finished_at = time.time()
+        self._notify(job)
+        return True
+
+    def get(self, job_id: str) -> Optional[DeckJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list[DeckJob]:
+        """すべてのジョブ（追加順）"""
+        with self._cond:
+            return list(self._jobs.values())
+
+    def scheduled(self) -> list[DeckJob]:
+        """待機中のジョブ（実行する順）"""
+        with self._cond:
+            return [
+                self._jobs[entry[-1]]
+                for entry in sorted(self._heap)
+                if self._jobs[entry[-1]].status == STATUS_QUEUED
+            ]
+
+    def _notify(self, job: DeckJob):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(job)
+        except Exception:
+            logger.exception("ジョブの通知に失敗しました: %s", job.id)
+
+    def _next_job(self) -> Optional[DeckJob]:
+        """次に実行するジョブを取り出す（停止する場合はNone）"""
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                while self._heap:
+                    job = self._jobs[heapq.heappop(self._heap)[-1]]
+                    if job.status == STATUS_QUEUED:
+                        job.status = STATUS_RUNNING
+                        job.started_at = time.time()
+                        return job
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._run_job(job)
+
+    def _progress(self, job: DeckJob, done: int, total: int):
+        job.done, job.total = done, total
+        self._notify(job)
+
+    def _run_job(self, job: DeckJob):
+        self._notify(job)
+        pipeline = None
+        try:
+            pipeline = self.pipeline_factory()
+            pipeline.uploaded_images = job.images
+            pipeline.output_name = job.output_name
+            pipeline.on_progress = lambda done, total: self._progress(job, done, total)
+            with self._cond:
+                self._running[job.id] = pipeline
+                if self._stopping:
+                    pipeline.cancel_event.set()
+            job.output_path = pipeline.run_pipeline(
+                resume=job.resume, append=job.append
+            )
+            job.failures = list(pipeline.last_failures)
+            job.status = STATUS_SUCCEEDED
+        except Exception as e:
+            if pipeline is not None and pipeline.cancel_event.is_set():
+                job.status = STATUS_CANCELLED
+            else:
+                logger.exception("ジョブの処理に失敗しました: %s", job.id)
+                job.status = STATUS_FAILED
+                job.error = str(e)
+        finally:
+            with self._cond:
+                self._running.pop(job.id, None)
+            job.finished_at = time.time()
+        self._notify(job)
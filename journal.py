@@ -0,0 +1,234 @@
+# 処理ジャーナル（長時間処理のクラッシュ復旧・再開用）
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+from pages import split_ref
+
+logger = logging.getLogger(__name__)
+
+# 画像ごとの処理状態
+STATE_PENDING = "pending"
+STATE_UPLOADED = "uploaded"
+STATE_EXTRACTED = "extracted"
+
+# リモートファイルの有効期限に対する安全マージン
+EXPIRY_MARGIN = timedelta(minutes=10)
+
+
+def image_key(file_path) -> str:
+    """画像を識別するキー（絶対パス + サイズ + 更新時刻）を返す
+
+    ファイルが差し替えられた場合は別のキーになるため、
+    再開時に古い抽出結果が使われることはない。
+    """
+    file_path, page = split_ref(file_path)
+    path = Path(file_path).resolve()
+    stat = path.stat()
+    key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    # PDF・TIFFのページはページ番号で区別する
+    return key if page is None else f"{key}#page={page}"
+
+
+def to_iso(value) -> Optional[str]:
+    """リモートファイルの有効期限をISO 8601の文字列にする"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return str(value)
+
+
+def expires_soon(expiration: Optional[str]) -> bool:
+    """有効期限（to_iso の文字列）が安全マージン内に迫っているか、読めない場合はTrue
+
+    有効期限がない（None・空）場合はFalse。
+    """
+    if not expiration:
+        return False
+    try:
+        expires_at = datetime.fromisoformat(expiration)
+    except ValueError:
+        return True
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at - EXPIRY_MARGIN <= datetime.now(timezone.utc)
+
+
+class RunJournal:
+    """画像ごとの処理状態を追記型JSONLで記録するジャーナル
+
+    1行1イベントで追記し、各行を書き込むたびにfsyncする。
+    プロセスが途中で終了しても、再起動時にイベントを再生することで
+    アップロード済みファイルと抽出済みの結果を復元できる。
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._images: dict[str, dict] = {}
+        self._batches: dict[int, dict] = {}
+        self.completed = False
+        self.output_path: Optional[str] = None
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            self._replay()
+        elif self.path.exists():
+            # 新規実行: 前回のジャーナルは破棄する
+            self.path.unlink()
+
+    def _replay(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中でクラッシュした最終行は無視する
+                    logger.warning("ジャーナルの破損行をスキップしました: %s", line_no)
+                    continue
+                self._apply(record)
+        logger.info(
+            "ジャーナルを復元しました: %s (抽出済み %d 件)",
+            self.path,
+            sum(1 for s in self._images.values() if s["state"] == STATE_EXTRACTED),
+        )
+
+    def _apply(self, record: dict):
+        event = record.get("event")
+        if event == "uploaded":
+            state = self._images.setdefault(record["image"], {"state": STATE_PENDING})
+            if state["state"] != STATE_EXTRACTED:
+                state["state"] = STATE_UPLOADED
+            state["remote_name"] = record.get("remote_name")
+            state["expiration_time"] = record.get("expiration_time")
+            state["key_id"] = record.get("key_id")
+        elif event == "extracted":
+            batch_id = record["batch"]
+            self._batches[batch_id] = {
+                "images": record["images"],
+                "result": record["result"],
+            }
+            for key in record["images"]:
+                state = self._images.setdefault(key, {"state": STATE_PENDING})
+                state["state"] = STATE_EXTRACTED
+                state["batch"] = batch_id
+        elif event == "deleted":
+            for key in record["images"]:
+                state = self._images.get(key)
+                if state is not None:
+                    state.pop("remote_name", None)
+                    state.pop("expiration_time", None)
+                    state.pop("key_id", None)
+        elif event == "done":
+            self.completed = True
+            self.output_path = record.get("output_path")
+
+    def _append(self, record: dict):
+        with self._lock:
+            self._append_locked(record)
+
+    def _append_locked(self, record: dict):
+        record["ts"] = datetime.now(timezone.utc).isoformat()
+        line = json.dumps(record, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._apply(record)
+
+    def record_upload(self, key: str, remote_file, key_id: Optional[str] = None):
+        """アップロード完了を記録する（key_id はアップロードに使ったAPIキー）"""
+        self._append(
+            {
+                "event": "uploaded",
+                "image": key,
+                "remote_name": getattr(remote_file, "name", None),
+                "expiration_time": to_iso(
+                    getattr(remote_file, "expiration_time", None)
+                ),
+                "key_id": key_id,
+            }
+        )
+
+    def record_extracted(self, keys: list[str], result: list):
+        """バッチの抽出結果を記録する（複数のスレッドから呼んでよい）"""
+        with self._lock:
+            batch_id = max(self._batches, default=-1) + 1
+            self._append_locked(
+                {
+                    "event": "extracted",
+                    "batch": batch_id,
+                    "images": keys,
+                    "result": result,
+                }
+            )
+
+    def record_deleted(self, keys: list[str]):
+        """リモートファイルの削除を記録する"""
+        self._append({"event": "deleted", "images": keys})
+
+    def record_done(self, output_path):
+        """スライド生成・保存の完了を記録する"""
+        self._append({"event": "done", "output_path": str(output_path)})
+
+    def state(self, key: str) -> str:
+        return self._images.get(key, {}).get("state", STATE_PENDING)
+
+    def is_extracted(self, key: str) -> bool:
+        return self.state(key) == STATE_EXTRACTED
+
+    def remote_name(self, key: str) -> Optional[str]:
+        """再利用可能なリモートファイル名を返す（期限切れ・削除済みならNone）"""
+        state = self._images.get(key)
+        if not state or state["state"] != STATE_UPLOADED:
+            return None
+        name = state.get("remote_name")
+        if not name or expires_soon(state.get("expiration_time")):
+            return None
+        return name
+
+    def leftover_uploads(self) -> list[tuple[str, Optional[str]]]:
+        """削除が記録されていないリモートファイルの (ファイル名, キーID) の一覧"""
+        return [
+            (state["remote_name"], state.get("key_id"))
+            for state in self._images.values()
+            if state.get("remote_name")
+        ]
+
+    def remote_key_id(self, key: str) -> Optional[str]:
+        """リモートファイルをアップロードしたAPIキーのID"""
+        return self._images.get(key, {}).get("key_id")
+
+    def batch_result(self, key: str) -> Optional[list]:
+        """画像を含むバッチの抽出結果（未抽出ならNone）"""
+        batch_id = self._images.get(key, {}).get("batch")
+        if batch_id is None:
+            return None
+        return self._batches[batch_id]["result"]
+
+    def results(self, keys: list[str]) -> list:
+        """指定した画像順に抽出結果を連結して返す（同一バッチは1回だけ）"""
+        return [figure for figure, _ in self.results_with_sources(keys)]
+
+    def results_with_sources(self, keys: list[str]) -> list[tuple[dict, list[str]]]:
+        """results と同じ順に、(図, その図を抽出したバッチの画像のキー) を返す"""
+        seen = set()
+        merged = []
+        for key in keys:
+            batch_id = self._images.get(key, {}).get("batch")
+            if batch_id is None or batch_id in seen:
+                continue
+            seen.add(batch_id)
+            batch = self._batches[batch_id]
+            merged.extend((figure, batch["images"]) for figure in batch["result"])
+        return merged
@@ -0,0 +1,202 @@
+# 複数APIキーのプールとキーごとのクォータスケジューリング
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# レート制限の集計期間（秒）
+WINDOW_SECONDS = 60.0
+
+
+class ApiKey:
+    """1つのAPIキー（とそのキーで使うモデル）の利用状況"""
+
+    def __init__(self, key_id: str, api_key: str, model=None, rpm=0, tpm=0):
+        self.key_id = key_id
+        self.api_key = api_key
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests: deque[float] = deque()
+        self._tokens: deque[list] = deque()  # [timestamp, tokens]
+
+    def _expire(self, now: float):
+        while self._requests and now - self._requests[0] >= WINDOW_SECONDS:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= WINDOW_SECONDS:
+            self._tokens.popleft()
+
+    def used_tokens(self) -> int:
+        return sum(tokens for _, tokens in self._tokens)
+
+    def headroom(self, now: float) -> float:
+        """残り容量の割合（0.0〜1.0、無制限の項目は1.0として扱う）"""
+        self._expire(now)
+        ratios = [1.0]
+        if self.rpm > 0:
+            ratios.append(1.0 - len(self._requests) / self.rpm)
+        if self.tpm > 0:
+            ratios.append(1.0 - self.used_tokens() / self.tpm)
+        return max(0.0, min(ratios))
+
+    def can_accept(self, now: float, tokens: int) -> bool:
+        self._expire(now)
+        if self.rpm > 0 and len(self._requests) >= self.rpm:
+            return False
+        if self.tpm > 0 and self._tokens and self.used_tokens() + tokens > self.tpm:
+            return False
+        return True
+
+    def next_release(self, now: float) -> float:
+        """容量が空くまでの待ち時間（秒）"""
+        candidates = []
+        if self._requests:
+            candidates.append(self._requests[0])
+        if self._tokens:
+            candidates.append(self._tokens[0][0])
+        if not candidates:
+            return 0.0
+        return max(0.0, min(candidates) + WINDOW_SECONDS - now)
+
+
+class KeyPool:
+    """残り容量が最も大きいキーにリクエストを割り当てる
+
+    Files API でアップロードしたファイルはアップロードしたキーでしか
+    使えないため、ファイル名とキーの対応（アフィニティ）を保持する。
+    """
+
+    def __init__(
+        self,
+        keys: list[ApiKey],
+        client_factory: Callable[[str], object],
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not keys:
+            raise ValueError("APIキーが1つも設定されていません")
+        self.keys = {key.key_id: key for key in keys}
+        self.client_factory = client_factory
+        self.clock = clock
+        self._clients: dict[str, object] = {}
+        self._affinity: dict[str, str] = {}
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_config(cls, config_ini, client_factory):
+        """[GEMINI] api_keys（カンマ区切り、`キー@モデル` でモデル指定可）から作成する
+
+        api_keys が未設定の場合は api_key の1つだけを使う。
+        """
+        from config import Settings
+
+        return cls.from_settings(
+            Settings.from_config(config_ini).gemini, client_factory
+        )
+
+    @classmethod
+    def from_settings(cls, gemini_settings, client_factory):
+        """検証済みの GeminiSettings から作成する"""
+        entries = list(gemini_settings.api_keys)
+        if not entries and gemini_settings.api_key:
+            entries = [gemini_settings.api_key]
+        rpm = gemini_settings.rpm_limit
+        tpm = gemini_settings.tpm_limit
+        keys = []
+        for index, entry in enumerate(entries):
+            api_key, _, model = entry.partition("@")
+            keys.append(
+                ApiKey(f"key{index}", api_key.strip(), model.strip() or None, rpm, tpm)
+            )
+        return cls(keys, client_factory)
+
+    def set_limits(self, rpm: int, tpm: int):
+        """すべてのキーの RPM/TPM 上限を変更する（設定の再読み込み用）"""
+        with self._cond:
+            for key in self.keys.values():
+                key.rpm = rpm
+                key.tpm = tpm
+            self._cond.notify_all()
+
+    def client(self, key_id: str):
+        """キーごとのクライアント（使い回す）"""
+        with self._cond:
+            if key_id not in self._clients:
+                self._clients[key_id] = self.client_factory(self.keys[key_id].api_key)
+            return self._clients[key_id]
+
+    def model_for(self, key_id: str, default: str) -> str:
+        return self.keys[key_id].model or default
+
+    def acquire(self, tokens: int = 0, key_id: Optional[str] = None) -> str:
+        """リクエスト1回分の枠を確保してキーIDを返す（空くまで待つ）
+
+        Args:
+            tokens: 見積もりトークン数（TPMの予約に使う）
+            key_id: アフィニティのあるキー。Noneの場合は最も余裕のあるキーを選ぶ
+        """
+        with self._cond:
+            while True:
+                chosen = self._reserve(tokens, key_id)
+                if chosen is not None:
+                    return chosen
+                now = self.clock()
+                candidates = [self.keys[key_id]] if key_id else list(self.keys.values())
+                wait = min(key.next_release(now) for key in candidates)
+                logger.info("APIキーのレート制限待ち: %.1f 秒", wait)
+                # 他スレッドの記録で早く空く場合もあるため最大1秒ごとに再評価する
+                self._cond.wait(timeout=min(max(wait, 0.05), 1.0))
+
+    def try_acquire(self, tokens: int = 0, key_id: Optional[str] = None):
+        """acquire と同じだが、すぐに枠を確保できない場合は待たずにNoneを返す"""
+        with self._cond:
+            return self._reserve(tokens, key_id)
+
+    def _reserve(self, tokens: int, key_id: Optional[str]) -> Optional[str]:
+        now = self.clock()
+        candidates = [self.keys[key_id]] if key_id else list(self.keys.values())
+        ready = [key for key in candidates if key.can_accept(now, tokens)]
+        if not ready:
+            return None
+        # 余裕が同じ場合は直近のリクエスト数が少ないキーを優先する
+        chosen = max(ready, key=lambda key: (key.headroom(now), -len(key._requests)))
+        chosen._requests.append(now)
+        if tokens:
+            chosen._tokens.append([now, tokens])
+        return chosen.key_id
+
+    def record_tokens(self, key_id: str, actual: int, reserved: int = 0):
+        """実際に消費したトークン数を記録する（予約分との差分を反映）"""
+        delta = (actual or 0) - reserved
+        if not delta:
+            return
+        with self._cond:
+            self.keys[key_id]._tokens.append([self.clock(), delta])
+            self._cond.notify_all()
+
+    def bind(self, file_name: str, key_id: str):
+        with self._cond:
+            self._affinity[file_name] = key_id
+
+    def key_for_file(self, file_name: str) -> Optional[str]:
+        with self._cond:
+            return self._affinity.get(file_name)
+
+    def key_for_files(self, files) -> Optional[str]:
+        """ファイル群が属するキーを返す（複数のキーにまたがる場合はValueError）"""
+        key_ids = {self.key_for_file(getattr(f, "name", None)) for f in files}
+        key_ids.discard(None)
+        if len(key_ids) > 1:
+            raise ValueError(
+                "異なるAPIキーでアップロードされたファイルが混在しています"
+            )
+        return key_ids.pop() if key_ids else None
+
+    def forget(self, file_name: str):
+        with self._cond:
+            self._affinity.pop(file_name, None)
@@ -0,0 +1,34 @@
+# 重いモジュールを初回アクセス時にimportするためのプロキシ
+import importlib
+import threading
+
+
+class LazyModule:
+    """属性に初めてアクセスしたときにモジュールをimportするプロキシ
+
+    起動時間を短くするため、google.genai や PIL などの重いモジュールは
+    実際に使われるまでimportしない。属性を代入した場合はプロキシ自身に
+    保持されるため、unittest.mock.patch による差し替えもそのまま動作する。
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<LazyModule {self.__dict__['_name']!r} ({state})>"
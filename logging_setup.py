@@ -0,0 +1,101 @@
+# キュー経由の非同期ログ出力（ファイルのローテーション・JSON形式に対応）
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+from tracing import TraceContextFilter
+
+# 実行中のリスナー（再設定時・終了時に停止する）
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON形式で出力する"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        # 実行中のログには実行IDとスパンIDを付ける（TraceContextFilter）
+        for name in ("trace_id", "span_id"):
+            value = getattr(record, name, "-")
+            if value != "-":
+                entry[name] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def create_file_handler(settings) -> logging.Handler:
+    """設定に応じたファイルハンドラ（ローテーションあり/なし）を作成する"""
+    if settings.rotation == "size":
+        return logging.handlers.RotatingFileHandler(
+            settings.log_file,
+            maxBytes=settings.max_bytes,
+            backupCount=settings.backup_count,
+            encoding=settings.encoding,
+        )
+    if settings.rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            settings.log_file,
+            when=settings.when,
+            backupCount=settings.backup_count,
+            encoding=settings.encoding,
+        )
+    return logging.FileHandler(settings.log_file, encoding=settings.encoding)
+
+
+def configure_logging(settings) -> logging.handlers.QueueListener:
+    """ルートロガーにQueueHandlerを設定し、出力はリスナーのスレッドで行う
+
+    ワーカースレッドはキューに積むだけなので、ファイルI/Oで待たされない。
+    プロセス終了時にリスナーを停止し、残ったログを書き出す。
+
+    Args:
+        settings: LoggingSettings
+    """
+    global _listener
+    shutdown_logging()
+
+    formatter = JsonFormatter() if settings.json else logging.Formatter(settings.format)
+    handlers = [create_file_handler(settings), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # 実行IDとスパンIDはログを出したスレッドで付ける（リスナーのスレッドでは分からない）
+    queue_handler.addFilter(TraceContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(settings.level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """リスナーを停止してキューに残ったログを書き出す"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
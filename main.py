@@ -2,89 +2,1505 @@ import json
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
-from PIL import Image, ImageTk
-from google import genai
-from google.genai import types
-from pydantic import BaseModel
-from config import config_ini
+from config import config_ini, Settings, SettingsError, SettingsWatcher
 import logging
-from get_prompt import get_system_instructions
-from concurrent.futures import ThreadPoolExecutor
-from pptx import Presentation
-from pptx.util import Inches, Pt
+import os
+import sys
+import threading
+import time
+from get_prompt import get_instruction_mtime, get_system_instructions
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
 from math import ceil, floor
 from datetime import datetime
-
-# ロギング設定
-output_file = config_ini.get("LOGGING", "log_file", fallback="app.log")
-encoding = config_ini.get("LOGGING", "encoding", fallback="utf-8")
-level_name = config_ini.get("LOGGING", "log-level", fallback="INFO").upper()
-level = getattr(logging, level_name, logging.INFO)
-log_format = config_ini.get(
-    "LOGGING",
-    "format",
-    fallback="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+import argparse
+import tempfile
+from journal import RunJournal, image_key
+from keypool import KeyPool
+from lazy_import import LazyModule
+from prompt_cache import shared_prompt_cache
+from image_registry import ImageRegistry
+import image_cache
+import pages
+import profiling
+import tracing
+from results_store import (
+    SOURCE_FIELD,
+    append_results,
+    deck_path,
+    failures_path,
+    iter_records,
+    read_results,
+    read_sources,
+    sidecar_path,
+    with_sources,
+    write_results,
 )
+from hedging import HedgeBudget, LatencyTracker, hedged_call
+from cascade import CascadeStats
+from backends import ExtractionCancelled, create_backend
+from job_queue import STATUS_FAILED, DeckQueue, image_size
+from upload_prefetch import UploadPrefetcher
+from session import RemoteHandle, SessionStore
+
+# 重いモジュールは初回使用時にimportする（起動時間短縮のため）
+genai = LazyModule("google.genai")
+types = LazyModule("google.genai.types")
+ImageTk = LazyModule("PIL.ImageTk")
+
+
+def Presentation(pptx=None):
+    """python-pptx の Presentation を遅延importして作成する"""
+    from pptx import Presentation as _Presentation
+
+    return _Presentation(pptx)
 
-# ルートロガーの設定
-logging.basicConfig(
-    level=level,  # ここが重要：ルートロガーのレベルを設定
-    format=log_format,
-    handlers=[
-        logging.FileHandler(output_file, encoding=encoding),
-        logging.StreamHandler(),
-    ],
-)
 
 logger = logging.getLogger(__name__)
 
 # このファイル（main.py）がある場所を取得
 BASE_DIR = Path(__file__).resolve().parent
 
+# 画像1枚あたりの入力トークン数の見積もり（TPMの予約に使用）
+IMAGE_TOKEN_ESTIMATE = 258
+# プレビューの縮小画像の大きさ
+THUMBNAIL_SIZE = (325, 325)
 
-class ImageTextboxApp:
-    def __init__(self, root, config_ini):
-        self.root = root
-        self.root.title("画像プレビューアプリケーション")
+
+class TextboxPipeline:
+    """GUIに依存しない処理本体（アップロード→テキスト抽出→スライド生成）"""
+
+    # プロセス全体で共有する入力のリソース（同時にデコードするページの枠・
+    # デコード済み画像のキャッシュ）に最後に反映した設定
+    _input_settings = None
+    _input_lock = threading.Lock()
+
+    def __init__(self, config_ini, defer_init=False, offline=False):
+        """
+        Args:
+            config_ini: 設定
+            defer_init: Trueの場合、クライアント作成とシステムプロンプトの
+                読み込みをバックグラウンドで行う（GUIの起動を待たせないため）
+            offline: Trueの場合、APIを使わない（結果ファイルからの再生成専用）
+        """
         self.config_ini = config_ini
-        self.output_dir = self.config_ini.get(
-            "PPTX_SETTINGS", "output_dir", fallback="pptx_output"
-        )
+        # 設定値は起動時に一度だけ検証・型変換する（不正な値はここでValueError）
+        self._settings = Settings.from_config(config_ini)
+        self.settings_watcher = None
         # 絶対パスに変換
-        self.output_dir = BASE_DIR / self.output_dir
+        self.output_dir = BASE_DIR / self._settings.pptx.output_dir
+
+        gemini_settings = self._settings.gemini
+        self.apiKey = gemini_settings.api_key
+        # 複数キーのプール（api_keys に2つ以上のキーがある場合のみ使用）
+        self.key_pool = None
+        if gemini_settings.api_keys:
+            key_pool = KeyPool.from_settings(
+                gemini_settings, lambda api_key: genai.Client(api_key=api_key)
+            )
+            if not self.apiKey:
+                self.apiKey = next(iter(key_pool.keys.values())).api_key
+            if len(key_pool) > 1:
+                self.key_pool = key_pool
+        if not self.apiKey and not offline:
+            logger.warning(
+                "GEMINI APIキーが設定されていません。APIキーを設定してください。"
+            )
+            raise ValueError("GEMINI APIキーが設定されていません。")
+        # 複数のパイプラインで共有するクライアント（サービスモードで使用）
+        self.shared_client = None
+        # 複数のパイプラインで共有する同時リクエスト数の上限（GUIのジョブキューで使用）
+        self.request_slots = None
+        # 抽出の進捗を (抽出済みの画像数, 画像数) で通知する
+        self.on_progress = None
+        # 「開始」前に始めたアップロード（GUIで使用、なければ開始時にアップロード）
+        self.prefetcher = None
+
+        # アップロードされた画像のパスを保存
+        self.image_registry = ImageRegistry()
+        self._configure_input(self._settings.input)
+        # 直近の実行で得られた抽出結果
+        self.last_results = None
+        self.prompt_cache = shared_prompt_cache
+        self.last_cache_stats = None
+        self._cache_stats = self._empty_cache_stats()
+        # 抽出は複数のスレッドから並列に呼ばれる（カスケード・パネル・タイル）
+        self._cache_stats_lock = threading.Lock()
+        # 実行中に抽出できた図を書き足す結果ファイル（実行中以外は None）
+        self._results_stream = None
+        self._results_stream_fresh = False
+        self._results_stream_lock = threading.Lock()
+        self.last_cascade_stats = None
+        self._cascade_stats = CascadeStats()
+        # 直近の実行で失敗した画像（{"image", "stage", "error"} のリスト）
+        self.last_failures = []
+        # 停止ボタンなどから処理の中断を要求する（バッチの区切りで停止する）
+        self.cancel_event = threading.Event()
+        # 遅いリクエストの複製（ヘッジ）の待ち時間と回数の上限
+        self.latency = LatencyTracker(gemini_settings.hedge_percentile)
+        self.hedge_budget = HedgeBudget(gemini_settings.hedge_max_ratio)
+        # 出力ファイル名（GUIでは入力欄の値を使用）
+        self.output_name = ""
+
+        self.gemini_model = gemini_settings.model
+        # テキスト抽出のバックエンド（[BACKEND]、差し替える場合は上書きする）
+        self.backend = create_backend(self._settings.backend, self)
+
+        # Gemini APIクライアントとシステムプロンプトの初期化
+        self._ready = threading.Event()
+        self._generate_client = None
+        self._system_instruction = None
+        # ファイルから読み込んだシステムプロンプトは、ファイルが更新されたら読み込み直す
+        self._instruction_mtime = None
+        self._instruction_from_file = False
+        self._instruction_lock = threading.Lock()
+        if offline:
+            self._ready.set()
+        elif defer_init:
+            threading.Thread(
+                target=self._initialize, name="pipeline-init", daemon=True
+            ).start()
+        else:
+            self._initialize()
+
+    def _initialize(self):
+        try:
+            if self._generate_client is None:
+                self._generate_client = genai.Client(api_key=self.apiKey)
+            if self._system_instruction is None:
+                self._reload_system_instruction()
+        except Exception:
+            logger.exception("Geminiクライアントの初期化に失敗しました")
+        finally:
+            self._ready.set()
+
+    def _reload_system_instruction(self):
+        # 読み込み中の更新を見逃さないよう、更新時刻は読み込む前に取得する
+        self._instruction_mtime = get_instruction_mtime()
+        self._system_instruction = self._load_system_instruction()
+        self._instruction_from_file = True
+
+    def _load_system_instruction(self):
+        try:
+            return (
+                get_system_instructions()
+                or "You are a helpful assistant that extracts text from images."
+            )
+        except FileNotFoundError as fnf_error:
+            logger.exception("System instruction file error")
+            return "You are a helpful assistant that extracts text from images."
+
+    @property
+    def uploaded_images(self):
+        """処理対象の画像パス（image_registry の内容、追加した順）"""
+        return self.image_registry.paths
+
+    @uploaded_images.setter
+    def uploaded_images(self, paths):
+        self.image_registry.replace(paths)
+
+    @property
+    def settings(self):
+        """現在の設定（監視中の場合は設定ファイルの変更が反映される）"""
+        if self.settings_watcher is not None:
+            return self.settings_watcher.get()
+        return self._settings
+
+    def attach_settings_watcher(self, settings_watcher):
+        """設定ファイルの変更を自動的に反映する"""
+        self.settings_watcher = settings_watcher
+        settings_watcher.subscribe(self._on_settings_reloaded)
+
+    def _on_settings_reloaded(self, settings, config_ini):
+        previous = self._settings
+        self._settings = settings
+        self.config_ini = config_ini
+        # 呼び出し側が上書きした値（サービスのジョブごとの出力先など）はそのまま残す
+        if self.output_dir == BASE_DIR / previous.pptx.output_dir:
+            self.output_dir = BASE_DIR / settings.pptx.output_dir
+        if self.gemini_model == previous.gemini.model:
+            self.gemini_model = settings.gemini.model
+        if settings.input != previous.input:
+            self._configure_input(settings.input, reload=True)
+        if settings.backend != previous.backend:
+            self.backend = create_backend(settings.backend, self)
+        if self.key_pool is not None:
+            self.key_pool.set_limits(
+                settings.gemini.rpm_limit, settings.gemini.tpm_limit
+            )
+        self.latency.percentile = settings.gemini.hedge_percentile
+        self.hedge_budget.max_ratio = settings.gemini.hedge_max_ratio
+
+    @classmethod
+    def _configure_input(cls, input_settings, reload=False):
+        """プロセス全体の入力のリソースを設定する
+
+        最初のパイプラインと設定の再読み込み時だけ設定し、キューやサービスの
+        ジョブ用のパイプラインは設定済みのリソースを使う（実行中のジョブの
+        ページの枠を途中で置き換えないように）。
+        """
+        with cls._input_lock:
+            if cls._input_settings is not None and not reload:
+                return
+            if input_settings == cls._input_settings:
+                return
+            pages.configure(
+                pdf_dpi=input_settings.pdf_dpi,
+                max_decoded_pages=input_settings.max_decoded_pages,
+            )
+            image_cache.configure(
+                input_settings.decode_cache_mb * 1024 * 1024,
+                max_pages=input_settings.max_decoded_pages,
+            )
+            cls._input_settings = input_settings
+
+    @property
+    def generate_client(self):
+        self._ready.wait()
+        if self._generate_client is None:
+            raise ValueError("Geminiクライアントの初期化に失敗しました")
+        return self._generate_client
+
+    @generate_client.setter
+    def generate_client(self, client):
+        self._generate_client = client
+
+    @property
+    def system_instruction(self):
+        self._ready.wait()
+        if self._instruction_from_file:
+            with self._instruction_lock:
+                if get_instruction_mtime() != self._instruction_mtime:
+                    logger.info("システムプロンプトが更新されたため読み込み直します")
+                    self._reload_system_instruction()
+        return self._system_instruction
+
+    @system_instruction.setter
+    def system_instruction(self, instruction):
+        self._instruction_from_file = False
+        self._system_instruction = instruction
+
+    def set_status(self, text):
+        """進捗を通知する（GUIではステータス表示を更新）"""
+        logger.debug(text)
+
+    def get_output_name(self):
+        """出力ファイル名を返す"""
+        return self.output_name
+
+    def _request_slot(self):
+        """アップロード・抽出のリクエスト1件分の枠（上限がなければ何もしない）"""
+        if self.request_slots is None:
+            return nullcontext()
+        return self.request_slots
+
+    def _client(self):
+        """Files API用のクライアント（共有クライアントがあればそれを使う）"""
+        if self.shared_client is not None:
+            return self.shared_client
+        return genai.Client(api_key=self.apiKey)
+
+    # gemini apiのファイルAPIを使った画像のアップロード
+    def file_upload_to_gemini(self, file_paths=None, on_uploaded=None, on_failed=None):
+        """画像を並列にアップロードし、アップロードできたファイルを入力順に返す
+
+        失敗したアップロードは max_retries 回まで再試行する。on_failed を
+        指定しない場合は、アップロードできたファイルを削除してから
+        最初の例外を親関数に伝播させる。
+
+        Args:
+            file_paths: アップロードする画像のパス。Noneの場合はuploaded_imagesを使用
+            on_uploaded: 1ファイルのアップロード完了ごとに (file_path, file) で呼ばれる
+            on_failed: 再試行しても失敗したファイルごとに (file_path, 例外) で呼ばれる
+        """
+        if file_paths is None:
+            file_paths = self.uploaded_images
+        if not file_paths:
+            logger.warning("アップロードする画像がありません")
+            raise ValueError("アップロードする画像がありません")
+
+        # 並列アップロード（最大10スレッド）
+        task_list = []
+        total_files = len(file_paths)
+        max_workers = min(10, total_files or 1)
+
+        # 大きいファイルから送り始め、最後に大きなファイルだけが残らないようにする
+        order = sorted(
+            range(total_files), key=lambda i: image_size(file_paths[i]), reverse=True
+        )
+        uploaded, failed = {}, {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    tracing.wrap(self._with_retries),
+                    partial(self._upload_one, file_paths[index]),
+                    f"アップロード ({pages.display_name(file_paths[index])})",
+                ): index
+                for index in order
+            }
+            for idx, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                file_path = file_paths[index]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error("アップロードに失敗しました: %s (%s)", file_path, e)
+                    failed[index] = e
+                    if on_failed is not None:
+                        on_failed(file_path, e)
+                else:
+                    uploaded[index] = result
+                    if on_uploaded is not None:
+                        on_uploaded(file_path, result)
+                logger.info(f"Uploaded {idx}/{total_files} files to Gemini")
+                self.set_status(f"アップロード中... {idx}/{total_files} files")
+
+        task_list = [uploaded[index] for index in sorted(uploaded)]
+        if failed and on_failed is None:
+            # 戻り値で返せないアップロード済みのファイルは残さない
+            self._delete_files_quietly(task_list)
+            raise failed[min(failed)]
+        logger.info(f"Total uploaded: {len(task_list)} files")
+        return task_list
+
+    def _upload_one(self, file_path):
+        """1枚の画像をアップロードする（ページ・回転した画像は正規化してPNGで送る）"""
+        with (
+            tracing.span("upload", image=pages.display_name(file_path)),
+            profiling.profile("upload"),
+            self._request_slot(),
+            image_cache.upload_source(file_path) as source,
+        ):
+            if self.key_pool is not None:
+                return self._upload_with_pool(source)
+            client = self._client()
+            return client.files.upload(file=source)
+
+    def _with_retries(self, func, description):
+        """func を実行し、失敗した場合は max_retries 回まで間隔を空けて再試行する"""
+        gemini = self.settings.gemini
+        for attempt in range(gemini.max_retries + 1):
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= gemini.max_retries:
+                    raise
+                delay = gemini.retry_backoff * 2**attempt
+                logger.warning(
+                    "%sに失敗しました。%.1f 秒後に再試行します (%d/%d): %s",
+                    description,
+                    delay,
+                    attempt + 1,
+                    gemini.max_retries,
+                    e,
+                )
+                time.sleep(delay)
+
+    def _upload_with_pool(self, file_path):
+        """最も余裕のあるキーでアップロードし、ファイルとキーを対応付ける"""
+        key_id = self.key_pool.acquire()
+        file = self.key_pool.client(key_id).files.upload(file=file_path)
+        self.key_pool.bind(file.name, key_id)
+        return file
+
+    def _delete_file(self, file_id):
+        with tracing.span("delete", file=file_id.name):
+            self._delete_remote_file(file_id)
+
+    def _delete_remote_file(self, file_id):
+        if self.key_pool is not None:
+            key_id = self.key_pool.key_for_file(file_id.name)
+            if key_id is not None:
+                self.key_pool.client(key_id).files.delete(name=file_id.name)
+                self.key_pool.forget(file_id.name)
+                return
+        client = self._client()
+        client.files.delete(name=file_id.name)
+
+    def _delete_files(self, files):
+        max_workers = min(10, len(files) or 1)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            delete = tracing.wrap(self._delete_file)
+            for idx, _ in enumerate(executor.map(delete, files), start=1):
+                logger.info(f"Deleted {idx}/{len(files)} files from Gemini")
+
+    def _delete_files_quietly(self, files):
+        """失敗した画像のリモートファイルを削除する（削除の失敗はログに記録するだけ）"""
+        for file in files:
+            try:
+                self._delete_file(file)
+            except Exception as e:
+                logger.warning(
+                    "リモートファイルを削除できませんでした: %s (%s)",
+                    getattr(file, "name", file),
+                    e,
+                )
+
+    @staticmethod
+    def _empty_cache_stats():
+        return {
+            "requests": 0,
+            "cached_requests": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+        }
+
+    def _generate_target(self, files):
+        """生成に使うクライアント・モデル・キーIDを返す
+
+        キープールを使う場合は、ファイルをアップロードしたキーで生成する。
+        """
+        if self.key_pool is None:
+            return self.generate_client, self.gemini_model, None
+        key_id = self.key_pool.key_for_files(files)
+        reserved = len(files) * IMAGE_TOKEN_ESTIMATE + len(self.system_instruction) // 4
+        key_id = self.key_pool.acquire(tokens=reserved, key_id=key_id)
+        return (
+            self.key_pool.client(key_id),
+            self.key_pool.model_for(key_id, self.gemini_model),
+            (key_id, reserved),
+        )
+
+    def extract_text(self, files, model=None, delete=True, image_paths=None):
+        """例外を親関数に伝播させる
+
+        Args:
+            files: アップロード済みのファイル
+            model: 使用するモデル（Noneの場合はバックエンドの既定）
+            delete: 抽出後にアップロード済みのファイルを削除するか
+            image_paths: files の元の画像（ローカルのバックエンドで使う）
+        """
+        with (
+            tracing.span(
+                "extract",
+                images=[pages.display_name(p) for p in image_paths or ()],
+                files=len(files),
+                model=model or "",
+                backend=self.backend.name,
+            ),
+            profiling.profile("extract"),
+        ):
+            return self._extract_text(
+                files, model=model, delete=delete, image_paths=image_paths
+            )
+
+    def _extract_text(self, files, model, delete, image_paths):
+        if not files:
+            logger.warning("テキスト抽出のためのファイルがありません")
+            raise ValueError("テキスト抽出のためのファイルがありません")
+        logger.info("Starting text extraction (%s)", self.backend.name)
+        self.set_status("テキスト抽出中...")
+
+        json_response = self.backend.extract(
+            files, image_paths=image_paths, model=model
+        )
+        # 失敗した場合は再試行できるよう、ファイルは成功してから削除する
+        if delete:
+            self._delete_files(files)
+        logger.info("Text extraction successful")
+        return json_response
+
+    def generate_with_gemini(self, files, model=None, cancel=None):
+        """Geminiで抽出して figure_token のリストを返す（GeminiBackend が使う）
+
+        Args:
+            files: アップロード済みのファイル
+            model: 使用するモデル（Noneの場合は設定のモデル）
+            cancel: セットされたら結果は不要（競争に負けた場合）。送信前なら
+                リクエストを送らず、送信済みなら結果を集計せずに
+                ExtractionCancelled を送出する
+        """
+        from pydantic import BaseModel
+
+        class figure_token(BaseModel):
+            figure_name: str
+            token: list[str]
+
+        client, target_model, reservation = self._generate_target(files)
+        if cancel is not None and cancel.is_set():
+            if reservation is not None:
+                self.key_pool.record_tokens(reservation[0], 0, reserved=reservation[1])
+            raise ExtractionCancelled(sent=False)
+        model = model or target_model
+        # システムプロンプトはキャッシュがあればそれを参照する（毎回送信しない）
+        api_key = (
+            self.key_pool.keys[reservation[0]].api_key
+            if reservation is not None
+            else self.apiKey
+        )
+        # 更新の確認は1リクエストにつき1回だけ行う
+        system_instruction = self.system_instruction
+        cache_name = self.prompt_cache.get(
+            client,
+            api_key,
+            model,
+            system_instruction,
+            ttl=self.settings.gemini.cache_ttl,
+        )
+        if cache_name is not None:
+            prompt_config = {"cached_content": cache_name}
+        else:
+            prompt_config = {"system_instruction": system_instruction}
+
+        # 試行ごとのキーの予約（最初の試行は reservation、複製は allow_hedge で確保した分）
+        reservations = deque([reservation])
+
+        def generate(timeout):
+            attempt_reservation = reservations.popleft()
+            # 期限がある場合は残り時間をHTTPのタイムアウトにする（負けた複製も終了する）
+            request_config = dict(prompt_config)
+            if timeout is not None:
+                request_config["http_options"] = types.HttpOptions(
+                    timeout=max(1, int(timeout * 1000))
+                )
+            with tracing.span("generate", model=model), self._request_slot():
+                if cancel is not None and cancel.is_set():
+                    # 枠を待つ間に競争に負けた場合は送信しない
+                    if attempt_reservation is not None:
+                        key_id, reserved = attempt_reservation
+                        self.key_pool.record_tokens(key_id, 0, reserved=reserved)
+                    raise ExtractionCancelled(sent=False)
+                started = time.monotonic()
+                response = client.models.generate_content(
+                    model=model,
+                    config=types.GenerateContentConfig(
+                        **request_config,
+                        response_mime_type="application/json",
+                        response_schema=list[figure_token],
+                    ),
+                    contents=[*files, "添付した画像について処理を行ってください。"],
+                )
+                self.latency.record(time.monotonic() - started)
+            # 負けた試行も実際に終わった時点で、使ったトークン数をキーに記録する
+            # （同期のクライアントでは送信中のリクエストを中断できないため）
+            if attempt_reservation is not None:
+                key_id, reserved = attempt_reservation
+                usage = getattr(response, "usage_metadata", None)
+                used = getattr(usage, "total_token_count", None)
+                if not isinstance(used, int):
+                    used = reserved
+                self.key_pool.record_tokens(key_id, used, reserved=reserved)
+            return response
+
+        def allow_hedge():
+            # 複製もクォータを消費するため、回数の上限とキーの空きを確認する
+            if cancel is not None and cancel.is_set():
+                return False
+            if not self.hedge_budget.try_acquire():
+                return False
+            if reservation is None:
+                reservations.append(None)
+                return True
+            key_id, reserved = reservation
+            if self.key_pool.try_acquire(reserved, key_id=key_id) is None:
+                return False
+            reservations.append((key_id, reserved))
+            return True
+
+        self.hedge_budget.on_request()
+        response = hedged_call(
+            # 複製のリクエストも同じ抽出のスパンの中に記録する
+            tracing.wrap(generate),
+            deadline=self.settings.gemini.request_timeout,
+            hedge_delay=self.latency.delay(),
+            allow_hedge=allow_hedge,
+        )
+        if cancel is not None and cancel.is_set():
+            # 競争に負けた結果は使わないため、キャッシュの集計にも含めない
+            raise ExtractionCancelled(sent=True)
+        prompt_tokens, cached_tokens = self.prompt_cache.record_usage(
+            response, cached=cache_name is not None
+        )
+        with self._cache_stats_lock:
+            self._cache_stats["requests"] += 1
+            self._cache_stats["cached_requests"] += cache_name is not None
+            self._cache_stats["prompt_tokens"] += prompt_tokens
+            self._cache_stats["cached_tokens"] += cached_tokens
+
+        # None または text欠如を検出
+        if not response or getattr(response, "text", None) is None:
+            raise ValueError("No response text received from Gemini API")
+
+        # 空文字列を検出
+        if not response.text:
+            raise ValueError("Empty response text received from Gemini API")
+
+        return json.loads(response.text)  # 例外はここで発生（親に伝播）
+
+    def generate_pptx(self, gemini_response, output_path=None, append=False):
+        """抽出結果からスライドを作成して保存する
+
+        Args:
+            gemini_response: 図ごとの figure_name / token の辞書のリスト
+            output_path: 保存先。Noneの場合は出力ファイル名から決める
+            append: Trueの場合、保存先のPPTXが既にあればその末尾にスライドを追加する
+        """
+        with (
+            tracing.span("generate_pptx", figures=len(gemini_response)),
+            profiling.memory("generate_pptx"),
+        ):
+            return self._generate_pptx(gemini_response, output_path, append)
+
+    def _generate_pptx(self, gemini_response, output_path, append):
+        from pptx.util import Inches, Pt
+
+        if output_path is None:
+            output_path = self._resolve_output_path()
+        output_path = Path(output_path)
+        append = append and output_path.exists()
+        # 追記の場合は既存のデッキを開く（既存スライドの画像などはそのまま書き戻される）
+        prs = Presentation(str(output_path)) if append else Presentation()
+        # 設定値（検証済み・型変換済み）
+        layout = self.settings.pptx
+        font_name = layout.font_name
+        font_size = layout.font_size
+        layout_num = layout.layout_num
+        char_width_in = layout.char_width_in
+        min_w_in = layout.min_w_in
+        min_h_in = layout.min_h_in
+        wrap_padding_in = layout.wrap_padding_in
+
+        # Heading box (single full-width box at the top)
+        margin_l = layout.margin_l
+        margin_r = layout.margin_r
+        margin_t = layout.margin_t
+        margin_b = layout.margin_b
+        heading_h = layout.heading_h
+        line_height_in = layout.line_height_in
+
+        def add_token_grid_slide(prs, title, token_list, cols=4):
+            layouts = prs.slide_layouts
+            idx = layout_num if 0 <= layout_num < len(layouts) else 6
+
+            slide = prs.slides.add_slide(layouts[idx])  # blank layout
+
+            # Page geometry
+            page_w = prs.slide_width / 914400.0  # EMU -> inches
+            page_h = prs.slide_height / 914400.0
+
+            # Title
+            title_box = slide.shapes.add_textbox(
+                Inches(margin_l),
+                Inches(margin_t - 0.1),
+                Inches(page_w - margin_l - margin_r),
+                Inches(heading_h),
+            )
+            tf = title_box.text_frame
+            tf.clear()
+            p = tf.paragraphs[0]
+            run = p.add_run()
+            run.text = f"Tokens from panel {title}"
+            run.font.size = Pt(font_size)
+
+            # Grid region
+            grid_top = margin_t + heading_h + 0.1
+            grid_left = margin_l
+            grid_w = page_w - margin_l - margin_r
+            grid_h = page_h - grid_top - margin_b
+
+            n = len(token_list)
+            rows = ceil(n / cols) if n else 1
+            cell_w_in = grid_w / cols
+            cell_h_in = grid_h / rows
+
+            for idx, token in enumerate(token_list):
+                r = idx // cols
+                c = idx % cols
+
+                # Size optimization rules
+                w_in = max(
+                    min_w_in,
+                    min(cell_w_in, char_width_in * len(token) + wrap_padding_in),
+                )
+                max_chars = max(1, floor((w_in - wrap_padding_in) / char_width_in))
+                lines = max(1, ceil(len(token) / max_chars))
+                h_in = max(min_h_in, min(0.9 * cell_h_in, lines * line_height_in))
+
+                # Position within the cell (top-left, with small padding)
+                cell_x = grid_left + c * cell_w_in
+                cell_y = grid_top + r * cell_h_in
+                pad = 0.05
+                left = cell_x + pad
+                top = cell_y + pad
+
+                box = slide.shapes.add_textbox(
+                    Inches(left), Inches(top), Inches(w_in), Inches(h_in)
+                )
+                tf = box.text_frame
+                tf.clear()  # required by spec
+                tf.word_wrap = True
+                p = tf.paragraphs[0]
+                run = p.add_run()
+                run.text = token
+                run.font.name = font_name
+                run.font.size = Pt(font_size)
+
+            return slide
+
+        with profiling.profile("layout"):
+            for figure in gemini_response:
+                add_token_grid_slide(
+                    prs,
+                    figure.get("figure_name", "Unknown"),
+                    figure.get("token", []),
+                    cols=4,
+                )
+
+        # 保存
+        try:
+            with profiling.profile("save"):
+                if append:
+                    # 保存に失敗しても既存のデッキが壊れないよう、一時ファイルから置き換える
+                    temp_path = output_path.with_name(output_path.name + ".tmp")
+                    prs.save(temp_path)
+                    os.replace(temp_path, output_path)
+                    logger.info(
+                        "PPTXファイルに %d 枚のスライドを追加しました: %s",
+                        len(gemini_response),
+                        output_path,
+                    )
+                else:
+                    prs.save(output_path)
+                    logger.info("PPTXファイルを保存しました: %s", output_path)
+        except Exception:
+            logger.exception("PPTXファイルの保存中にエラーが発生しました")
+            raise
+
+        return output_path
+
+    def _safe_stem(self):
+        """入力されたファイル名からディレクトリ成分を除いたベース名を返す"""
+        safe_name = self.get_output_name().strip()
+        if not safe_name:
+            return ""
+        # パストラバーサル対策: ベース名のみを使用
+        safe_stem = Path(safe_name).stem
+        return Path(safe_stem).name  # ディレクトリ分を除去
+
+    def _resolve_output_path(self):
+        """保存先のPPTXパスを決定し、出力ディレクトリ配下であることを検証する"""
+        safe_basename = self._safe_stem()
+        if not safe_basename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            pptx_filename = f"output_{timestamp}.pptx"
+        else:
+            pptx_filename = f"{safe_basename}.pptx"
+
+        output_path = self.output_dir / pptx_filename
+
+        # 出力ディレクトリを確実に作成
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # パストラバーサル検証
+        try:
+            output_path.resolve().relative_to(self.output_dir.resolve())
+        except ValueError:
+            logger.exception("パストラバーサルの試行を検出しました")
+            raise ValueError("無効なファイル名が指定されました")
+
+        return output_path
+
+    def _key_id_for(self, file):
+        """リモートファイルをアップロードしたキーのID（キープール未使用時はNone）"""
+        if self.key_pool is None:
+            return None
+        return self.key_pool.key_for_file(getattr(file, "name", None))
+
+    def _journal_path(self):
+        """ファイル名ごとのジャーナルのパス（未入力時は共通名）"""
+        return self.output_dir / f"{self._safe_stem() or 'output'}.journal.jsonl"
+
+    def extracted_images(self, file_paths):
+        """ジャーナルに抽出結果が記録されている画像だけを返す（再開してもAPIを呼ばない画像）"""
+        journal_path = self._journal_path()
+        if not journal_path.exists():
+            return []
+        journal = RunJournal(journal_path, resume=True)
+        extracted = []
+        for file_path in file_paths:
+            try:
+                key = image_key(file_path)
+            except OSError:
+                continue
+            if journal.is_extracted(key):
+                extracted.append(file_path)
+        return extracted
+
+    def _delete_leftover_uploads(self, journal):
+        """ジャーナルに記録されたまま削除されていないリモートファイルを削除する"""
+        leftovers = journal.leftover_uploads()
+        for remote_name, key_id in leftovers:
+            try:
+                if self.key_pool is not None and key_id in self.key_pool.keys:
+                    client = self.key_pool.client(key_id)
+                else:
+                    client = self._client()
+                client.files.delete(name=remote_name)
+            except Exception as e:
+                # 期限切れで既に消えている場合など
+                logger.debug(
+                    "リモートファイルを削除できませんでした: %s (%s)", remote_name, e
+                )
+        if leftovers:
+            logger.info(
+                "前回の実行のアップロードを削除しました: %d files", len(leftovers)
+            )
+
+    def _check_cancelled(self):
+        """停止が要求されていれば PipelineCancelled を送出する（進捗はジャーナルに残る）"""
+        if self.cancel_event.is_set():
+            raise PipelineCancelled("処理を停止しました")
+
+    def _get_remote_file(self, remote_name, key_id=None):
+        """アップロード済みのリモートファイルを取得する（キープールではキーと対応付ける）"""
+        if self.key_pool is not None:
+            client = self.key_pool.client(key_id)
+        else:
+            client = self._client()
+        file = client.files.get(name=remote_name)
+        if self.key_pool is not None:
+            self.key_pool.bind(file.name, key_id)
+        return file
+
+    def _reuse_remote_files(self, journal, file_paths, keys):
+        """ジャーナルに記録された有効なリモートファイルを取得する"""
+        reused = {}
+        for file_path in file_paths:
+            remote_name = journal.remote_name(keys[file_path])
+            if not remote_name:
+                continue
+            key_id = journal.remote_key_id(keys[file_path])
+            if self.key_pool is not None and key_id not in self.key_pool.keys:
+                # アップロードしたキーが設定から外れている場合は再アップロード
+                continue
+            try:
+                reused[file_path] = self._get_remote_file(remote_name, key_id)
+                logger.info("アップロード済みファイルを再利用します: %s", remote_name)
+            except Exception:
+                logger.warning("リモートファイルを再利用できません: %s", remote_name)
+        return reused
+
+    def _near_duplicate_aliases(self, file_paths):
+        """近似重複の画像と代表の対応 {重複画像: 代表} を返す"""
+        dedupe = self.settings.dedupe
+        if not dedupe.enabled or len(file_paths) < 2:
+            return {}
+        from near_duplicates import cluster_near_duplicates
+
+        clusters = cluster_near_duplicates(
+            file_paths, similarity=dedupe.similarity, hash_size=dedupe.hash_size
+        )
+        aliases = {
+            duplicate: cluster[0] for cluster in clusters for duplicate in cluster[1:]
+        }
+        if aliases:
+            logger.info(
+                "近似重複: %d files の抽出を省略します（%d クラスタ）",
+                len(aliases),
+                sum(1 for cluster in clusters if len(cluster) > 1),
+            )
+        return aliases
+
+    def _extract_cascaded(self, files, image_paths):
+        """カスケードが有効な場合は高速なモデルで抽出し、疑わしい結果だけ抽出し直す
+
+        Args:
+            files: アップロード済みのファイル
+            image_paths: files の元の画像（結果の判定に使う）
+        """
+        settings = self.settings.cascade
+        if not settings.enabled:
+            return self.extract_text(files, image_paths=image_paths)
+        from cascade import escalation_reasons
+
+        started = time.monotonic()
+        try:
+            result = self.extract_text(
+                files, model=settings.model, delete=False, image_paths=image_paths
+            )
+            reasons = escalation_reasons(
+                result,
+                image_paths,
+                max_unclassified_ratio=settings.max_unclassified_ratio,
+                tokens_per_complexity=settings.tokens_per_complexity,
+            )
+        except Exception as e:
+            reasons = [f"高速なモデルでの抽出に失敗しました: {e}"]
+        fast_seconds = time.monotonic() - started
+        if not reasons:
+            self._delete_files(files)
+            self._cascade_stats.record(len(image_paths), fast_seconds, None)
+            return result
+
+        logger.info(
+            "通常のモデルで抽出し直します: %s (%s)",
+            ", ".join(pages.display_name(p) for p in image_paths),
+            "; ".join(reasons),
+        )
+        started = time.monotonic()
+        result = self.extract_text(files, image_paths=image_paths)
+        self._cascade_stats.record(
+            len(image_paths), fast_seconds, time.monotonic() - started
+        )
+        return result
+
+    def _extract_panel_images(self, journal, keys, file_paths):
+        """パネルに分割できる画像をパネルごとに抽出し、残りの画像を返す
+
+        パネル画像はそれぞれ別のリクエストとして並列に抽出し、
+        元の画像1枚分の結果（パネルごとに1つの図）としてジャーナルに記録する。
+        """
+        settings = self.settings.panels
+        if not settings.enabled or not file_paths:
+            return file_paths
+        from panels import combine_panel_results, split_panels
+
+        return self._extract_split_images(
+            journal,
+            keys,
+            file_paths,
+            lambda file_path, out_dir: split_panels(
+                file_path,
+                out_dir,
+                min_gap_ratio=settings.min_gap_ratio,
+                min_panel_ratio=settings.min_panel_ratio,
+                max_panels=settings.max_panels,
+            ),
+            combine_panel_results,
+            "パネル",
+        )
+
+    def _extract_tiled_images(self, journal, keys, file_paths):
+        """長辺が max_side を超える画像をタイルごとに抽出し、残りの画像を返す
+
+        タイルはそれぞれ別のリクエストとして並列に抽出し、重なりで重複した
+        トークンをまとめた1つの図としてジャーナルに記録する。
+        """
+        settings = self.settings.tiles
+        if not settings.enabled or not file_paths:
+            return file_paths
+        from tiles import merge_tile_results, split_tiles
+
+        return self._extract_split_images(
+            journal,
+            keys,
+            file_paths,
+            lambda file_path, out_dir: split_tiles(
+                file_path,
+                out_dir,
+                max_side=settings.max_side,
+                overlap_ratio=settings.overlap_ratio,
+                max_tiles=settings.max_tiles,
+            ),
+            merge_tile_results,
+            "タイル",
+        )
+
+    def _extract_split_images(self, journal, keys, file_paths, split, combine, kind):
+        """分割できる画像を部分ごとに並列に抽出し、残りの画像を返す
+
+        Args:
+            split: (画像, 出力先) から部分画像のパスのリストを返す関数
+                （分割しない場合は空リスト）
+            combine: (元画像の名前, 部分ごとの抽出結果) から
+                元の画像1枚分の結果を作る関数
+            kind: ログに使う部分の呼び方（「パネル」など）
+
+        部分画像のアップロードも元の画像のキーに部分の名前を付けたキーで
+        ジャーナルに記録する。途中で停止・クラッシュした場合は、再開時に
+        再利用するか、次の新規実行で削除される。
+        """
+        with tempfile.TemporaryDirectory(prefix="split_") as work_dir:
+            split_map = {}
+            for index, file_path in enumerate(file_paths):
+                self._check_cancelled()
+                crops = split(file_path, Path(work_dir) / str(index))
+                if crops:
+                    split_map[file_path] = crops
+            if not split_map:
+                return file_paths
+
+            all_crops = [crop for crops in split_map.values() for crop in crops]
+            # 分割は同じ画像から同じ部分画像を作るため、部分画像の名前で区別できる
+            crop_keys = {
+                crop: f"{keys[file_path]}#part={Path(crop).stem}"
+                for file_path, crops in split_map.items()
+                for crop in crops
+            }
+            remote_files = self._reuse_remote_files(journal, all_crops, crop_keys)
+            to_upload = [crop for crop in all_crops if crop not in remote_files]
+
+            def on_uploaded(crop, file):
+                remote_files[crop] = file
+                journal.record_upload(
+                    crop_keys[crop], file, key_id=self._key_id_for(file)
+                )
+
+            self._check_cancelled()
+            if to_upload:
+                self.file_upload_to_gemini(
+                    to_upload, on_uploaded=on_uploaded, on_failed=lambda c, e: None
+                )
+
+            def extract_crop(crop):
+                # 停止した場合はリモートファイルを残す（ジャーナルに記録済み）
+                self._check_cancelled()
+                result = self._with_retries(
+                    lambda: self._extract_cascaded([remote_files[crop]], [crop]),
+                    f"{kind}の抽出",
+                )
+                journal.record_deleted([crop_keys[crop]])
+                return result
+
+            uploaded_crops = [crop for crop in all_crops if crop in remote_files]
+            results = {}
+            with ThreadPoolExecutor(
+                max_workers=min(10, len(uploaded_crops) or 1)
+            ) as executor:
+                futures = {
+                    executor.submit(tracing.wrap(extract_crop), crop): crop
+                    for crop in uploaded_crops
+                }
+                for future in as_completed(futures):
+                    crop = futures[future]
+                    try:
+                        results[crop] = future.result()
+                    except PipelineCancelled:
+                        continue
+                    except Exception as e:
+                        logger.warning("%sの抽出に失敗しました: %s (%s)", kind, crop, e)
+                        self._delete_files_quietly([remote_files[crop]])
+                        journal.record_deleted([crop_keys[crop]])
+            self._check_cancelled()
+
+        extracted = []
+        for file_path, image_crops in split_map.items():
+            if any(crop not in results for crop in image_crops):
+                # 失敗した部分がある画像は、分割せずに画像全体として抽出する
+                continue
+            combined = combine(
+                Path(file_path).stem, [results[crop] for crop in image_crops]
+            )
+            self._record_extracted(journal, [keys[file_path]], combined)
+            journal.record_deleted([keys[file_path]])
+            extracted.append(file_path)
+        logger.info(
+            "%s分割: %d files を %d 個の%sとして抽出しました",
+            kind,
+            len(extracted),
+            sum(len(split_map[file_path]) for file_path in extracted),
+            kind,
+        )
+        return [p for p in file_paths if p not in extracted]
+
+    def _extract_batches_in_parallel(
+        self, journal, keys, remote_files, batches, failures, on_done=None
+    ):
+        """バッチを並列に抽出する（カスケードでは1枚ずつのリクエストになるため）"""
+
+        def extract(batch):
+            self._check_cancelled()
+            self._extract_batch(journal, keys, remote_files, batch, failures)
+            if on_done is not None:
+                on_done()
+
+        with ThreadPoolExecutor(max_workers=min(10, len(batches) or 1)) as executor:
+            extract = tracing.wrap(extract)
+            futures = [executor.submit(extract, batch) for batch in batches]
+            for future in as_completed(futures):
+                future.result()
+
+    def _extract_batch(self, journal, keys, remote_files, batch, failures):
+        """バッチを抽出してジャーナルに記録する
+
+        複数枚のバッチが失敗した場合は1枚ずつに分けて抽出し直し、
+        1枚のバッチは max_retries 回まで再試行する。それでも失敗した画像は
+        failures に記録し、リモートファイルを削除して処理を続ける。
+        """
+        files = [remote_files[p] for p in batch]
+        try:
+            if len(batch) > 1:
+                result = self._extract_cascaded(files, batch)
+            else:
+                result = self._with_retries(
+                    lambda: self._extract_cascaded(files, batch),
+                    f"テキスト抽出 ({pages.display_name(batch[0])})",
+                )
+        except Exception as e:
+            if len(batch) > 1:
+                logger.warning(
+                    "バッチの抽出に失敗したため1枚ずつ抽出し直します (%d files): %s",
+                    len(batch),
+                    e,
+                )
+                for file_path in batch:
+                    self._extract_batch(
+                        journal, keys, remote_files, [file_path], failures
+                    )
+                return
+            logger.error("テキスト抽出に失敗しました: %s (%s)", batch[0], e)
+            failures[batch[0]] = ("extract", e)
+            self._delete_files_quietly(files)
+            journal.record_deleted([keys[batch[0]]])
+            return
+        batch_keys = [keys[p] for p in batch]
+        self._record_extracted(journal, batch_keys, result)
+        journal.record_deleted(batch_keys)
+
+    def run_pipeline(self, resume=False, append=False):
+        """アップロード→テキスト抽出→スライド生成を実行する
+
+        画像ごとの進捗をジャーナルに記録し、resume=True の場合は
+        抽出済みの画像をスキップし、有効なアップロード済みファイルを再利用する。
+        append=True の場合は同名のデッキが既にあれば、まだ含まれていない画像の
+        図のスライドだけをその末尾に追加する。
+        実行ごとにトレースの実行IDを割り当て、ログと（有効な場合は）トレースに記録する。
+        例外は親関数に伝播させる。
+        """
+        with tracing.run(
+            "run_pipeline",
+            output=self.get_output_name(),
+            images=len(self.image_registry),
+            resume=resume,
+            append=append,
+        ) as run:
+            logger.info("実行ID: %s", run.trace_id)
+            try:
+                return self._run_pipeline(resume, append)
+            finally:
+                self._results_stream = None
+
+    def _start_results_stream(self, journal, keys, append):
+        """抽出できた図を結果ファイルに逐次書き足す準備をする
+
+        途中で落ちても抽出済みの図が結果ファイルに残るようにする。書き足す行には
+        抽出元の画像のキーを付けない（デッキに含まれる画像と誤認されないように）。
+        キーは実行の最後に書き直すときに付ける。追記の場合は既存の行の後ろに
+        書き足し（再開前に抽出済みの図は前回の実行で書き足してある）、そうでない
+        場合は再開前に抽出済みの図から書き直す。
+        """
+        self._results_stream = sidecar_path(self._resolve_output_path())
+        self._results_stream_fresh = not append
+        if not append:
+            self._stream_results(journal.results(keys))
+
+    def _stream_results(self, figures):
+        path = self._results_stream
+        if path is None or not figures:
+            return
+        with self._results_stream_lock:
+            try:
+                if self._results_stream_fresh:
+                    write_results(path, figures)
+                    self._results_stream_fresh = False
+                else:
+                    append_results(path, figures)
+            except OSError as e:
+                # 途中経過の保存に失敗しても抽出は続ける（最後にまとめて書き直す）
+                logger.warning(
+                    "結果ファイルへの書き込みに失敗しました: %s (%s)", path, e
+                )
+
+    def _record_extracted(self, journal, keys, result):
+        """抽出結果をジャーナルに記録し、結果ファイルにも書き足す"""
+        journal.record_extracted(keys, result)
+        self._stream_results(result)
+
+    def _run_pipeline(self, resume, append):
+        images = self.uploaded_images
+        if not images:
+            logger.warning("アップロードする画像がありません")
+            raise ValueError("アップロードする画像がありません")
+        keys = {file_path: image_key(file_path) for file_path in images}
+        if append:
+            # 既にデッキに含まれる画像は抽出しない
+            known = self._deck_sources()
+            images = [p for p in images if keys[p] not in known]
+            if not images:
+                logger.info("デッキに追加する新しい画像はありません")
+                return self._resolve_output_path()
+
+        journal_path = self._journal_path()
+        if not resume and journal_path.exists():
+            # 前回の実行が残したアップロードは、ジャーナルを破棄する前に削除する
+            self._delete_leftover_uploads(RunJournal(journal_path, resume=True))
+        journal = RunJournal(journal_path, resume=resume)
+        self.cancel_event.clear()
+        # 失敗した画像 {パス: (段階, 例外)}（処理は続け、成功した画像でスライドを作る）
+        failures = {}
+        self._cache_stats = self._empty_cache_stats()
+        self._cascade_stats = CascadeStats()
+        pending = [p for p in images if not journal.is_extracted(keys[p])]
+        self._start_results_stream(journal, [keys[p] for p in images], append)
+        logger.info(
+            "処理対象: %d/%d files (抽出済み %d files)",
+            len(pending),
+            len(images),
+            len(images) - len(pending),
+        )
+
+        def report_progress():
+            if self.on_progress is not None:
+                done = sum(journal.is_extracted(keys[p]) for p in images)
+                self.on_progress(done, len(images))
+
+        report_progress()
+
+        # 近似重複の画像は代表だけを抽出し、残りは代表の結果を使う
+        aliases = self._near_duplicate_aliases(pending)
+        pending = [p for p in pending if p not in aliases]
+        representatives = set(aliases.values())
+
+        # 巨大な画像はタイルごとに、複数パネルの図はパネルごとに並列で抽出する
+        # （設定で有効な場合）
+        pending = self._extract_tiled_images(journal, keys, pending)
+        pending = self._extract_panel_images(journal, keys, pending)
+
+        if pending:
+            remote_files = self._reuse_remote_files(journal, pending, keys)
+            to_upload = [p for p in pending if p not in remote_files]
+
+            def on_uploaded(file_path, file):
+                remote_files[file_path] = file
+                journal.record_upload(
+                    keys[file_path], file, key_id=self._key_id_for(file)
+                )
+
+            if self.prefetcher is not None:
+                # 先にアップロードしておいたファイルを使う（以降の削除はジャーナルで管理）
+                for file_path, file in self.prefetcher.take(to_upload).items():
+                    on_uploaded(file_path, file)
+                to_upload = [p for p in to_upload if p not in remote_files]
+                # 近似重複・パネル分割・再利用で使わなかった先行アップロードは削除する
+                self.prefetcher.discard(list(keys))
+            if to_upload:
+
+                def on_failed(file_path, error):
+                    failures[file_path] = ("upload", error)
+
+                self.file_upload_to_gemini(
+                    to_upload, on_uploaded=on_uploaded, on_failed=on_failed
+                )
+                pending = [p for p in pending if p in remote_files]
+
+            # アップロードしたキーごとにまとめてからバッチに分割する
+            groups = {}
+            for file_path in pending:
+                key_id = self._key_id_for(remote_files[file_path])
+                groups.setdefault(key_id, []).append(file_path)
+
+            # バッチ単位で抽出（0以下の場合はキーごとに1リクエストで処理）
+            batch_size = self.settings.gemini.batch_size
+            batches = []
+            for group in groups.values():
+                # 代表の結果を重複画像に使い回すため、代表は単独で抽出する
+                batches.extend([p] for p in group if p in representatives)
+                group = [p for p in group if p not in representatives]
+                size = batch_size if batch_size > 0 else max(len(group), 1)
+                if self.settings.cascade.enabled:
+                    # カスケードでは画像ごとにモデルを選ぶため1枚ずつ抽出する
+                    size = 1
+                batches.extend(
+                    group[start : start + size] for start in range(0, len(group), size)
+                )
+            if self.settings.cascade.enabled:
+                started = time.monotonic()
+                self._extract_batches_in_parallel(
+                    journal, keys, remote_files, batches, failures, report_progress
+                )
+                self._cascade_stats.record_wall(time.monotonic() - started)
+            else:
+                for batch in batches:
+                    self._check_cancelled()
+                    self._extract_batch(journal, keys, remote_files, batch, failures)
+                    report_progress()
+
+        for duplicate, representative in aliases.items():
+            result = journal.batch_result(keys[representative])
+            if result is None:
+                failures[duplicate] = failures.get(
+                    representative, ("extract", "代表の画像を抽出できませんでした")
+                )
+                continue
+            self._record_extracted(journal, [keys[duplicate]], result)
+        if aliases:
+            report_progress()
+
+        self.last_failures = [
+            {"image": file_path, "stage": stage, "error": str(error)}
+            for file_path in images
+            if file_path in failures
+            for stage, error in [failures[file_path]]
+        ]
+        if failures:
+            logger.warning(
+                "%d/%d files の処理に失敗しました（成功した画像だけでスライドを作成します）",
+                len(failures),
+                len(images),
+            )
+        sourced = journal.results_with_sources([keys[p] for p in images])
+        gemini_response = [figure for figure, _ in sourced]
+        sources = [batch_keys for _, batch_keys in sourced]
+        if failures and not gemini_response:
+            raise ValueError(
+                f"すべての画像の処理に失敗しました: {self.last_failures[0]['error']}"
+            )
+        self.last_results = gemini_response
+        self.last_cache_stats = dict(self._cache_stats)
+        if self._cache_stats["requests"]:
+            logger.info(
+                "コンテキストキャッシュ: %d/%d リクエストで使用、"
+                "入力 %d トークン中 %d トークンをキャッシュから読み込み",
+                self._cache_stats["cached_requests"],
+                self._cache_stats["requests"],
+                self._cache_stats["prompt_tokens"],
+                self._cache_stats["cached_tokens"],
+            )
+        self.last_cascade_stats = self._cascade_stats.as_dict()
+        if self._cascade_stats.images:
+            saved = self._cascade_stats.latency_saved()
+            logger.info(
+                "カスケード抽出: %d/%d files (%.0f%%) を通常のモデルで抽出し直しました%s",
+                self._cascade_stats.escalated,
+                self._cascade_stats.images,
+                self._cascade_stats.escalated_ratio * 100,
+                "" if saved is None else f"、短縮できた時間の見積もり {saved:.1f} 秒",
+            )
+        # 抽出結果をPPTXの横に保存する（APIを呼ばずに再生成できるように）
+        output_path = self._resolve_output_path()
+        self._write_failure_report(output_path)
+        if append and output_path.exists():
+            output_path = self._append_to_deck(gemini_response, sources, output_path)
+        else:
+            output_path = self.generate_pptx(gemini_response, output_path)
+            # 逐次書き足した結果ファイルを、画像の順に抽出元のキー付きで書き直す
+            # （デッキの保存に成功してから記録する）
+            write_results(
+                sidecar_path(output_path), with_sources(gemini_response, sources)
+            )
+        journal.record_done(output_path)
+        return output_path
+
+    def _deck_sources(self):
+        """追記先のデッキに含まれる画像のキー（デッキがない場合は空）
+
+        Raises:
+            ValueError: デッキはあるが、含まれる画像を記録した結果ファイルがない場合
+        """
+        output_path = self._resolve_output_path()
+        if not output_path.exists():
+            return set()
+        results_path = sidecar_path(output_path)
+        known = read_sources(results_path) if results_path.exists() else set()
+        if not known:
+            # 判定できないまま追記すると、既存の図のスライドが重複する
+            raise ValueError(
+                f"デッキに含まれる画像の記録（{results_path.name}）がないため"
+                f"追記できません: {output_path.name}"
+            )
+        return known
+
+    def _append_to_deck(self, figures, sources, output_path):
+        """既存のデッキの末尾に図のスライドを追加し、結果ファイルにも書き足す
+
+        デッキに含まれる画像は run_pipeline で除いてあるため、figures は
+        すべて新しい画像の図。
+        """
+        if not figures:
+            logger.info("デッキに追加する新しい図はありません: %s", output_path)
+            return output_path
+        results_path = sidecar_path(output_path)
+        # 抽出元のキーがない行は、この実行（または途中で止まった実行）で
+        # 書き足した途中経過なので、デッキの既存の図には含めない
+        previous = [
+            record for record in iter_records(results_path) if SOURCE_FIELD in record
+        ]
+        # デッキの保存に成功してから記録する（失敗した図は次回も追加対象になる）
+        output_path = self.generate_pptx(figures, output_path, append=True)
+        write_results(results_path, previous + with_sources(figures, sources))
+        return output_path
+
+    def _write_failure_report(self, output_path):
+        """失敗した画像の一覧をPPTXの横に保存する（失敗がなければ古いものを削除）"""
+        report_path = failures_path(output_path)
+        if self.last_failures:
+            write_results(report_path, self.last_failures)
+            logger.warning("失敗した画像の一覧を保存しました: %s", report_path)
+        elif report_path.exists():
+            report_path.unlink()
+
+    def render_results(self, results_path, output_path=None):
+        """結果ファイルからAPIを呼ばずにスライドを作り直す
+
+        Args:
+            results_path: run_pipeline が保存した `*.results.jsonl`
+            output_path: 保存先。Noneの場合は結果ファイルの横の同名のPPTX
+        """
+        figures = read_results(results_path)
+        if not figures:
+            raise ValueError(f"結果ファイルに抽出結果がありません: {results_path}")
+        return self.generate_pptx(figures, Path(output_path or deck_path(results_path)))
+
+
+class PipelineCancelled(Exception):
+    """停止が要求されたため処理を中断した"""
 
-        self.root.geometry(
-            config_ini.get("GUI_SETTINGS", "window_size", fallback="1170x450")
-        )
 
-        self.apiKey = config_ini.get("GEMINI", "api_key", fallback="")
-        if not self.apiKey:
-            logger.warning(
-                "GEMINI APIキーが設定されていません。APIキーを設定してください。"
-            )
-            raise ValueError("GEMINI APIキーが設定されていません。")
-        # Gemini APIクライアントの初期化
-        self.generate_client = genai.Client(api_key=self.apiKey)
+class ImageTextboxApp(TextboxPipeline):
+    def __init__(self, root, config_ini, resume=False, append=False, defer_init=False):
+        self.root = root
+        self.resume_default = resume
+        self.append_default = append
+        self.root.title("画像プレビューアプリケーション")
 
-        # アップロードされた画像のパスを保存
-        self.uploaded_images = []
+        super().__init__(config_ini, defer_init=defer_init)
+        gui_settings = self._settings.gui
+        self.root.geometry(gui_settings.window_size)
 
-        self.gemini_model = config_ini.get(
-            "GEMINI", "model", fallback="gemini-2.5-flash"
+        # 開始ボタンの処理とキューのジョブで同時リクエスト数の枠を共有する
+        self.request_slots = threading.BoundedSemaphore(
+            gui_settings.max_concurrent_requests
         )
-        try:
-            self.system_instruction = (
-                get_system_instructions()
-                or "You are a helpful assistant that extracts text from images."
-            )
-        except FileNotFoundError as fnf_error:
-            logger.exception("System instruction file error")
-            self.system_instruction = (
-                "You are a helpful assistant that extracts text from images."
-            )
+        self.job_queue = DeckQueue(
+            self._create_job_pipeline,
+            max_parallel_jobs=gui_settings.max_parallel_jobs,
+            on_change=self._on_job_changed,
+        )
+        # ジョブ一覧の行とジョブIDの対応
+        self._job_ids = []
+        # ファイルを選んだ時点でアップロードを始め、「開始」では抽出だけを待つ
+        if gui_settings.prefetch_uploads:
+            self.prefetcher = UploadPrefetcher(self._upload_one, self._delete_file)
+        # 閉じるときに作業状態を保存し、次回の起動時に復元する
+        self.session_store = None
+        if gui_settings.restore_session:
+            self.session_store = SessionStore(BASE_DIR / gui_settings.session_dir)
+        # 復元した画像の保存済みの縮小画像 {パス: PNGのパス}
+        self._session_thumbnails = {}
+        # プレビューに表示済みの画像の数と、2列目を置く最後の行のフレーム
+        # （追加した画像だけを描画するため）
+        self._displayed_count = 0
+        self._preview_row = None
+        # 画像参照を保持するリスト（ガベージコレクション防止）
+        self.image_references = []
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # メインコンテナ
         self.setup_ui()
+        self._restore_session()
+
+    def set_status(self, text):
+        # ワーカースレッドからはTkのイベントループ経由で更新する
+        if threading.current_thread() is threading.main_thread():
+            self.status_display.config(text=text)
+        else:
+            self.root.after(0, lambda: self.status_display.config(text=text))
+
+    def get_output_name(self):
+        return self.file_name.get()
 
     def setup_ui(self):
         # メインコンテンツエリア（パーン分割）
@@ -121,6 +1537,16 @@ class ImageTextboxApp:
         )
         self.file_name_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
+        # 再開オプション（ジャーナルから途中経過を復元）
+        self.resume_var = tk.BooleanVar(value=self.resume_default)
+        ttk.Checkbutton(
+            left_frame, text="前回の処理を再開", variable=self.resume_var
+        ).pack(anchor=tk.W, padx=5)
+        self.append_var = tk.BooleanVar(value=self.append_default)
+        ttk.Checkbutton(
+            left_frame, text="既存のPPTXに追記", variable=self.append_var
+        ).pack(anchor=tk.W, padx=5)
+
         # モデル名表示フレーム
         model_frame = ttk.Frame(left_frame)
         model_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -174,6 +1600,32 @@ class ImageTextboxApp:
         )
         self.stop_button.pack(side=tk.LEFT, padx=2)
 
+        # 保存済みの抽出結果からスライドだけを作り直す（APIは呼ばない）
+        ttk.Button(
+            left_frame, text="結果から再生成", command=self.on_render_results
+        ).pack(fill=tk.X, padx=5, pady=(0, 5))
+
+        # ジョブキュー（複数のデッキを優先度順に処理する）
+        queue_frame = ttk.LabelFrame(left_frame, text="ジョブキュー", padding=5)
+        queue_frame.pack(fill=tk.BOTH, padx=5, pady=5)
+
+        queue_control = ttk.Frame(queue_frame)
+        queue_control.pack(fill=tk.X)
+        ttk.Label(queue_control, text="優先度:").pack(side=tk.LEFT, padx=(0, 5))
+        self.priority_var = tk.IntVar(value=0)
+        ttk.Spinbox(
+            queue_control, from_=0, to=9, width=4, textvariable=self.priority_var
+        ).pack(side=tk.LEFT)
+        ttk.Button(queue_control, text="キューに追加", command=self.on_enqueue).pack(
+            side=tk.LEFT, fill=tk.X, expand=True, padx=2
+        )
+        ttk.Button(queue_control, text="取消", command=self.on_cancel_job).pack(
+            side=tk.LEFT, fill=tk.X, expand=True
+        )
+
+        self.job_listbox = tk.Listbox(queue_frame, height=4)
+        self.job_listbox.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+
         # ステータス表示フレーム
         status_frame = ttk.LabelFrame(left_frame, text="ステータス", padding=5)
         status_frame.pack(
@@ -265,35 +1717,47 @@ class ImageTextboxApp:
         file_paths = filedialog.askopenfilenames(
             title="ファイルを選択",
             filetypes=[
+                ("画像・PDF・TIFF", "*.jpg *.jpeg *.png *.pdf *.tif *.tiff"),
                 ("画像ファイル (JPEG/PNG)", "*.jpg *.jpeg *.png"),
+                ("PDF/TIFF (複数ページ)", "*.pdf *.tif *.tiff"),
             ],
         )
         if file_paths:
-            for file_path in file_paths:
-                file_name = Path(file_path).name
-                # リストボックスに追加（重複チェック）
-                if file_name not in self.file_listbox.get(0, tk.END):
-                    self.file_listbox.insert(tk.END, file_name)
-                    # 画像パスを保存
-                    self.uploaded_images.append(file_path)
-
-            self.status_display.config(
-                text=f"{len(file_paths)}個のファイルをアップロードしました"
-            )
+            # PDF・TIFFはページごとに1枚の画像として扱う（ページ数だけを読む）
+            file_paths, unreadable = pages.expand_inputs(file_paths)
+            # 同じパス・同じ内容の画像は追加しない（ファイル名が同じでも内容が違えば追加）
+            added, skipped = self.image_registry.add_many(file_paths)
+            skipped += unreadable
+            if added:
+                self.file_listbox.insert(tk.END, *(entry.name for entry in added))
+                if self.prefetcher is not None:
+                    self.prefetcher.submit([entry.path for entry in added])
+
+            message = f"{len(added)}個のファイルをアップロードしました"
+            if skipped:
+                message += f"（重複・読み込めないファイル {skipped} 個をスキップ）"
+            self.status_display.config(text=message)
 
             # 画像を表示
             self.display_images()
 
     def on_reset(self):
         """リセットボタンの処理"""
+        # 先に始めたアップロードは取り消し、完了したものはリモートから削除する
+        if self.prefetcher is not None:
+            self.prefetcher.discard()
+        self._clear_selection()
+        self.status_display.config(text="リセット完了")
+
+    def _clear_selection(self):
+        """選択中の画像と画像表示をクリアする"""
         # ファイルリストをクリア
         self.file_listbox.delete(0, tk.END)
-        self.uploaded_images.clear()
+        self.image_registry.clear()
+        self._session_thumbnails.clear()
 
         # 画像表示エリアをクリア
-        for widget in self.images_frame.winfo_children():
-            widget.destroy()
-
+        self._clear_previews()
         self.on_frame_configure()
 
         # プレースホルダーラベルを再表示
@@ -304,283 +1768,173 @@ class ImageTextboxApp:
         )
         self.placeholder_label.pack(pady=50)
 
-        self.status_display.config(text="リセット完了")
-
     def display_images(self):
-        """アップロードされた画像をすべて表示（2列レイアウト）"""
-        # プレースホルダーを削除
-        if hasattr(self, "placeholder_label"):
-            self.placeholder_label.destroy()
+        """アップロードされた画像を表示（2列レイアウト）
 
-        # 既存の画像ウィジェットをクリア
+        表示済みの画像はそのまま残し、まだ表示していない画像だけを描画する。
+        """
+        with profiling.memory("display_images"):
+            self._display_images()
+
+    def _clear_previews(self):
         for widget in self.images_frame.winfo_children():
             widget.destroy()
-
-        # 画像参照を保持するリスト（ガベージコレクション防止）
         self.image_references = []
+        self._displayed_count = 0
+        self._preview_row = None
+
+    def _display_images(self):
+        images = self.uploaded_images
+        if len(images) < self._displayed_count:
+            # 画像が減った場合だけ作り直す
+            self._clear_previews()
+        if self._displayed_count == 0:
+            # プレースホルダーを削除
+            if hasattr(self, "placeholder_label"):
+                self.placeholder_label.destroy()
+
+        for idx in range(self._displayed_count, len(images)):
+            self._display_image(idx, images[idx])
+        self._displayed_count = len(images)
+
+    def _display_image(self, idx, img_path):
+        try:
+            # 2列ごとに新しい行フレームを作成
+            if idx % 2 == 0:
+                self._preview_row = ttk.Frame(self.images_frame)
+                self._preview_row.pack(fill=tk.X, pady=5)
+
+            thumbnail = self._thumbnail(img_path)
+
+            # PhotoImageに変換
+            photo = ImageTk.PhotoImage(thumbnail)
+            self.image_references.append(photo)
+
+            # フレームを作成（2列配置）
+            img_container = ttk.Frame(self._preview_row, relief=tk.RIDGE, borderwidth=2)
+            img_container.pack(side=tk.LEFT, pady=5, padx=5, expand=True)
+
+            # ファイル名ラベル
+            name_label = ttk.Label(
+                img_container,
+                text=pages.display_name(img_path),
+                font=("Arial", 9, "bold"),
+                wraplength=330,
+            )
+            name_label.pack(pady=5, padx=5)
 
-        # 2列レイアウト用の行フレーム
-        current_row_frame = None
-
-        # 各画像を表示
-        for idx, img_path in enumerate(self.uploaded_images):
-            try:
-                # 2列ごとに新しい行フレームを作成
-                if idx % 2 == 0:
-                    current_row_frame = ttk.Frame(self.images_frame)
-                    current_row_frame.pack(fill=tk.X, pady=5)
-
-                # 画像を読み込み
-                with Image.open(img_path) as img:
-
-                    # サムネイルサイズに縮小（アスペクト比を維持）
-                    img.thumbnail((325, 325), Image.Resampling.LANCZOS)
-
-                    # PhotoImageに変換
-                    photo = ImageTk.PhotoImage(img)
-                self.image_references.append(photo)
+            # 画像ラベル
+            img_label = tk.Label(img_container, image=photo, bg="white")
+            img_label.pack(pady=5, padx=5)
 
-                # フレームを作成（2列配置）
-                img_container = ttk.Frame(
-                    current_row_frame, relief=tk.RIDGE, borderwidth=2
-                )
-                img_container.pack(side=tk.LEFT, pady=5, padx=5, expand=True)
-
-                # ファイル名ラベル
-                name_label = ttk.Label(
-                    img_container,
-                    text=Path(img_path).name,
-                    font=("Arial", 9, "bold"),
-                    wraplength=330,
-                )
-                name_label.pack(pady=5, padx=5)
+        except Exception as e:
+            # エラー時は警告を表示
+            if idx % 2 == 0:
+                self._preview_row = ttk.Frame(self.images_frame)
+                self._preview_row.pack(fill=tk.X, pady=5)
+
+            error_label = ttk.Label(
+                self._preview_row,
+                text=f"エラー: {pages.display_name(img_path)} - {str(e)}",
+                foreground="red",
+            )
+            error_label.pack(side=tk.LEFT, pady=5, padx=5)
 
-                # 画像ラベル
-                img_label = tk.Label(img_container, image=photo, bg="white")
-                img_label.pack(pady=5, padx=5)
+    def _thumbnail(self, img_path):
+        """プレビューの縮小画像（アスペクト比を維持）
 
+        復元した画像は保存済みの縮小画像を使い、元の画像を開かない。それ以外は
+        デコード結果を前処理・アップロードと共有し、画像ごとに1回だけデコードする。
+        """
+        saved = self._session_thumbnails.get(img_path)
+        if saved is not None:
+            try:
+                return self.session_store.open_thumbnail(saved)
             except Exception as e:
-                # エラー時は警告を表示
-                if idx % 2 == 0:
-                    error_row = ttk.Frame(self.images_frame)
-                    error_row.pack(fill=tk.X, pady=5)
-                    current_row_frame = error_row
-
-                error_label = ttk.Label(
-                    current_row_frame,
-                    text=f"エラー: {Path(img_path).name} - {str(e)}",
-                    foreground="red",
-                )
-                error_label.pack(side=tk.LEFT, pady=5, padx=5)
-
-    # gemini apiのファイルAPIを使った画像のアップロード
-    def file_upload_to_gemini(self):
-        """例外を親関数に伝播させる"""
-        if not self.uploaded_images:
-            logger.warning("アップロードする画像がありません")
-            raise ValueError("アップロードする画像がありません")
+                logger.debug("保存した縮小画像を読み込めません: %s (%s)", saved, e)
+                del self._session_thumbnails[img_path]
+        return image_cache.shared_image_cache.thumbnail(img_path, THUMBNAIL_SIZE)
 
-        # 並列アップロード（最大10スレッド）
-        task_list = []
-        total_files = len(self.uploaded_images)
-        max_workers = min(10, total_files or 1)
-
-        def upload_file(file_path):
-            client = genai.Client(api_key=self.apiKey)
-            return client.files.upload(file=file_path)
+    def _restore_session(self):
+        """前回の作業状態（画像一覧・出力ファイル名・縮小画像・アップロード）を復元する
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for idx, result in enumerate(
-                executor.map(upload_file, self.uploaded_images), 1
-            ):
-                task_list.append(result)
-                logger.info(f"Uploaded {idx}/{total_files} files to Gemini")
-                self.status_display.config(
-                    text=f"アップロード中... {idx}/{total_files} files"
+        元の画像は読み込まない。保存したアップロードは先行アップロードとして
+        バックグラウンドで取得し直す（取得できなければアップロードし直す）。
+        """
+        if self.session_store is None:
+            return
+        started = time.perf_counter()
+        session = self.session_store.load()
+        if session is None:
+            return
+        self.file_name.set(session.output_name)
+        if not session.images:
+            return
+        self.image_registry.restore(image.entry() for image in session.images)
+        for image in session.images:
+            thumbnail = self.session_store.thumbnail_path(image)
+            if thumbnail is not None:
+                self._session_thumbnails[image.path] = thumbnail
+            if image.remote is not None and self.prefetcher is not None:
+                self.prefetcher.adopt(
+                    image.path, partial(self._restore_upload, image.path, image.remote)
                 )
-
-        logger.info(f"Total uploaded: {len(task_list)} files")
-        return task_list
-
-    def _delete_file(self, file_id):
-        client = genai.Client(api_key=self.apiKey)
-        client.files.delete(name=file_id.name)
-
-    def extract_text(self, files):
-        """例外を親関数に伝播させる"""
-
-        class figure_token(BaseModel):
-            figure_name: str
-            token: list[str]
-
-        if not files:
-            logger.warning("テキスト抽出のためのファイルがありません")
-            raise ValueError("テキスト抽出のためのファイルがありません")
-        logger.info("Starting text extraction")
-        self.status_display.config(text="テキスト抽出中...")
-
-        response = self.generate_client.models.generate_content(
-            model=self.gemini_model,
-            config=types.GenerateContentConfig(
-                system_instruction=self.system_instruction,
-                response_mime_type="application/json",
-                response_schema=list[figure_token],
-            ),
-            contents=[*files, "添付した画像について処理を行ってください。"],
-        )
-        max_workers = min(10, len(files) or 1)
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            for idx, _ in enumerate(executor.map(self._delete_file, files), start=1):
-                logger.info(f"Deleted {idx}/{len(files)} files from Gemini")
-
-        # None または text欠如を検出
-        if not response or getattr(response, "text", None) is None:
-            raise ValueError("No response text received from Gemini API")
-
-        # 空文字列を検出
-        if not response.text:
-            raise ValueError("Empty response text received from Gemini API")
-
-        json_response = json.loads(response.text)  # 例外はここで発生（親に伝播）
-        logger.info("Text extraction successful")
-        return json_response
-
-    def generate_pptx(self, gemini_response):
-        prs = Presentation()
-        # 設定値をロード
-        font_name = self.config_ini.get("PPTX_SETTINGS", "font_name", fallback="Arial")
-        font_size = self.config_ini.getint("PPTX_SETTINGS", "font_size", fallback=14)
-        layout_num = self.config_ini.getint("PPTX_SETTINGS", "layout_num", fallback=6)
-        char_width_in = self.config_ini.getfloat(
-            "PPTX_SETTINGS", "char_width_in", fallback=0.097
+        self.file_listbox.insert(tk.END, *(entry.name for entry in self.image_registry))
+        self.display_images()
+        logger.info(
+            "前回の作業状態を復元しました: %d files (%.0f ms)",
+            len(session.images),
+            (time.perf_counter() - started) * 1000,
         )
-        min_w_in = self.config_ini.getfloat("PPTX_SETTINGS", "min_w_in", fallback=0.45)
-        min_h_in = self.config_ini.getfloat("PPTX_SETTINGS", "min_h_in", fallback=0.30)
-        wrap_padding_in = self.config_ini.getfloat(
-            "PPTX_SETTINGS", "wrap_padding_in", fallback=0.20
+        self.status_display.config(
+            text=f"前回の作業状態を復元しました（{len(session.images)}個のファイル）"
         )
 
-        # Heading box (single full-width box at the top)
-        margin_l = self.config_ini.getfloat("PPTX_SETTINGS", "margin_l", fallback=0.4)
-        margin_r = self.config_ini.getfloat("PPTX_SETTINGS", "margin_r", fallback=0.4)
-        margin_t = self.config_ini.getfloat("PPTX_SETTINGS", "margin_t", fallback=0.5)
-        margin_b = self.config_ini.getfloat("PPTX_SETTINGS", "margin_b", fallback=0.4)
-        heading_h = self.config_ini.getfloat("PPTX_SETTINGS", "heading_h", fallback=0.4)
-        line_height_in = 1.3 * (font_size / 72.0)
-
-        def add_token_grid_slide(prs, title, token_list, cols=4):
-            layouts = prs.slide_layouts
-            idx = layout_num if 0 <= layout_num < len(layouts) else 6
-
-            slide = prs.slides.add_slide(layouts[idx])  # blank layout
-
-            # Page geometry
-            page_w = prs.slide_width / 914400.0  # EMU -> inches
-            page_h = prs.slide_height / 914400.0
-
-            # Title
-            title_box = slide.shapes.add_textbox(
-                Inches(margin_l),
-                Inches(margin_t - 0.1),
-                Inches(page_w - margin_l - margin_r),
-                Inches(heading_h),
+    def _restore_upload(self, file_path, handle):
+        """保存したアップロードを取得し直す（使えない場合はアップロードし直す）"""
+        try:
+            return self._get_remote_file(handle.name, handle.key_id)
+        except Exception as e:
+            logger.info(
+                "保存したアップロードを使えないためアップロードし直します: %s (%s)",
+                handle.name,
+                e,
             )
-            tf = title_box.text_frame
-            tf.clear()
-            p = tf.paragraphs[0]
-            run = p.add_run()
-            run.text = f"Tokens from panel {title}"
-            run.font.size = Pt(font_size)
-
-            # Grid region
-            grid_top = margin_t + heading_h + 0.1
-            grid_left = margin_l
-            grid_w = page_w - margin_l - margin_r
-            grid_h = page_h - grid_top - margin_b
-
-            n = len(token_list)
-            rows = ceil(n / cols) if n else 1
-            cell_w_in = grid_w / cols
-            cell_h_in = grid_h / rows
-
-            for idx, token in enumerate(token_list):
-                r = idx // cols
-                c = idx % cols
-
-                # Size optimization rules
-                w_in = max(
-                    min_w_in,
-                    min(cell_w_in, char_width_in * len(token) + wrap_padding_in),
-                )
-                max_chars = max(1, floor((w_in - wrap_padding_in) / char_width_in))
-                lines = max(1, ceil(len(token) / max_chars))
-                h_in = max(min_h_in, min(0.9 * cell_h_in, lines * line_height_in))
-
-                # Position within the cell (top-left, with small padding)
-                cell_x = grid_left + c * cell_w_in
-                cell_y = grid_top + r * cell_h_in
-                pad = 0.05
-                left = cell_x + pad
-                top = cell_y + pad
-
-                box = slide.shapes.add_textbox(
-                    Inches(left), Inches(top), Inches(w_in), Inches(h_in)
-                )
-                tf = box.text_frame
-                tf.clear()  # required by spec
-                tf.word_wrap = True
-                p = tf.paragraphs[0]
-                run = p.add_run()
-                run.text = token
-                run.font.name = font_name
-                run.font.size = Pt(font_size)
-
-            return slide
+            return self._upload_one(file_path)
 
-        for figure in gemini_response:
-            add_token_grid_slide(
-                prs,
-                figure.get("figure_name", "Unknown"),
-                figure.get("token", []),
-                cols=4,
+    def _save_session(self):
+        """作業状態を保存する（完了した先行アップロードは削除せずに引き継ぐ）"""
+        if self.session_store is None:
+            return
+        paths = self.uploaded_images
+        uploads = {}
+        if self.prefetcher is not None:
+            uploads = self.prefetcher.detach(set(paths))
+        # デコード済みの縮小画像だけを保存する（閉じるときに画像をデコードしない）
+        thumbnails = {}
+        for path in paths:
+            thumbnail = image_cache.shared_image_cache.peek_thumbnail(
+                path, THUMBNAIL_SIZE
             )
-
-        # 保存
-        safe_name = self.file_name.get().strip()
-        if not safe_name:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            pptx_filename = f"output_{timestamp}.pptx"
-        else:
-            # パストラバーサル対策: ベース名のみを使用
-            safe_stem = Path(safe_name).stem
-            safe_basename = Path(safe_stem).name  # ディレクトリ分を除去
-            pptx_filename = f"{safe_basename}.pptx"
-
-        output_path = self.output_dir / pptx_filename
-
-        # 出力ディレクトリを確実に作成
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # パストラバーサル検証
+            if thumbnail is not None:
+                thumbnails[path] = thumbnail
         try:
-            output_path.resolve().relative_to(self.output_dir.resolve())
-        except ValueError:
-            logger.exception("パストラバーサルの試行を検出しました")
-            raise ValueError("無効なファイル名が指定されました")
-
-        try:
-            prs.save(output_path)
-            logger.info("PPTXファイルを保存しました: %s", output_path)
+            self.session_store.save(
+                self.file_name.get(),
+                list(self.image_registry),
+                uploads={
+                    path: RemoteHandle.from_file(file, self._key_id_for(file))
+                    for path, file in uploads.items()
+                },
+                thumbnails=thumbnails,
+            )
         except Exception:
-            logger.exception("PPTXファイルの保存中にエラーが発生しました")
-            raise
-
-        return output_path
+            logger.exception("作業状態を保存できませんでした")
+            self._delete_files_quietly(list(uploads.values()))
 
     def on_start(self):
         """開始ボタンの処理"""
-        if self.file_listbox.size() == 0:
+        if len(self.image_registry) == 0:
             messagebox.showwarning("警告", "ファイルをアップロードしてください")
             logger.warning(
                 "ファイルがアップロードされていません。処理を開始できません。"
@@ -591,41 +1945,375 @@ class ImageTextboxApp:
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
 
-        # ここで実際の処理を開始
+        # 処理はワーカースレッドで行い、ウィンドウの応答を保つ
+        logger.info("処理を開始しました。")
+        self._worker = threading.Thread(
+            target=self._run_in_background,
+            args=(self.resume_var.get(), self.append_var.get()),
+            daemon=True,
+        )
+        self._worker.start()
+
+    def _run_in_background(self, resume, append):
+        """ワーカースレッドでパイプラインを実行し、結果をTkのスレッドに返す"""
+        output_path, error = None, None
         try:
-            logger.info("処理を開始しました。")
             # 出力ディレクトリの存在確認
             self.output_dir.mkdir(parents=True, exist_ok=True)
-        except ValueError as ve:
-            messagebox.showerror("エラー", f"処理中にエラーが発生しました: {ve}")
-            logger.exception("ValueError during processing")
+            output_path = self.run_pipeline(resume=resume, append=append)
         except Exception as e:
+            error = e
+        # プロファイル中は実行ごとに書き出す（異常終了しても残るように）
+        profiling.flush()
+        self.root.after(0, lambda: self._on_pipeline_done(output_path, error))
+
+    def _on_pipeline_done(self, output_path, error):
+        """パイプラインの終了をTkのスレッドで処理する"""
+        if isinstance(error, PipelineCancelled):
+            logger.info("処理を停止しました")
+            messagebox.showinfo(
+                "停止",
+                "処理を停止しました。「前回の処理を再開」で続きから処理できます",
+            )
+            self.on_finish(show_message=False)
+            return
+        if isinstance(error, ValueError):
+            logger.error("ValueError during processing", exc_info=error)
+            messagebox.showerror("エラー", f"処理中にエラーが発生しました: {error}")
+        elif error is not None:
+            logger.error("Unexpected error during processing", exc_info=error)
             messagebox.showerror(
-                "エラー", f"処理中に予期しないエラーが発生しました: {e}"
+                "エラー", f"処理中に予期しないエラーが発生しました: {error}"
             )
-            logger.exception("Unexpected error during processing")
-        finally:
-            self.on_finish()
+        else:
+            logger.info("処理が完了しました: %s", output_path)
+            if self.last_failures:
+                messagebox.showwarning(
+                    "一部失敗",
+                    f"{len(self.last_failures)} 件の画像を処理できませんでした。\n"
+                    f"一覧: {failures_path(output_path)}",
+                )
+        self.on_finish()
 
     def on_stop(self):
-        """停止ボタンの処理"""
-        self.status_display.config(text="処理を停止しました")
-        self.start_button.config(state=tk.NORMAL)
+        """停止ボタンの処理（実行中のバッチが終わった時点で停止する）"""
+        self.cancel_event.set()
+        self.status_display.config(text="停止しています...")
         self.stop_button.config(state=tk.DISABLED)
 
-        # ここで実際の処理を停止
-        messagebox.showinfo("停止", "処理を停止しました")
-        self.status_display.config(text="準備完了")
+    def _create_job_pipeline(self):
+        """キューのジョブ用のパイプライン（キープール・リクエストの枠を共有する）"""
+        pipeline = TextboxPipeline(self.config_ini)
+        pipeline.output_dir = self.output_dir
+        pipeline.gemini_model = self.gemini_model
+        pipeline.key_pool = self.key_pool
+        pipeline.request_slots = self.request_slots
+        pipeline.prefetcher = self.prefetcher
+        # 購読はしない（ジョブごとに購読が増えるため）が、最新の設定は参照する
+        pipeline.settings_watcher = self.settings_watcher
+        return pipeline
+
+    def on_enqueue(self):
+        """選択中の画像とファイル名をデッキのジョブとしてキューに追加する"""
+        if len(self.image_registry) == 0:
+            messagebox.showwarning("警告", "ファイルをアップロードしてください")
+            return
+        output_name = self.file_name.get().strip()
+        if not output_name:
+            messagebox.showwarning("警告", "ファイル名を入力してください")
+            return
+        try:
+            priority = self.priority_var.get()
+        except tk.TclError:
+            messagebox.showwarning("警告", "優先度は整数で入力してください")
+            return
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            job = self.job_queue.submit(
+                output_name,
+                self.uploaded_images,
+                priority=priority,
+                resume=self.resume_var.get(),
+                append=self.append_var.get(),
+            )
+        except ValueError as e:
+            messagebox.showwarning("警告", str(e))
+            return
+        self.job_queue.start()
+        # 次のデッキの画像を選べるように選択を空にする（先行アップロードはジョブで使う）
+        self._clear_selection()
+        self.file_name.set("")
+        self.status_display.config(
+            text=f"キューに追加しました: {output_name} ({job.total} files)"
+        )
+
+    def on_cancel_job(self):
+        """ジョブ一覧で選択したジョブを取り消す"""
+        selection = self.job_listbox.curselection()
+        if not selection:
+            return
+        self.job_queue.cancel(self._job_ids[selection[0]])
+        self._refresh_job_list()
+
+    def _on_job_changed(self, job):
+        # ジョブはワーカースレッドで実行されるため、一覧はTkのスレッドで更新する
+        self.root.after(0, self._refresh_job_list)
+
+    def _refresh_job_list(self):
+        """ジョブ一覧に各ジョブの状態と進捗を表示する"""
+        jobs = self.job_queue.jobs()
+        selection = self.job_listbox.curselection()
+        self.job_listbox.delete(0, tk.END)
+        if jobs:
+            self.job_listbox.insert(tk.END, *(job.describe() for job in jobs))
+        for index, job in enumerate(jobs):
+            if job.status == STATUS_FAILED:
+                self.job_listbox.itemconfig(index, foreground="red")
+        self._job_ids = [job.id for job in jobs]
+        if selection and selection[0] < len(jobs):
+            self.job_listbox.selection_set(selection[0])
+
+    def on_render_results(self):
+        """結果ファイルを選択してスライドを再生成する"""
+        results_paths = filedialog.askopenfilenames(
+            title="抽出結果ファイルを選択",
+            initialdir=str(self.output_dir),
+            filetypes=[("抽出結果 (JSONL)", "*.results.jsonl")],
+        )
+        if not results_paths:
+            return
+        rendered, failed = [], []
+        for results_path in results_paths:
+            try:
+                rendered.append(self.render_results(results_path))
+            except Exception as e:
+                logger.exception("スライドの再生成に失敗しました: %s", results_path)
+                failed.append(f"{Path(results_path).name}: {e}")
+        self.status_display.config(text=f"{len(rendered)}個のスライドを再生成しました")
+        if failed:
+            messagebox.showerror(
+                "エラー", "再生成に失敗しました:\n" + "\n".join(failed)
+            )
+        else:
+            messagebox.showinfo("完了", f"{len(rendered)}個のスライドを再生成しました")
+
+    def on_close(self):
+        """ウィンドウを閉じる
 
-    def on_finish(self):
+        作業状態を保存し、保存しなかった先行アップロードは取り消して削除する。
+        """
+        self._save_session()
+        if self.prefetcher is not None:
+            self.prefetcher.discard()
+        self.root.destroy()
+
+    def on_finish(self, show_message=True):
         """処理完了時の共通処理"""
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
         self.status_display.config(text="準備完了")
-        messagebox.showinfo("完了", "処理が完了しました")
+        if show_message:
+            messagebox.showinfo("完了", "処理が完了しました")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Image to Textbox")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="ジャーナルから前回の処理を再開する",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="同名のPPTXが既にある場合は新しい図のスライドだけを追加する",
+    )
+    parser.add_argument(
+        "--watch",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="GUIを起動せずにフォルダを監視して新しい画像を自動処理する",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="GUIを起動せずにローカルHTTP抽出サービスを起動する",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="段階ごとのプロファイル（cProfile・tracemalloc）を書き出す",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="実行ごとのトレース（Chromeのトレース形式またはOTLP/JSON）を書き出す",
+    )
+    parser.add_argument(
+        "--render",
+        nargs="+",
+        metavar="RESULTS",
+        help="保存済みの抽出結果（*.results.jsonl）からAPIを呼ばずにスライドを再生成する",
+    )
+    return parser.parse_args(argv)
+
+
+def run_render(results_paths):
+    """結果ファイルからスライドを再生成する（失敗があれば終了コード1）"""
+    pipeline = TextboxPipeline(config_ini, offline=True)
+    status = 0
+    for results_path in results_paths:
+        start = time.perf_counter()
+        try:
+            output_path = pipeline.render_results(results_path)
+        except Exception as e:
+            logger.error("スライドの再生成に失敗しました: %s (%s)", results_path, e)
+            status = 1
+            continue
+        logger.info(
+            "再生成しました: %s (%.2f 秒)", output_path, time.perf_counter() - start
+        )
+    return status
+
+
+def start_settings_watcher():
+    """設定ファイルの監視を開始する（設定ファイルがない場合はNone）"""
+    try:
+        settings_watcher = SettingsWatcher()
+    except FileNotFoundError:
+        return None
+    settings_watcher.start()
+    return settings_watcher
+
+
+def run_watch_daemon(directory):
+    """フォルダ監視デーモンを起動する（Ctrl+Cで終了）"""
+    from watcher import WatchDaemon
+
+    pipeline = TextboxPipeline(config_ini)
+    daemon = WatchDaemon.from_settings(pipeline, pipeline.settings.watch, directory)
+    settings_watcher = start_settings_watcher()
+    if settings_watcher is not None:
+        pipeline.attach_settings_watcher(settings_watcher)
+        settings_watcher.subscribe(
+            lambda settings, _config_ini: daemon.apply_settings(settings.watch)
+        )
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        if settings_watcher is not None:
+            settings_watcher.stop()
+
+
+def run_service():
+    """ローカルHTTP抽出サービスを起動する（Ctrl+Cで終了）"""
+    from service import create_server, service_from_settings
+
+    settings = Settings.from_config(config_ini)
+    settings_watcher = start_settings_watcher()
+
+    def create_pipeline():
+        pipeline = TextboxPipeline(config_ini)
+        if settings_watcher is not None:
+            pipeline.attach_settings_watcher(settings_watcher)
+        return pipeline
+
+    api_key = settings.gemini.api_key
+    shared_client = genai.Client(api_key=api_key) if api_key else None
+    # ワーカーごとにプールを作るとRPM/TPMの枠が共有されないため、1つだけ作って配る
+    shared_key_pool = None
+    if settings.gemini.api_keys:
+        key_pool = KeyPool.from_settings(
+            settings.gemini, lambda api_key: genai.Client(api_key=api_key)
+        )
+        if len(key_pool) > 1:
+            shared_key_pool = key_pool
+    service = service_from_settings(
+        create_pipeline,
+        settings.service,
+        BASE_DIR,
+        shared_client=shared_client,
+        shared_key_pool=shared_key_pool,
+    )
+    if settings_watcher is not None:
+        settings_watcher.subscribe(
+            lambda new_settings, _config_ini: service.apply_settings(
+                new_settings.service
+            )
+        )
+    host, port = settings.service.host, settings.service.port
+    server = create_server(service, host, port)
+    service.start()
+    logger.info("抽出サービスを起動しました: http://%s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if settings_watcher is not None:
+            settings_watcher.stop()
+
+
+def is_gui_mode(args) -> bool:
+    return args.watch is None and not args.serve and not args.render
+
 
+def report_settings_error(error, gui: bool = False):
+    """設定の誤りを標準エラーに出力する（GUIではダイアログでも表示する）"""
+    print(error, file=sys.stderr)
+    if not gui:
+        return
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return
+    root.withdraw()
+    messagebox.showerror("設定エラー", str(error))
+    root.destroy()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from logging_setup import configure_logging
+
+    try:
+        settings = Settings.from_config(config_ini)
+    except SettingsError as e:
+        # ログの出力先も設定から決まるため、設定の誤りは標準エラー（GUIでは画面）に出して終了する
+        report_settings_error(e, gui=is_gui_mode(args))
+        raise SystemExit(2)
+    configure_logging(settings.logging)
+    if args.profile or settings.profile.enabled:
+        profiling.start(
+            BASE_DIR / settings.profile.output_dir, top=settings.profile.top
+        )
+    if args.trace or settings.trace.enabled:
+        tracing.start(
+            BASE_DIR / settings.trace.output_dir, format=settings.trace.format
+        )
+    try:
+        run_mode(args)
+    finally:
+        profiling.stop()
+        tracing.stop()
+
+
+def run_mode(args):
+    """コマンドラインの指定に応じてデーモン・サービス・再生成・GUIを実行する"""
+    if args.watch is not None:
+        run_watch_daemon(args.watch)
+        return
+    if args.serve:
+        run_service()
+        return
+    if args.render:
+        raise SystemExit(run_render(args.render))
 
-def main():
     root = tk.Tk()
     icon_name = config_ini.get("GUI_SETTINGS", "icon_name", fallback="favicon.ico")
     icon_path = BASE_DIR / "config" / icon_name
@@ -635,12 +2323,19 @@ def main():
         logger.exception("アイコンの設定に失敗しました")
 
     try:
-        ImageTextboxApp(root, config_ini)
+        app = ImageTextboxApp(
+            root, config_ini, resume=args.resume, append=args.append, defer_init=True
+        )
     except ValueError as ve:
         logger.exception("アプリケーションの初期化に失敗しました")
         messagebox.showerror("エラー", f"アプリケーションの初期化に失敗しました: {ve}")
         root.destroy()
         return
+    try:
+        # 処理開始時に設定ファイルの変更を確認する（再起動不要）
+        app.attach_settings_watcher(SettingsWatcher())
+    except (FileNotFoundError, ValueError):
+        logger.exception("設定ファイルの監視を開始できませんでした")
 
     root.mainloop()
 
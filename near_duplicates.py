@@ -0,0 +1,141 @@
+# 知覚ハッシュによる近似重複画像の検出（解像度・形式違いの再書き出しをまとめる）
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from image_cache import grayscale
+
+logger = logging.getLogger(__name__)
+
+# 類似度行列を計算する行ブロックの大きさ（メモリ使用量を抑えるため）
+BLOCK_ROWS = 1024
+
+# 同じ図の再書き出しとみなす縦横比の差（対数の差、約5%）
+ASPECT_TOLERANCE = 0.05
+
+# 画素の比較：両方の画像を小さい方の大きさ（長辺 VERIFY_MAX_SIDE まで）に縮小し、
+# VERIFY_BLOCK 画素四方のブロックごとの平均の差がすべて VERIFY_TOLERANCE 以下なら同じ図
+# （再圧縮・縮小の誤差は全体に薄く広がるが、ラベルの違いは1か所に集中するため）
+VERIFY_MAX_SIDE = 512
+VERIFY_BLOCK = 8
+VERIFY_TOLERANCE = 32.0
+
+
+def difference_hash(
+    path, hash_size: int = 16
+) -> Optional[tuple[np.ndarray, int, float]]:
+    """縮小したグレースケール画像の隣接画素の大小関係からハッシュを作る
+
+    Returns:
+        (hash_size * hash_size 個のビット, 元画像の画素数, 縦横比)。
+        読み込めない場合はNone
+    """
+    try:
+        # JPEGは縮小しながらデコードできるため、全画素を展開しない
+        gray, (width, height) = grayscale(path, hash_size * 4)
+        small = gray.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    except Exception as e:
+        logger.debug("知覚ハッシュを計算できませんでした: %s (%s)", path, e)
+        return None
+    pixels = np.asarray(small, dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel(), width * height, width / height
+
+
+def _verify_image(path) -> Optional[Image.Image]:
+    """画素の比較用に縮小したグレースケール画像（読み込めない場合はNone）"""
+    try:
+        gray, _ = grayscale(path, VERIFY_MAX_SIDE)
+    except Exception as e:
+        logger.debug("画像を比較できませんでした: %s (%s)", path, e)
+        return None
+    gray.thumbnail((VERIFY_MAX_SIDE, VERIFY_MAX_SIDE), Image.Resampling.BOX)
+    return gray
+
+
+def same_content(a: Image.Image, b: Image.Image) -> bool:
+    """縮小した2つの画像が同じ図か（局所的な違いがないか）を画素で比較する"""
+    width, height = min(a.width, b.width), min(a.height, b.height)
+    rows, cols = height // VERIFY_BLOCK, width // VERIFY_BLOCK
+    if rows == 0 or cols == 0:
+        return False
+    diff = np.abs(
+        np.asarray(a.resize((width, height), Image.Resampling.BOX), dtype=np.float32)
+        - np.asarray(b.resize((width, height), Image.Resampling.BOX), dtype=np.float32)
+    )
+    blocks = diff[: rows * VERIFY_BLOCK, : cols * VERIFY_BLOCK].reshape(
+        rows, VERIFY_BLOCK, cols, VERIFY_BLOCK
+    )
+    return float(blocks.mean(axis=(1, 3)).max()) <= VERIFY_TOLERANCE
+
+
+def cluster_near_duplicates(
+    paths: list[str], similarity: float = 0.97, hash_size: int = 16
+) -> list[list[str]]:
+    """同じ図を解像度・形式を変えて書き出した画像をまとめる
+
+    画素数が最も大きい画像（最も高解像度の書き出し）を代表とし、
+    代表とのハッシュの類似度が similarity 以上で縦横比がほぼ同じ画像を候補にする。
+    ラベルだけが違うグラフなどはハッシュが一致するため、候補は代表と画素を
+    比較し、局所的な違いがない画像だけを同じクラスタに入れる。
+    読み込めない画像はそれぞれ単独のクラスタになる。
+
+    Returns:
+        クラスタのリスト。各クラスタの先頭が代表で、順序は paths の順
+    """
+    with ThreadPoolExecutor(max_workers=min(8, len(paths) or 1)) as executor:
+        hashes = list(executor.map(lambda p: difference_hash(p, hash_size), paths))
+
+    indices = [i for i, h in enumerate(hashes) if h is not None]
+    clusters: dict[int, list[int]] = {i: [i] for i, h in enumerate(hashes) if h is None}
+    if indices:
+        bits = np.stack([hashes[i][0] for i in indices])
+        # ±1 のベクトルにすると内積 = ビット数 - 2 × ハミング距離
+        signed = np.where(bits, 1.0, -1.0).astype(np.float32)
+        n_bits = bits.shape[1]
+        min_dot = n_bits * (2.0 * similarity - 1.0)
+        log_aspect = np.log([hashes[i][2] for i in indices])
+
+        # 高解像度の画像から順に代表にする
+        order = sorted(
+            range(len(indices)), key=lambda k: (-hashes[indices[k]][1], indices[k])
+        )
+        assigned = np.zeros(len(indices), dtype=bool)
+        for start in range(0, len(order), BLOCK_ROWS):
+            block = order[start : start + BLOCK_ROWS]
+            dots = signed[block] @ signed.T
+            for row, k in enumerate(block):
+                if assigned[k]:
+                    continue
+                assigned[k] = True
+                close = np.abs(log_aspect - log_aspect[k]) <= ASPECT_TOLERANCE
+                candidates = np.flatnonzero((dots[row] >= min_dot) & close & ~assigned)
+                members = _verified(paths, indices[k], [indices[m] for m in candidates])
+                assigned[[m for m in candidates if indices[m] in members]] = True
+                clusters[indices[k]] = [indices[k], *sorted(members)]
+
+    return [
+        [paths[i] for i in members]
+        for _, members in sorted(clusters.items(), key=lambda item: min(item[1]))
+    ]
+
+
+def _verified(paths, representative: int, candidates: list[int]) -> set[int]:
+    """候補のうち、代表と画素を比較して同じ図と確認できたもの"""
+    if not candidates:
+        return set()
+    reference = _verify_image(paths[representative])
+    if reference is None:
+        return set()
+    members = set()
+    for index in candidates:
+        image = _verify_image(paths[index])
+        if image is not None and same_content(reference, image):
+            members.add(index)
+        else:
+            logger.debug(
+                "ハッシュは近いが画素が異なるためまとめません: %s", paths[index]
+            )
+    return members
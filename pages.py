@@ -0,0 +1,158 @@
+# 複数ページの入力（PDF・TIFF）をページ単位で扱う
+#
+# ページは `<ファイルのパス>#page=<番号>` という参照で表し、画像と同じように
+# 一覧・プレビュー・アップロードの対象にする。ページは必要になったときに
+# 1ページずつデコードし、同時にメモリ上に展開するページ数に上限を設ける。
+import logging
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PAGED_SUFFIXES = (".pdf", ".tif", ".tiff")
+
+_PAGE_REF = re.compile(r"^(?P<path>.+)#page=(?P<page>\d+)$")
+
+# PDFのラスタライズ解像度
+_pdf_dpi = 200
+# 同時にデコードしてよいページ数
+_max_decoded_pages = 4
+_page_slots = threading.BoundedSemaphore(_max_decoded_pages)
+# pdfium はスレッドセーフではないため、呼び出しを直列化する
+_pdfium_lock = threading.Lock()
+
+
+def configure(pdf_dpi: int = 200, max_decoded_pages: int = 4):
+    """ラスタライズ解像度と同時にデコードするページ数の上限を設定する
+
+    上限が変わらない場合は、デコード中のページが使っている枠をそのまま使う。
+    """
+    global _pdf_dpi, _max_decoded_pages, _page_slots
+    _pdf_dpi = pdf_dpi
+    max_decoded_pages = max(1, max_decoded_pages)
+    if max_decoded_pages != _max_decoded_pages:
+        _max_decoded_pages = max_decoded_pages
+        _page_slots = threading.BoundedSemaphore(max_decoded_pages)
+
+
+def is_paged(path) -> bool:
+    return Path(path).suffix.lower() in PAGED_SUFFIXES
+
+
+def make_ref(path, page: int) -> str:
+    return f"{path}#page={page}"
+
+
+def split_ref(ref) -> tuple[str, Optional[int]]:
+    """ページ参照を (ファイルのパス, ページ番号) に分ける（画像の場合はNone）"""
+    ref = str(ref)
+    match = _PAGE_REF.match(ref)
+    if match and is_paged(match["path"]):
+        return match["path"], int(match["page"])
+    return ref, None
+
+
+def display_name(ref) -> str:
+    """一覧・プレビューに表示する名前"""
+    path, page = split_ref(ref)
+    name = Path(path).name
+    return name if page is None else f"{name} (p.{page})"
+
+
+def page_count(path) -> int:
+    """PDF・TIFFのページ数"""
+    if Path(path).suffix.lower() == ".pdf":
+        import pypdfium2 as pdfium
+
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(str(path))
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def expand_inputs(paths) -> tuple[list[str], int]:
+    """PDF・TIFFをページ参照に展開し、(画像・ページの一覧, 読み込めなかった数) を返す"""
+    expanded, failed = [], 0
+    for path in paths:
+        if not is_paged(path):
+            expanded.append(str(path))
+            continue
+        try:
+            count = page_count(path)
+        except Exception as e:
+            logger.warning("ページ数を取得できませんでした: %s (%s)", path, e)
+            failed += 1
+            continue
+        expanded.extend(make_ref(path, page) for page in range(1, count + 1))
+    return expanded, failed
+
+
+def _decode_page(path: str, page: int):
+    """1ページだけをデコードしてPIL画像を返す"""
+    if Path(path).suffix.lower() == ".pdf":
+        import pypdfium2 as pdfium
+
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(path)
+            try:
+                bitmap = pdf[page - 1].render(scale=_pdf_dpi / 72)
+                return bitmap.to_pil()
+            finally:
+                pdf.close()
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.seek(page - 1)
+        # RGB/L 以外（16bitなど）はアップロード・表示できる形式に変換する
+        if img.mode in ("RGB", "RGBA", "L"):
+            return img.copy()
+        return img.convert("RGB")
+
+
+@contextmanager
+def open_image(ref):
+    """画像またはページを開く（ページの場合は同時デコード数の上限を守る）"""
+    path, page = split_ref(ref)
+    if page is None:
+        from PIL import Image
+
+        with Image.open(path) as img:
+            yield img
+        return
+    with _page_slots:
+        img = _decode_page(path, page)
+        try:
+            yield img
+        finally:
+            img.close()
+
+
+@contextmanager
+def upload_source(ref):
+    """アップロードできるファイルのパスを返す
+
+    画像はそのまま、ページは一時的なPNGに書き出してアップロード後に削除する。
+    """
+    path, page = split_ref(ref)
+    if page is None:
+        yield path
+        return
+    fd, temp_path = tempfile.mkstemp(prefix="page_", suffix=".png")
+    os.close(fd)
+    try:
+        with open_image(ref) as img:
+            img.save(temp_path, format="PNG")
+        yield temp_path
+    finally:
+        os.unlink(temp_path)
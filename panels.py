@@ -0,0 +1,160 @@
+# 複数パネルの図を余白の投影プロファイルで分割する
+import logging
+from pathlib import Path
+from string import ascii_lowercase
+
+import numpy as np
+from PIL import Image
+
+from image_cache import open_image
+
+logger = logging.getLogger(__name__)
+
+# 背景（余白）とみなす明るさの下限（0〜255）
+BACKGROUND_LEVEL = 235
+
+
+def _runs(mask: np.ndarray) -> list[tuple[int, int]]:
+    """True が連続する区間 [start, end) の一覧"""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return [(int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def _merge_small(
+    segments: list[tuple[int, int]], min_size: float
+) -> list[tuple[int, int]]:
+    """小さすぎる区間（サブラベル・共通の軸ラベルなど）を隣の区間に含める"""
+    merged: list[tuple[int, int]] = []
+    for start, end in segments:
+        if merged and (
+            end - start < min_size or merged[-1][1] - merged[-1][0] < min_size
+        ):
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _split_axis(ink: np.ndarray, axis: int, min_gap: int) -> list[tuple[int, int]]:
+    """余白の帯（幅 min_gap 以上）で区切った、内容のある区間の一覧"""
+    profile = ink.any(axis=axis)
+    segments = []
+    start = 0
+    for gap_start, gap_end in _runs(~profile):
+        # 端の余白は幅に関係なく除き、内側は十分に広い余白だけで区切る
+        at_edge = gap_start == 0 or gap_end == len(profile)
+        if gap_end - gap_start < min_gap and not at_edge:
+            continue
+        if gap_start > start:
+            segments.append((start, gap_start))
+        start = gap_end
+    if start < len(profile):
+        segments.append((start, len(profile)))
+    return segments
+
+
+def find_panels(
+    image: Image.Image,
+    min_gap_ratio: float = 0.02,
+    min_panel_ratio: float = 0.15,
+    max_panels: int = 12,
+) -> list[tuple[int, int, int, int]]:
+    """パネルの領域 (left, top, right, bottom) を読む順（行ごとに左から）に返す
+
+    グレースケール画像の行・列ごとの「インク」（背景より暗い画素）の有無を
+    投影し、十分な幅の余白の帯で横方向の段に分けてから、各段を縦方向の
+    余白で分ける。小さすぎる断片（ラベルや凡例だけの領域など）は
+    隣のパネルに含めるため、画像内の文字が失われることはない。
+    分割できない場合は画像全体を1つだけ返す。
+    """
+    gray = np.asarray(image.convert("L"))
+    height, width = gray.shape
+    ink = gray < BACKGROUND_LEVEL
+    whole = [(0, 0, width, height)]
+    if not ink.any():
+        return whole
+
+    min_gap_rows = max(2, int(height * min_gap_ratio))
+    min_gap_cols = max(2, int(width * min_gap_ratio))
+    rows = _merge_small(
+        _split_axis(ink, axis=1, min_gap=min_gap_rows), height * min_panel_ratio
+    )
+    panels = []
+    for top, bottom in rows:
+        columns = _merge_small(
+            _split_axis(ink[top:bottom], axis=0, min_gap=min_gap_cols),
+            width * min_panel_ratio,
+        )
+        panels.extend((left, top, right, bottom) for left, right in columns)
+
+    if len(panels) < 2 or len(panels) > max_panels:
+        return whole
+    # 切り出しで文字の端が欠けないよう、余白の半分だけ広げる
+    pad_x, pad_y = min_gap_cols // 2, min_gap_rows // 2
+    return [
+        (
+            max(0, left - pad_x),
+            max(0, top - pad_y),
+            min(width, right + pad_x),
+            min(height, bottom + pad_y),
+        )
+        for left, top, right, bottom in panels
+    ]
+
+
+def panel_label(index: int) -> str:
+    """0, 1, 2, … を a, b, c, … に変換する"""
+    return ascii_lowercase[index % len(ascii_lowercase)]
+
+
+def split_panels(
+    path,
+    out_dir,
+    min_gap_ratio: float = 0.02,
+    min_panel_ratio: float = 0.15,
+    max_panels: int = 12,
+) -> list[str]:
+    """画像をパネルに分割して out_dir に保存し、パネル画像のパスを返す
+
+    パネルが1つしか見つからない場合（または読み込めない場合）は空リスト。
+    """
+    try:
+        with open_image(path) as img:
+            img.load()
+            boxes = find_panels(img, min_gap_ratio, min_panel_ratio, max_panels)
+            if len(boxes) < 2:
+                return []
+            out_dir = Path(out_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            stem = Path(path).stem
+            crops = []
+            for index, box in enumerate(boxes):
+                crop_path = out_dir / f"{stem}_{panel_label(index)}.png"
+                img.crop(box).save(crop_path)
+                crops.append(str(crop_path))
+    except Exception as e:
+        logger.warning("パネルの分割に失敗しました: %s (%s)", path, e)
+        return []
+    logger.info("パネルに分割しました: %s (%d panels)", path, len(crops))
+    return crops
+
+
+def combine_panel_results(figure_name: str, panel_results: list[list]) -> list:
+    """パネルごとの抽出結果を、パネルごとに1つの図としてまとめる
+
+    Args:
+        figure_name: パネル名に使う元画像の名前（モデルが名前を返さない場合）
+        panel_results: パネル順の抽出結果（figure_name/token の辞書のリスト）
+    """
+    combined = []
+    for index, result in enumerate(panel_results):
+        names = [f.get("figure_name") for f in result if f.get("figure_name")]
+        base = names[0] if names else figure_name
+        combined.append(
+            {
+                "figure_name": f"{base} ({panel_label(index)})",
+                "token": [token for f in result for token in f.get("token", [])],
+            }
+        )
+    return combined
@@ -0,0 +1,209 @@
+# 処理段階ごとのプロファイル（--profile または [PROFILE] enabled = true）
+#
+# アップロード・抽出・レイアウト・保存を cProfile で計測し、段階ごとの pstats と
+# 時間のかかった関数の一覧を実行ごとのディレクトリに書き出す。プレビューと
+# スライド生成の前後では tracemalloc のスナップショットを取り、増えたメモリの
+# 割り当て元の上位を書き出す。有効にしていない場合は何もしない。
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc が記録する呼び出し元の深さ
+TRACE_FRAMES = 10
+
+
+class RunProfiler:
+    """1回の実行（プロセス）の段階ごとのプロファイルを run_dir に書き出す
+
+    Args:
+        run_dir: 出力先のディレクトリ
+        top: 一覧に書き出す関数・割り当て元の数
+    """
+
+    def __init__(self, run_dir, top: int = 30):
+        self.run_dir = Path(run_dir)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.top = top
+        self._stats: dict[str, pstats.Stats] = {}
+        self._timings: dict[str, dict] = {}
+        self._memory: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        # cProfile（Python 3.12 以降は sys.monitoring）は全スレッドを計測し、
+        # 同時に1つしか有効にできないため、計測中の段階は1つだけにする
+        self._active_stage: Optional[str] = None
+        self._active_profile: Optional[cProfile.Profile] = None
+        self._active_depth = 0
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(TRACE_FRAMES)
+
+    @contextmanager
+    def profile(self, stage: str):
+        """with 文の中の処理を stage の段階として cProfile で計測する
+
+        同じ段階を複数のスレッドで並列に実行している間は1つの計測にまとめ、
+        最後のスレッドが抜けたときに段階ごとの統計に加える。別の段階の計測中に
+        始まった段階は時間だけを記録し（処理は計測中の段階に含まれる）、
+        summary.json の overlapped に回数を数える。
+        """
+        started = time.perf_counter()
+        owned = self._enter(stage)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._exit(stage, owned, elapsed)
+
+    def _enter(self, stage: str) -> bool:
+        """段階の計測に加わる（時間だけを記録する場合はFalse）"""
+        with self._lock:
+            if self._active_stage == stage:
+                self._active_depth += 1
+                return True
+            if self._active_stage is not None:
+                return False
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # 外部のプロファイラが動いている場合など
+                logger.debug("cProfile を開始できませんでした: %s", e)
+                return False
+            self._active_stage = stage
+            self._active_profile = profile
+            self._active_depth = 1
+            return True
+
+    def _exit(self, stage: str, owned: bool, elapsed: float):
+        with self._lock:
+            timing = self._timings.setdefault(
+                stage, {"calls": 0, "seconds": 0.0, "overlapped": 0}
+            )
+            timing["calls"] += 1
+            timing["seconds"] += elapsed
+            if not owned:
+                timing["overlapped"] += 1
+                return
+            self._active_depth -= 1
+            if self._active_depth > 0:
+                return
+            profile, self._active_profile = self._active_profile, None
+            self._active_stage = None
+            profile.disable()
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    @contextmanager
+    def memory(self, stage: str):
+        """with 文の前後の tracemalloc のスナップショットを比べて書き出す"""
+        before = tracemalloc.take_snapshot()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self._write_memory_report(
+                stage, before, after, peak - start_bytes, current - start_bytes
+            )
+
+    def _write_memory_report(self, stage, before, after, peak_delta, retained):
+        with self._lock:
+            reports = self._memory.setdefault(stage, [])
+            index = len(reports) + 1
+            reports.append({"peak_bytes": peak_delta, "retained_bytes": retained})
+        lines = [
+            f"{stage} #{index}",
+            f"ピーク時の増加: {peak_delta / 1024:.1f} KiB",
+            f"終了時の増加: {retained / 1024:.1f} KiB",
+            "",
+            f"割り当ての増加が大きい箇所（上位 {self.top} 件）:",
+        ]
+        for stat in after.compare_to(before, "lineno")[: self.top]:
+            lines.append(str(stat))
+        path = self.run_dir / f"{stage}.{index:03d}.memory.txt"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def flush(self):
+        """段階ごとの pstats・関数の一覧・集計（summary.json）を書き出す"""
+        with self._lock:
+            for stage, stats in self._stats.items():
+                pstats_path = self.run_dir / f"{stage}.pstats"
+                stats.dump_stats(pstats_path)
+                report = io.StringIO()
+                pstats.Stats(str(pstats_path), stream=report).sort_stats(
+                    pstats.SortKey.CUMULATIVE
+                ).print_stats(self.top)
+                (self.run_dir / f"{stage}.txt").write_text(
+                    report.getvalue(), encoding="utf-8"
+                )
+            summary = {
+                "stages": {stage: dict(t) for stage, t in self._timings.items()},
+                "memory": {stage: list(r) for stage, r in self._memory.items()},
+            }
+        (self.run_dir / "summary.json").write_text(
+            json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+
+    def close(self):
+        self.flush()
+        if self._started_tracing:
+            tracemalloc.stop()
+
+
+_active: Optional[RunProfiler] = None
+
+
+def start(directory, top: int = 30) -> RunProfiler:
+    """プロファイルを開始し、directory の下に実行ごとのディレクトリを作る"""
+    global _active
+    if _active is not None:
+        return _active
+    run_dir = Path(directory) / datetime.now().strftime("%Y%m%d_%H%M%S")
+    _active = RunProfiler(run_dir, top=top)
+    logger.info("プロファイルを記録します: %s", run_dir)
+    return _active
+
+
+def stop():
+    """プロファイルを書き出して終了する"""
+    global _active
+    if _active is None:
+        return
+    profiler, _active = _active, None
+    profiler.close()
+    logger.info("プロファイルを書き出しました: %s", profiler.run_dir)
+
+
+def active() -> Optional[RunProfiler]:
+    return _active
+
+
+def profile(stage: str):
+    """段階を cProfile で計測する（プロファイルが無効な場合は何もしない）"""
+    return nullcontext() if _active is None else _active.profile(stage)
+
+
+def memory(stage: str):
+    """段階の前後のメモリを比べる（プロファイルが無効な場合は何もしない）"""
+    return nullcontext() if _active is None else _active.memory(stage)
+
+
+def flush():
+    if _active is not None:
+        _active.flush()
@@ -0,0 +1,170 @@
+# システムプロンプトのコンテキストキャッシュ（Gemini cached content）
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 期限切れ直前のキャッシュを使わないよう、この秒数を残して延長する
+REFRESH_MARGIN_SECONDS = 60.0
+# 一時的なエラーで作成に失敗した場合、この秒数が経つまで再試行しない
+RETRY_AFTER_SECONDS = 60.0
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """同じ内容で再試行しても成功しないエラーか（4xx、ただしタイムアウトと429を除く）"""
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and 400 <= code < 500 and code not in (408, 429)
+
+
+@dataclass
+class CacheEntry:
+    name: str
+    prompt_hash: str
+    expires_at: float
+
+
+class PromptCache:
+    """システムプロンプトをモデルごとのキャッシュとして作成し使い回す
+
+    キャッシュはAPIキー（プロジェクト）ごと・モデルごとに1つ作成する。
+    プロンプトの内容（ハッシュ）が変わった場合は古いキャッシュを削除して作り直し、
+    期限が近づいたらTTLを延長する。作成に失敗した場合、呼び出し側は
+    通常どおりシステムプロンプトを送信する。プロンプトがキャッシュの
+    最小トークン数に満たないなどの4xxエラーは同じ内容で再試行せず、
+    一時的なエラーは RETRY_AFTER_SECONDS 秒後に再試行する。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._entries: dict[tuple[str, str], CacheEntry] = {}
+        # 作成に失敗したキャッシュ → 再試行できる時刻（恒久的な失敗は inf）
+        self._failed: dict[tuple[str, str, str], float] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cached_requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def get(
+        self, client, api_key: str, model: str, system_instruction: str, ttl: float
+    ) -> Optional[str]:
+        """キャッシュ名を返す（キャッシュを使えない場合はNone）"""
+        if ttl <= 0 or not system_instruction:
+            return None
+        key = (fingerprint(api_key), model)
+        prompt_hash = fingerprint(system_instruction)
+        with self._lock:
+            now = self.clock()
+            if self._failed.get((*key, prompt_hash), now) > now:
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and entry.prompt_hash != prompt_hash:
+                logger.info(
+                    "システムプロンプトが変更されたためキャッシュを作り直します"
+                )
+                self._delete(client, entry)
+                entry = None
+            if entry is not None and entry.expires_at - now < REFRESH_MARGIN_SECONDS:
+                entry = self._refresh(client, entry, ttl, now)
+            if entry is None:
+                entry, retry_after = self._create(
+                    client, model, system_instruction, ttl, now
+                )
+                if entry is None:
+                    self._failed[(*key, prompt_hash)] = now + retry_after
+                    self._entries.pop(key, None)
+                    return None
+                self._failed.pop((*key, prompt_hash), None)
+            self._entries[key] = entry
+            return entry.name
+
+    def _create(self, client, model, system_instruction, ttl, now):
+        """キャッシュを作成する
+
+        Returns:
+            (作成したキャッシュ, 0.0)、失敗した場合は (None, 再試行までの秒数)
+        """
+        from google.genai import types
+
+        try:
+            cached = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name="image-to-textbox system instruction",
+                    system_instruction=system_instruction,
+                    ttl=f"{int(ttl)}s",
+                ),
+            )
+        except Exception as e:
+            logger.warning("コンテキストキャッシュを作成できませんでした: %s", e)
+            return None, (
+                float("inf") if is_permanent_error(e) else RETRY_AFTER_SECONDS
+            )
+        name = getattr(cached, "name", None)
+        if not isinstance(name, str):
+            logger.warning("コンテキストキャッシュの名前を取得できませんでした")
+            return None, RETRY_AFTER_SECONDS
+        logger.info("コンテキストキャッシュを作成しました: %s (%s)", name, model)
+        return CacheEntry(name, fingerprint(system_instruction), now + ttl), 0.0
+
+    def _refresh(self, client, entry, ttl, now):
+        """TTLを延長する（失敗した場合はNoneを返して作り直させる）"""
+        from google.genai import types
+
+        if entry.expires_at > now:
+            try:
+                client.caches.update(
+                    name=entry.name,
+                    config=types.UpdateCachedContentConfig(ttl=f"{int(ttl)}s"),
+                )
+                entry.expires_at = now + ttl
+                return entry
+            except Exception as e:
+                logger.warning("コンテキストキャッシュを延長できませんでした: %s", e)
+        return None
+
+    def _delete(self, client, entry):
+        try:
+            client.caches.delete(name=entry.name)
+        except Exception as e:
+            logger.warning("コンテキストキャッシュを削除できませんでした: %s", e)
+
+    def record_usage(self, response, cached: bool) -> tuple[int, int]:
+        """レスポンスのトークン使用量からキャッシュの効果を集計する
+
+        Returns:
+            (入力トークン数, うちキャッシュから読み込まれたトークン数)
+        """
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        cached_tokens = getattr(usage, "cached_content_token_count", None)
+        prompt_tokens = prompt_tokens if isinstance(prompt_tokens, int) else 0
+        cached_tokens = cached_tokens if isinstance(cached_tokens, int) else 0
+        with self._lock:
+            self.requests += 1
+            if cached:
+                self.cached_requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+        return prompt_tokens, cached_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "cached_requests": self.cached_requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+
+# プロセス内のパイプラインで共有する（サービスのワーカー間でも同じキャッシュを使う）
+shared_prompt_cache = PromptCache()
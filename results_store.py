@@ -0,0 +1,122 @@
+# 抽出結果のJSONLファイル（PPTXの横に保存し、APIを呼ばずに再生成するため）
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".results.jsonl"
+FAILURES_SUFFIX = ".failures.jsonl"
+# 図を抽出した画像のキー（journal.image_key、追記時にデッキに含まれる画像を判定する）
+SOURCE_FIELD = "images"
+
+
+def sidecar_path(pptx_path) -> Path:
+    """PPTXに対応する結果ファイルのパス（deck.pptx → deck.results.jsonl）"""
+    pptx_path = Path(pptx_path)
+    return pptx_path.with_name(pptx_path.stem + SIDECAR_SUFFIX)
+
+
+def failures_path(pptx_path) -> Path:
+    """PPTXに対応する失敗レポートのパス（deck.pptx → deck.failures.jsonl）"""
+    pptx_path = Path(pptx_path)
+    return pptx_path.with_name(pptx_path.stem + FAILURES_SUFFIX)
+
+
+def deck_path(results_path) -> Path:
+    """結果ファイルに対応するPPTXのパス（deck.results.jsonl → deck.pptx）"""
+    results_path = Path(results_path)
+    name = results_path.name
+    if name.endswith(SIDECAR_SUFFIX):
+        name = name[: -len(SIDECAR_SUFFIX)]
+    else:
+        name = results_path.stem
+    return results_path.with_name(name + ".pptx")
+
+
+def write_results(path, figures: Iterable[dict]) -> Path:
+    """図ごとに1行のJSONLとして書き出す
+
+    一時ファイルに1行ずつ書いてから置き換えるため、途中で失敗しても
+    以前の結果ファイルが壊れることはない。
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for figure in figures:
+            f.write(json.dumps(figure, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+def append_results(path, figures: Iterable[dict]) -> Path:
+    """抽出できた図を結果ファイルの末尾に書き足す（長い実行の途中経過を残すため）
+
+    前回の実行が途中で止まり最後の行が途切れている場合は、改行を補ってから書き足す
+    （途切れた行は読み込み時に読み飛ばされる）。
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab+") as f:
+        f.seek(0, os.SEEK_END)
+        lines = [json.dumps(figure, ensure_ascii=False) + "\n" for figure in figures]
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                lines.insert(0, "\n")
+        f.write("".join(lines).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+def with_sources(figures: Iterable[dict], sources: Iterable[list]) -> list[dict]:
+    """図ごとに抽出元の画像のキーを付けた行を返す"""
+    return [
+        {**figure, SOURCE_FIELD: list(images)}
+        for figure, images in zip(figures, sources)
+    ]
+
+
+def iter_records(path) -> Iterator[dict]:
+    """結果ファイルを1行ずつ読み込む（空行・壊れた行は読み飛ばす）"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                figure = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(
+                    "結果ファイルの破損行をスキップしました: %s:%d", path, line_no
+                )
+                continue
+            if isinstance(figure, dict):
+                yield figure
+
+
+def iter_results(path) -> Iterator[dict]:
+    """結果ファイルの図を読み込む（抽出元の画像のキーは取り除く）"""
+    for record in iter_records(path):
+        record.pop(SOURCE_FIELD, None)
+        yield record
+
+
+def read_results(path) -> list[dict]:
+    return list(iter_results(path))
+
+
+def read_sources(path) -> set[str]:
+    """結果ファイルの図を抽出した画像のキー"""
+    keys = set()
+    for record in iter_records(path):
+        images = record.get(SOURCE_FIELD)
+        if isinstance(images, list):
+            keys.update(key for key in images if isinstance(key, str))
+    return keys
@@ -0,0 +1,434 @@
+# ローカルHTTP抽出サービス（ジョブキュー + ワーカープール）
+import base64
+import binascii
+import json
+import logging
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+import pages
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_SUFFIXES = (".jpg", ".jpeg", ".png", ".pdf", ".tif", ".tiff")
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class JobRejected(Exception):
+    """ジョブを受け付けられない場合の例外（HTTPステータスを持つ）"""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ServiceLimits:
+    max_images: int = 50
+    max_image_bytes: int = 20 * 1024 * 1024
+    max_total_bytes: int = 200 * 1024 * 1024
+
+    @property
+    def max_body_bytes(self) -> int:
+        """リクエスト本文の上限（base64 によるサイズ増加分を見込む）"""
+        return self.max_total_bytes * 4 // 3 + 64 * 1024
+
+
+@dataclass
+class Job:
+    id: str
+    output_name: str
+    work_dir: Path
+    images: list[str] = field(default_factory=list)
+    status: str = STATUS_QUEUED
+    error: Optional[str] = None
+    output_path: Optional[Path] = None
+    results: Optional[list] = None
+    failures: list = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "output_name": self.output_name,
+            "images": len(self.images),
+            "error": self.error,
+            "failures": self.failures,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _safe_name(name: str, fallback: str) -> str:
+    """パス成分と危険な文字を取り除いたファイル名を返す"""
+    base = Path(name or "").name
+    base = re.sub(r"[^\w.\-]", "_", base)
+    return base.strip("._") or fallback
+
+
+class ExtractionService:
+    """有界キューでジョブを受け付け、ワーカースレッドでパイプラインを実行する
+
+    パイプラインはワーカーごとに作成するが、Gemini クライアントは
+    1つを全ワーカーで共有し、コネクションプールとクォータを共用する。
+    """
+
+    def __init__(
+        self,
+        pipeline_factory: Callable[[], object],
+        job_dir,
+        workers: int = 2,
+        queue_size: int = 16,
+        limits: Optional[ServiceLimits] = None,
+        shared_client=None,
+        shared_key_pool=None,
+        job_retention: float = 3600.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.pipeline_factory = pipeline_factory
+        self.job_dir = Path(job_dir)
+        self.workers = max(1, workers)
+        self.limits = limits or ServiceLimits()
+        self.shared_client = shared_client
+        # 複数キーのプール（RPM/TPMの枠をワーカー全体で共有する）
+        self.shared_key_pool = shared_key_pool
+        # 完了したジョブと作業フォルダを残す秒数（0以下の場合は削除しない）
+        self.job_retention = job_retention
+        self.clock = clock
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+        self._stop_event = threading.Event()
+
+    def start(self):
+        self._stop_event.clear()
+        self._remove_stale_job_dirs()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"extract-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        self._janitor = threading.Thread(
+            target=self._janitor_loop, name="job-janitor", daemon=True
+        )
+        self._janitor.start()
+        logger.info("抽出サービスのワーカーを %d 個起動しました", self.workers)
+
+    def stop(self):
+        self._stop_event.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def apply_settings(self, settings):
+        """再読み込みした設定のうち、実行中に変更できる値（受付上限・保持期間）を反映する
+
+        ワーカー数・キューの長さ・待ち受けアドレスは再起動時に反映される。
+        """
+        self.limits = limits_from_settings(settings)
+        self.job_retention = settings.job_retention
+        logger.info("サービスの受付上限を再読み込みしました")
+
+    def purge_expired(self) -> int:
+        """保持期間を過ぎた完了済みのジョブと作業フォルダを削除し、削除した数を返す"""
+        if self.job_retention <= 0:
+            return 0
+        cutoff = self.clock() - self.job_retention
+        with self._lock:
+            expired = [
+                job
+                for job in self._jobs.values()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+        if expired:
+            logger.info("保持期間を過ぎたジョブを削除しました: %d 件", len(expired))
+        return len(expired)
+
+    def _remove_stale_job_dirs(self):
+        """前回の起動で残った古い作業フォルダを削除する"""
+        if self.job_retention <= 0 or not self.job_dir.is_dir():
+            return
+        cutoff = self.clock() - self.job_retention
+        for work_dir in self.job_dir.iterdir():
+            try:
+                if work_dir.is_dir() and work_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _janitor_loop(self):
+        while not self._stop_event.wait(60.0):
+            self.purge_expired()
+
+    def submit(self, images: list[tuple[str, bytes]], output_name: str = "") -> Job:
+        """画像を保存してジョブをキューに追加する"""
+        self.purge_expired()
+        if not images:
+            raise JobRejected(HTTPStatus.BAD_REQUEST, "画像が指定されていません")
+        if len(images) > self.limits.max_images:
+            raise JobRejected(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                f"画像は最大 {self.limits.max_images} 枚までです",
+            )
+        total = 0
+        for name, data in images:
+            if Path(name).suffix.lower() not in ALLOWED_SUFFIXES:
+                raise JobRejected(
+                    HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"未対応の形式です: {name}"
+                )
+            if len(data) > self.limits.max_image_bytes:
+                raise JobRejected(
+                    HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"画像が大きすぎます: {name}"
+                )
+            total += len(data)
+        if total > self.limits.max_total_bytes:
+            raise JobRejected(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "ジョブの合計サイズが大きすぎます"
+            )
+
+        job_id = uuid.uuid4().hex
+        work_dir = self.job_dir / job_id
+        work_dir.mkdir(parents=True, exist_ok=True)
+        job = Job(
+            id=job_id,
+            output_name=_safe_name(Path(output_name).stem, job_id),
+            work_dir=work_dir,
+            created_at=self.clock(),
+        )
+        for index, (name, data) in enumerate(images):
+            image_path = work_dir / f"{index:04d}_{_safe_name(name, 'image.png')}"
+            image_path.write_bytes(data)
+            job.images.append(str(image_path))
+
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                shutil.rmtree(work_dir, ignore_errors=True)
+                raise JobRejected(
+                    HTTPStatus.SERVICE_UNAVAILABLE, "ジョブキューが満杯です"
+                ) from None
+            self._jobs[job_id] = job
+        logger.info("ジョブを受け付けました: %s (%d images)", job_id, len(job.images))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _create_pipeline(self):
+        pipeline = self.pipeline_factory()
+        if self.shared_client is not None:
+            pipeline.shared_client = self.shared_client
+            pipeline.generate_client = self.shared_client
+        if self.shared_key_pool is not None:
+            pipeline.key_pool = self.shared_key_pool
+        return pipeline
+
+    def _worker(self):
+        pipeline = None
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            pipeline = self._run_job(pipeline, job)
+
+    def _run_job(self, pipeline, job: Job):
+        """ジョブを実行し、次のジョブで使い回すパイプラインを返す"""
+        job.status = STATUS_RUNNING
+        job.started_at = self.clock()
+        try:
+            if pipeline is None:
+                pipeline = self._create_pipeline()
+            images, unreadable = _expand_pages(job.images)
+            if not images:
+                raise ValueError("読み込める画像がありません")
+            pipeline.uploaded_images = images
+            pipeline.output_name = job.output_name
+            pipeline.output_dir = job.work_dir
+            job.output_path = Path(pipeline.run_pipeline())
+            job.results = getattr(pipeline, "last_results", None)
+            # 失敗した画像があっても、成功した画像のデッキは返す
+            job.failures = unreadable + [
+                {**failure, "image": pages.display_name(failure["image"])}
+                for failure in getattr(pipeline, "last_failures", None) or []
+            ]
+            job.status = STATUS_SUCCEEDED
+            logger.info("ジョブが完了しました: %s", job.id)
+        except Exception as e:
+            job.error = str(e)
+            job.status = STATUS_FAILED
+            logger.exception("ジョブの処理中にエラーが発生しました: %s", job.id)
+        finally:
+            job.finished_at = self.clock()
+        return pipeline
+
+
+def _expand_pages(images) -> tuple[list[str], list[dict]]:
+    """PDF・TIFFをページに展開し、(画像・ページの一覧, 読み込めなかったファイル) を返す"""
+    expanded, unreadable = [], []
+    for image in images:
+        refs, failed = pages.expand_inputs([image])
+        expanded.extend(refs)
+        if failed:
+            unreadable.append(
+                {
+                    "image": Path(image).name,
+                    "stage": "input",
+                    "error": "ページ数を取得できませんでした",
+                }
+            )
+    return expanded, unreadable
+
+
+def _make_handler(service: ExtractionService):
+    class ExtractionRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.info("%s - %s", self.address_string(), format % args)
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message):
+            self._send_json(status, {"error": message})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send_error(HTTPStatus.NOT_FOUND, "not found")
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._send_error(HTTPStatus.BAD_REQUEST, "Content-Length が不正です")
+                return
+            # 再読み込みした上限が反映されるよう、リクエストごとに参照する
+            if length > service.limits.max_body_bytes:
+                self._send_error(
+                    HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "リクエストが大きすぎます"
+                )
+                return
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                images = [
+                    (item["name"], base64.b64decode(item["data"], validate=True))
+                    for item in payload.get("images", [])
+                ]
+            except (ValueError, KeyError, TypeError, binascii.Error):
+                self._send_error(HTTPStatus.BAD_REQUEST, "不正なリクエストです")
+                return
+            try:
+                job = service.submit(images, payload.get("output_name", ""))
+            except JobRejected as e:
+                self._send_error(e.status, str(e))
+                return
+            self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+        def do_GET(self):
+            parts = [part for part in self.path.split("/") if part]
+            if len(parts) < 2 or parts[0] != "jobs":
+                self._send_error(HTTPStatus.NOT_FOUND, "not found")
+                return
+            job = service.get(parts[1])
+            if job is None:
+                self._send_error(HTTPStatus.NOT_FOUND, "ジョブが見つかりません")
+                return
+            if len(parts) == 2:
+                self._send_json(HTTPStatus.OK, job.to_dict())
+                return
+            if job.status != STATUS_SUCCEEDED:
+                self._send_error(HTTPStatus.CONFLICT, f"ジョブは {job.status} です")
+                return
+            if parts[2] == "tokens":
+                self._send_json(HTTPStatus.OK, job.results or [])
+            elif parts[2] == "pptx":
+                data = job.output_path.read_bytes()
+                self.send_response(HTTPStatus.OK)
+                self.send_header(
+                    "Content-Type",
+                    "application/vnd.openxmlformats-officedocument."
+                    "presentationml.presentation",
+                )
+                self.send_header(
+                    "Content-Disposition",
+                    f'attachment; filename="{job.output_path.name}"',
+                )
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_error(HTTPStatus.NOT_FOUND, "not found")
+
+    return ExtractionRequestHandler
+
+
+def create_server(service: ExtractionService, host="127.0.0.1", port=8765):
+    """サービスを公開するHTTPサーバーを作成する（serve_forever は呼び出し側）"""
+    return ThreadingHTTPServer((host, port), _make_handler(service))
+
+
+def service_from_config(pipeline_factory, config_ini, base_dir, shared_client=None):
+    """[SERVICE] セクションの設定からサービスを作成する"""
+    from config import Settings
+
+    return service_from_settings(
+        pipeline_factory,
+        Settings.from_config(config_ini).service,
+        base_dir,
+        shared_client=shared_client,
+    )
+
+
+def service_from_settings(
+    pipeline_factory, settings, base_dir, shared_client=None, shared_key_pool=None
+):
+    """検証済みの ServiceSettings からサービスを作成する"""
+    return ExtractionService(
+        pipeline_factory,
+        Path(base_dir) / settings.job_dir,
+        workers=settings.workers,
+        queue_size=settings.queue_size,
+        limits=limits_from_settings(settings),
+        shared_client=shared_client,
+        shared_key_pool=shared_key_pool,
+        job_retention=settings.job_retention,
+    )
+
+
+def limits_from_settings(settings) -> ServiceLimits:
+    return ServiceLimits(
+        max_images=settings.max_images,
+        max_image_bytes=settings.max_image_bytes,
+        max_total_bytes=settings.max_total_bytes,
+    )
@@ -0,0 +1,223 @@
+# GUIの作業状態（選択中の画像・出力ファイル名・縮小画像・先行アップロード）の保存と復元
+#
+# ウィンドウを閉じるときに session.json と縮小画像のPNGを保存し、次回の起動時に
+# 元の画像を読み込まずに（更新の確認に stat するだけで）一覧と縮小画像を復元する。
+# 元の画像は抽出やプレビューの作り直しで必要になるまで開かない。
+#
+# main から起動時にimportされるため、Pillow は使うときにimportする。
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from image_registry import ImageEntry
+from journal import expires_soon, to_iso
+from pages import split_ref
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_NAME = "session.json"
+THUMBNAIL_DIR = "thumbnails"
+
+
+@dataclass
+class RemoteHandle:
+    """アップロード済みのリモートファイル"""
+
+    name: str
+    expiration_time: Optional[str] = None
+    key_id: Optional[str] = None
+
+    @classmethod
+    def from_file(cls, remote_file, key_id: Optional[str] = None) -> "RemoteHandle":
+        return cls(
+            name=remote_file.name,
+            expiration_time=to_iso(getattr(remote_file, "expiration_time", None)),
+            key_id=key_id,
+        )
+
+
+@dataclass
+class SessionImage:
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: Optional[str] = None
+    thumbnail: Optional[str] = None
+    remote: Optional[RemoteHandle] = None
+
+    def entry(self) -> ImageEntry:
+        """画像一覧（ImageRegistry）に復元するエントリ"""
+        return ImageEntry(self.path, self.size, self.content_hash)
+
+
+@dataclass
+class Session:
+    output_name: str = ""
+    images: list[SessionImage] = field(default_factory=list)
+
+
+def _file_stat(path) -> os.stat_result:
+    return os.stat(split_ref(path)[0])
+
+
+def thumbnail_name(path, size: int, mtime_ns: int) -> str:
+    """縮小画像のファイル名（画像が更新されると別の名前になる）"""
+    file_path, page = split_ref(path)
+    ident = f"{os.path.abspath(file_path)}#{page}:{size}:{mtime_ns}"
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest() + ".png"
+
+
+class SessionStore:
+    """作業状態を directory に保存・復元する
+
+    Args:
+        directory: session.json と縮小画像（thumbnails/）を置くディレクトリ
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = self.directory / SNAPSHOT_NAME
+        self.thumbnail_dir = self.directory / THUMBNAIL_DIR
+
+    def save(self, output_name: str, entries, uploads=None, thumbnails=None):
+        """作業状態を保存する
+
+        Args:
+            output_name: 出力ファイル名
+            entries: 画像一覧のエントリ（ImageEntry）
+            uploads: {パス: RemoteHandle}（完了した先行アップロード）
+            thumbnails: {パス: 縮小画像}（保存済みの縮小画像がない画像の分）
+        """
+        uploads = uploads or {}
+        thumbnails = thumbnails or {}
+        self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        images = []
+        for entry in entries:
+            try:
+                stat = _file_stat(entry.path)
+            except OSError:
+                continue
+            name = thumbnail_name(entry.path, stat.st_size, stat.st_mtime_ns)
+            thumbnail_path = self.thumbnail_dir / name
+            if not thumbnail_path.exists() and entry.path in thumbnails:
+                try:
+                    thumbnails[entry.path].save(thumbnail_path, format="PNG")
+                except Exception as e:
+                    logger.debug("縮小画像を保存できませんでした: %s (%s)", name, e)
+            images.append(
+                SessionImage(
+                    path=entry.path,
+                    size=stat.st_size,
+                    mtime_ns=stat.st_mtime_ns,
+                    content_hash=entry._hash,
+                    thumbnail=name if thumbnail_path.exists() else None,
+                    remote=uploads.get(entry.path),
+                )
+            )
+        self._write(Session(output_name, images))
+        self._prune_thumbnails({image.thumbnail for image in images})
+        logger.info("作業状態を保存しました: %s (%d files)", self.path, len(images))
+
+    def _write(self, session: Session):
+        # 一時ファイルに書いてから置き換える（保存中に終了しても前回の状態が残る）
+        record = {
+            "version": SNAPSHOT_VERSION,
+            "output_name": session.output_name,
+            "images": [
+                {
+                    "path": image.path,
+                    "size": image.size,
+                    "mtime_ns": image.mtime_ns,
+                    "hash": image.content_hash,
+                    "thumbnail": image.thumbnail,
+                    "remote": (
+                        None
+                        if image.remote is None
+                        else {
+                            "name": image.remote.name,
+                            "expiration_time": image.remote.expiration_time,
+                            "key_id": image.remote.key_id,
+                        }
+                    ),
+                }
+                for image in session.images
+            ],
+        }
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+
+    def _prune_thumbnails(self, keep):
+        for path in self.thumbnail_dir.glob("*.png"):
+            if path.name not in keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def load(self) -> Optional[Session]:
+        """保存した作業状態を読み込む（ない・読めない場合はNone）
+
+        削除・更新された画像は一覧から除き、期限が迫ったアップロードは使わない。
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("作業状態を読み込めませんでした: %s (%s)", self.path, e)
+            return None
+        if not isinstance(record, dict) or record.get("version") != SNAPSHOT_VERSION:
+            logger.warning("作業状態の形式が異なるため使いません: %s", self.path)
+            return None
+
+        session = Session(output_name=record.get("output_name") or "")
+        dropped = 0
+        for item in record.get("images", []):
+            try:
+                image = SessionImage(
+                    path=item["path"],
+                    size=item["size"],
+                    mtime_ns=item["mtime_ns"],
+                    content_hash=item.get("hash"),
+                    thumbnail=item.get("thumbnail"),
+                    remote=(
+                        RemoteHandle(**item["remote"]) if item.get("remote") else None
+                    ),
+                )
+                stat = _file_stat(image.path)
+            except (KeyError, TypeError, OSError):
+                dropped += 1
+                continue
+            if stat.st_mtime_ns != image.mtime_ns or stat.st_size != image.size:
+                dropped += 1
+                continue
+            if image.thumbnail and not (self.thumbnail_dir / image.thumbnail).exists():
+                image.thumbnail = None
+            if image.remote is not None and expires_soon(image.remote.expiration_time):
+                image.remote = None
+            session.images.append(image)
+        if dropped:
+            logger.info("削除・更新された画像 %d 個は復元しません", dropped)
+        return session
+
+    def thumbnail_path(self, image: SessionImage) -> Optional[Path]:
+        if not image.thumbnail:
+            return None
+        return self.thumbnail_dir / image.thumbnail
+
+    @staticmethod
+    def open_thumbnail(path):
+        """保存した縮小画像を読み込む"""
+        from PIL import Image
+
+        with Image.open(path) as img:
+            img.load()
+            return img
@@ -0,0 +1,187 @@
+import configparser
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from backends import (
+    ExtractionCancelled,
+    GeminiBackend,
+    RaceBackend,
+    StubBackend,
+    create_backend,
+)
+from config import Settings, SettingsError
+
+
+class FakeBackend:
+    """決まった結果を返す（started で開始を、release で戻るタイミングを制御する）"""
+
+    def __init__(self, name, result=None, error=None, wait=False):
+        self.name = name
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.finished = threading.Event()
+        if not wait:
+            self.release.set()
+        self.calls = []
+
+    def extract(self, files, image_paths=None, model=None, cancel=None):
+        self.calls.append((files, image_paths, model))
+        self.started.set()
+        try:
+            self.release.wait(5)
+            if self.error is not None:
+                raise self.error
+            return self.result
+        finally:
+            self.finished.set()
+
+
+VALID = [{"figure_name": "a.png", "token": ["A"]}]
+
+
+def backend_settings(**options):
+    config = configparser.ConfigParser()
+    config["BACKEND"] = options
+    return Settings.from_config(config).backend
+
+
+def test_stub_returns_one_figure_per_image():
+    """スタブは元の画像の名前（なければファイル名）で図を1つずつ返すことを確認"""
+    stub = StubBackend(tokens=["x"])
+    files = [SimpleNamespace(display_name="a.png"), SimpleNamespace(name="files/b")]
+
+    assert stub.extract(files, image_paths=["dir/a.png", "dir/b.png"]) == [
+        {"figure_name": "a.png", "token": ["x"]},
+        {"figure_name": "b.png", "token": ["x"]},
+    ]
+    assert [figure["figure_name"] for figure in stub.extract(files)] == [
+        "a.png",
+        "files/b",
+    ]
+
+
+def test_gemini_backend_prefers_its_own_model():
+    """競争の相手に指定したモデルが呼び出し側のモデルより優先されることを確認"""
+    calls = []
+    pipeline = SimpleNamespace(
+        generate_with_gemini=lambda files, model=None, cancel=None: (
+            calls.append(model) or VALID
+        )
+    )
+
+    GeminiBackend(pipeline).extract(["f"], model="fast")
+    GeminiBackend(pipeline, model="other").extract(["f"], model="fast")
+
+    assert calls == ["fast", "other"]
+    assert GeminiBackend(pipeline, model="other").name == "gemini:other"
+
+
+def test_race_returns_first_valid_result():
+    """先に返ったバックエンドの結果を、遅い方を待たずに使うことを確認"""
+    slow = FakeBackend("slow", result=[{"figure_name": "slow", "token": []}], wait=True)
+    fast = FakeBackend("fast", result=VALID)
+    race = RaceBackend(slow, fast)
+
+    try:
+        assert race.extract(["f"], image_paths=["a.png"], model="m") == VALID
+        assert race.wins == {"fast": 1}
+        assert slow.started.wait(5)
+        assert slow.calls == [(["f"], ["a.png"], "m")]
+    finally:
+        slow.release.set()
+
+
+def test_race_counts_losers_separately():
+    """負けた方は、送信前にやめたか・結果を捨てたかを勝ちとは別に数えることを確認"""
+
+    class Cancellable(FakeBackend):
+        def extract(self, files, image_paths=None, model=None, cancel=None):
+            self.calls.append(files)
+            try:
+                cancel.wait(5)
+                raise ExtractionCancelled(sent=False)
+            finally:
+                self.finished.set()
+
+    waiting = Cancellable("waiting")
+    race = RaceBackend(waiting, FakeBackend("fast", result=VALID))
+    assert race.extract(["f"]) == VALID
+    assert waiting.finished.wait(5)
+
+    slow = FakeBackend("slow", result=VALID, wait=True)
+    race_sent = RaceBackend(slow, FakeBackend("fast", result=VALID))
+    assert race_sent.extract(["f"]) == VALID
+    slow.release.set()
+    assert slow.finished.wait(5)
+
+    for _ in range(100):
+        if race.cancelled and race_sent.wasted:
+            break
+        threading.Event().wait(0.01)
+    assert race.cancelled == {"waiting": 1}
+    assert not race.wasted
+    assert race_sent.wasted == {"slow": 1}
+    assert race_sent.wins == {"fast": 1}
+
+
+def test_race_skips_invalid_and_failed_results():
+    """構造が不正な結果と例外は無視し、もう一方の有効な結果を待つことを確認"""
+    broken = FakeBackend("broken", result=[{"figure_name": "a.png"}])
+    slow = FakeBackend("slow", result=VALID, wait=True)
+    race = RaceBackend(broken, slow)
+    threading.Timer(0.05, slow.release.set).start()
+
+    assert race.extract(["f"]) == VALID
+    assert race.wins == {"slow": 1}
+
+    failing = FakeBackend("failing", error=RuntimeError("quota"))
+    assert RaceBackend(failing, FakeBackend("ok", result=VALID)).extract(["f"]) == VALID
+
+
+def test_race_raises_when_both_fail():
+    """両方とも失敗した場合は例外を送出することを確認"""
+    race = RaceBackend(
+        FakeBackend("a", error=RuntimeError("quota")),
+        FakeBackend("b", result="not a list"),
+    )
+
+    with pytest.raises((RuntimeError, ValueError)):
+        race.extract(["f"])
+
+
+def test_create_backend_from_settings():
+    """[BACKEND] の設定から単独のバックエンドと競争のバックエンドを作ることを確認"""
+    pipeline = SimpleNamespace()
+
+    assert isinstance(create_backend(backend_settings(), pipeline), GeminiBackend)
+    assert isinstance(
+        create_backend(backend_settings(name="stub"), pipeline), StubBackend
+    )
+
+    race = create_backend(
+        backend_settings(race_with="gemini", race_model="gemini-2.5-pro"), pipeline
+    )
+    assert isinstance(race, RaceBackend)
+    assert race.name == "race(gemini, gemini:gemini-2.5-pro)"
+
+
+def test_pointless_races_are_rejected():
+    """スタブとの競争と、同じモデル同士の競争は設定の読み込み時にエラーになることを確認"""
+    with pytest.raises(SettingsError):
+        backend_settings(race_with="stub")
+    with pytest.raises(SettingsError):
+        backend_settings(name="stub", race_with="gemini", race_model="gemini-2.5-pro")
+    with pytest.raises(SettingsError):
+        backend_settings(race_with="gemini")
+    with pytest.raises(SettingsError):
+        backend_settings(race_with="gemini", race_model="gemini-2.5-flash")
+
+
+def test_invalid_backend_name_is_rejected():
+    """不明なバックエンド名は設定の読み込み時にエラーになることを確認"""
+    with pytest.raises(ValueError):
+        backend_settings(name="openai")
@@ -0,0 +1,101 @@
+import pytest
+
+pytest.importorskip("numpy")
+from PIL import Image, ImageDraw
+
+from cascade import CascadeStats, escalation_reasons, image_complexity, schema_errors
+
+
+def save_image(path, lines=0):
+    img = Image.new("RGB", (400, 300), "white")
+    draw = ImageDraw.Draw(img)
+    for index in range(lines):
+        y = 10 + index * 6
+        draw.line([(10, y), (390, y)], fill="black", width=1)
+    img.save(path)
+    return str(path)
+
+
+class TestImageComplexity:
+    def test_blank_image_has_no_complexity(self, tmp_path):
+        """無地の画像の複雑さが0になることを確認"""
+        assert image_complexity(save_image(tmp_path / "blank.png")) == 0.0
+
+    def test_busy_image_is_more_complex(self, tmp_path):
+        """線の多い画像ほど複雑さが大きくなることを確認"""
+        few = image_complexity(save_image(tmp_path / "few.png", lines=3))
+        many = image_complexity(save_image(tmp_path / "many.png", lines=40))
+        assert 0 < few < many <= 1
+
+    def test_unreadable_image(self, tmp_path):
+        """読み込めない画像の複雑さは0として扱うことを確認"""
+        broken = tmp_path / "broken.png"
+        broken.write_bytes(b"not an image")
+        assert image_complexity(str(broken)) == 0.0
+
+
+class TestEscalationReasons:
+    def test_good_result_is_not_escalated(self, tmp_path):
+        """十分なトークンがある結果は再抽出しないことを確認"""
+        image = save_image(tmp_path / "a.png", lines=3)
+        result = [{"figure_name": "Fig. 1", "token": ["0", "10", "20", "Time (s)"]}]
+        assert escalation_reasons(result, [image], tokens_per_complexity=10) == []
+
+    def test_schema_violation(self):
+        """スキーマに合わない結果を検出することを確認"""
+        assert schema_errors({"figure_name": "x"})
+        assert schema_errors([{"figure_name": "x", "token": [1]}])
+        assert escalation_reasons([{"token": []}], [])
+
+    def test_empty_figures(self):
+        """図がない・トークンのない図がある場合に再抽出することを確認"""
+        assert escalation_reasons([], [])
+        result = [
+            {"figure_name": "a", "token": ["1"]},
+            {"figure_name": "b", "token": []},
+        ]
+        reasons = escalation_reasons(result, [], tokens_per_complexity=0)
+        assert any("b" in reason for reason in reasons)
+
+    def test_unclassified_ratio(self):
+        """Unclassified の割合が高い場合に再抽出することを確認"""
+        result = [
+            {"figure_name": "a", "token": ["1", "2"]},
+            {"figure_name": "Unclassified", "token": ["?", "??"]},
+        ]
+        assert escalation_reasons(
+            result, [], max_unclassified_ratio=0.3, tokens_per_complexity=0
+        )
+        assert not escalation_reasons(
+            result, [], max_unclassified_ratio=0.6, tokens_per_complexity=0
+        )
+
+    def test_too_few_tokens_for_complex_image(self, tmp_path):
+        """複雑な画像に対してトークンが少ない場合に再抽出することを確認"""
+        image = save_image(tmp_path / "busy.png", lines=40)
+        result = [{"figure_name": "Fig. 1", "token": ["1"]}]
+        assert escalation_reasons(result, [image], tokens_per_complexity=100)
+
+
+class TestCascadeStats:
+    def test_latency_saved(self):
+        """再抽出した割合と短縮できた時間が集計されることを確認"""
+        stats = CascadeStats()
+        assert stats.latency_saved() is None
+        stats.record(1, fast_seconds=1.0, strong_seconds=None)
+        stats.record(1, fast_seconds=1.0, strong_seconds=None)
+        stats.record(1, fast_seconds=1.0, strong_seconds=4.0)
+        stats.record(1, fast_seconds=1.0, strong_seconds=None)
+        assert stats.escalated_ratio == 0.25
+        # すべて通常のモデルなら 4 × 4.0 秒、実際は 4.0 + 4.0 秒
+        assert stats.latency_saved() == pytest.approx(8.0)
+        assert stats.as_dict()["escalated"] == 1
+
+    def test_latency_saved_uses_wall_clock(self):
+        """並列に抽出した場合は実際の経過時間と比べることを確認"""
+        stats = CascadeStats()
+        stats.record(1, fast_seconds=1.0, strong_seconds=4.0)
+        stats.record(1, fast_seconds=1.0, strong_seconds=None)
+        stats.record_wall(5.0)
+        # カスケードなしのバッチ抽出の見積もり 2 × 4.0 秒、実際は 5.0 秒
+        assert stats.latency_saved() == pytest.approx(3.0)
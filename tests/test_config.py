@@ -182,3 +182,96 @@ class TestConfig:
         assert len(config["GUI_SETTINGS"]) == len(config_params["GUI_SETTINGS"])
         assert len(config["LOGGING"]) == len(config_params["LOGGING"])
         assert len(config["PPTX_SETTINGS"]) == len(config_params["PPTX_SETTINGS"])
+
+
+class TestSettings:
+    """型付き設定（Settings）のテスト"""
+
+    def test_values_are_converted(self, temp_config_file):
+        """設定値が型変換されて読み込まれることを確認"""
+        from config import load_settings
+
+        settings = load_settings(temp_config_file)
+
+        assert settings.gemini.model == "gemini-2.5-pro"
+        assert settings.gemini.request_timeout == 300.0
+        assert settings.gemini.hedge_percentile == 0.0
+        assert settings.pptx.font_size == 14
+        assert settings.pptx.char_width_in == pytest.approx(0.097)
+        assert settings.pptx.line_height_in == pytest.approx(1.3 * 14 / 72)
+        assert settings.watch.deck_mode == "rolling"
+        assert settings.service.port == 8765
+
+    def test_settings_are_immutable(self, temp_config_file):
+        """設定オブジェクトが変更できないことを確認"""
+        import dataclasses
+        from config import load_settings
+
+        settings = load_settings(temp_config_file)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            settings.pptx.font_size = 20
+
+    def test_invalid_values_are_reported_together(self, config_params):
+        """不正な値がまとめてSettingsErrorとして報告されることを確認"""
+        from config import Settings, SettingsError
+
+        config_params["PPTX_SETTINGS"]["font_size"] = "big"
+        config_params["GUI_SETTINGS"]["window_size"] = "wide"
+        config_params["LOGGING"]["log-level"] = "LOUD"
+        config = ConfigParser(interpolation=None)
+        config.read_dict(config_params)
+
+        with pytest.raises(SettingsError) as excinfo:
+            Settings.from_config(config)
+        assert len(excinfo.value.errors) == 3
+        assert isinstance(excinfo.value, ValueError)
+
+    def test_rotation_when_is_validated(self, config_params):
+        """[LOGGING] when はローテーションのハンドラが受け付ける値だけを許すことを確認"""
+        from config import Settings, SettingsError
+
+        config = ConfigParser(interpolation=None)
+        config_params["LOGGING"]["when"] = "w6"
+        config.read_dict(config_params)
+        assert Settings.from_config(config).logging.when == "w6"
+
+        config["LOGGING"]["when"] = "bogus"
+        with pytest.raises(SettingsError) as excinfo:
+            Settings.from_config(config)
+        assert "[LOGGING] when" in excinfo.value.errors[0]
+
+
+class TestSettingsWatcher:
+    """設定ファイルの再読み込みのテスト"""
+
+    @staticmethod
+    def rewrite(path, old, new):
+        import os
+
+        text = path.read_text(encoding="utf-8").replace(old, new)
+        path.write_text(text, encoding="utf-8")
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_reload_on_change(self, temp_config_file):
+        """ファイルが更新されたら新しい設定が通知されることを確認"""
+        from config import SettingsWatcher
+
+        watcher = SettingsWatcher(temp_config_file)
+        received = []
+        watcher.subscribe(lambda settings, config_ini: received.append(settings))
+        assert watcher.reload_if_changed() is False
+
+        self.rewrite(temp_config_file, "font_size = 14", "font_size = 20")
+        assert watcher.reload_if_changed() is True
+        assert watcher.get().pptx.font_size == 20
+        assert received[0].pptx.font_size == 20
+
+    def test_invalid_reload_keeps_previous_settings(self, temp_config_file):
+        """不正な設定に更新された場合は以前の設定を使い続けることを確認"""
+        from config import SettingsWatcher
+
+        watcher = SettingsWatcher(temp_config_file)
+        self.rewrite(temp_config_file, "font_size = 14", "font_size = -1")
+        assert watcher.reload_if_changed() is False
+        assert watcher.get().pptx.font_size == 14
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from hedging import DeadlineExceeded, HedgeBudget, LatencyTracker, hedged_call
+
+
+class TestLatencyTracker:
+    def test_no_delay_until_enough_samples(self):
+        """サンプルが少ない間はヘッジしないことを確認"""
+        tracker = LatencyTracker(percentile=90, min_samples=3)
+        tracker.record(1.0)
+        tracker.record(2.0)
+        assert tracker.delay() is None
+
+    def test_delay_is_percentile(self):
+        """ヘッジまでの待ち時間が指定したパーセンタイルになることを確認"""
+        tracker = LatencyTracker(percentile=90, min_samples=1)
+        for seconds in range(1, 11):
+            tracker.record(float(seconds))
+        assert tracker.delay() == 10.0
+        tracker.percentile = 50
+        assert tracker.delay() == 6.0
+
+    def test_zero_percentile_disables_hedging(self):
+        """percentile=0の場合はヘッジしないことを確認"""
+        tracker = LatencyTracker(percentile=0, min_samples=1)
+        tracker.record(1.0)
+        assert tracker.delay() is None
+
+
+class TestHedgeBudget:
+    def test_hedges_are_limited_to_ratio(self):
+        """ヘッジの回数がリクエスト数の一定割合に抑えられることを確認"""
+        budget = HedgeBudget(max_ratio=0.25, burst=1.0)
+        granted = 0
+        for _ in range(20):
+            budget.on_request()
+            granted += budget.try_acquire()
+        assert granted == 5
+
+
+class TestHedgedCall:
+    def test_without_deadline_or_hedge_calls_directly(self):
+        """期限もヘッジもない場合は呼び出し元のスレッドで実行されることを確認"""
+        seen = []
+        result = hedged_call(lambda timeout: seen.append(timeout) or "ok")
+        assert result == "ok"
+        assert seen == [None]
+
+    def test_hedge_wins_when_primary_is_slow(self):
+        """最初のリクエストが遅い場合は複製の結果を使うことを確認"""
+        release = threading.Event()
+        calls = []
+
+        def attempt(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        try:
+            assert hedged_call(attempt, deadline=10, hedge_delay=0.05) == "fast"
+        finally:
+            release.set()
+        assert len(calls) == 2
+        # 複製には残り時間が渡される
+        assert 0 < calls[1] < 10
+
+    def test_hedge_not_sent_when_not_allowed(self):
+        """allow_hedgeがFalseを返す場合は複製を送らないことを確認"""
+        calls = []
+
+        def attempt(timeout):
+            calls.append(timeout)
+            time.sleep(0.2)
+            return "primary"
+
+        result = hedged_call(attempt, hedge_delay=0.01, allow_hedge=lambda: False)
+        assert result == "primary"
+        assert len(calls) == 1
+
+    def test_deadline_exceeded(self):
+        """期限までに完了しない場合はDeadlineExceededになることを確認"""
+        release = threading.Event()
+        try:
+            with pytest.raises(DeadlineExceeded):
+                hedged_call(lambda timeout: release.wait(5), deadline=0.05)
+        finally:
+            release.set()
+
+    def test_errors_propagate(self):
+        """すべてのリクエストが失敗した場合は例外が伝播することを確認"""
+
+        def attempt(timeout):
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError, match="boom"):
+            hedged_call(attempt, deadline=5, hedge_delay=1)
@@ -0,0 +1,165 @@
+import pytest
+from PIL import Image
+
+from image_cache import DecodedImageCache
+
+
+@pytest.fixture
+def counting_cache(monkeypatch):
+    """デコードした回数を数えるキャッシュ"""
+    cache = DecodedImageCache()
+    decoded = []
+    original = cache._decode
+
+    def decode(ref):
+        decoded.append(ref)
+        return original(ref)
+
+    monkeypatch.setattr(cache, "_decode", decode)
+    return cache, decoded
+
+
+def save_image(path, size=(40, 20), color="red", **kwargs):
+    Image.new("RGB", size, color).save(path, **kwargs)
+    return str(path)
+
+
+def test_preview_preprocessing_and_upload_decode_once(counting_cache, tmp_path):
+    """プレビュー・前処理・アップロードで画像を1回だけデコードすることを確認"""
+    cache, decoded = counting_cache
+    path = save_image(tmp_path / "a.png")
+
+    thumbnail = cache.thumbnail(path, (10, 10))
+    with cache.open(path) as img:
+        assert img.size == (40, 20)
+    with cache.upload_source(path) as source:
+        # そのまま送れる画像はファイルを送る
+        assert source == path
+
+    assert thumbnail.size == (10, 5)
+    assert decoded == [path]
+    assert cache.thumbnail(path, (10, 10)) is thumbnail
+
+
+def test_same_content_shares_one_decode(counting_cache, tmp_path):
+    """内容が同じ画像は別のパスでも1回だけデコードすることを確認"""
+    cache, decoded = counting_cache
+    first = save_image(tmp_path / "first.png")
+    second = tmp_path / "second.png"
+    second.write_bytes((tmp_path / "first.png").read_bytes())
+
+    assert cache.get(first) is cache.get(str(second))
+    assert len(decoded) == 1
+
+
+def test_modified_file_is_decoded_again(counting_cache, tmp_path):
+    """ファイルが書き換えられた場合はデコードし直すことを確認"""
+    cache, decoded = counting_cache
+    path = save_image(tmp_path / "a.png")
+    cache.get(path)
+    save_image(tmp_path / "a.png", size=(30, 30), color="blue")
+
+    assert cache.get(path).size == (30, 30)
+    assert len(decoded) == 2
+
+
+def test_exif_orientation_is_applied_once(counting_cache, tmp_path):
+    """EXIFの向きを反映した画像をプレビューとアップロードで共有することを確認"""
+    cache, decoded = counting_cache
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 時計回りに90度回転して表示する
+    path = save_image(tmp_path / "rotated.jpg", size=(40, 20), exif=exif)
+
+    assert cache.get(path).size == (20, 40)
+    with cache.upload_source(path) as source:
+        assert source != path
+        with Image.open(source) as uploaded:
+            assert uploaded.format == "PNG"
+            assert uploaded.size == (20, 40)
+    assert decoded == [path]
+
+
+def test_cmyk_image_is_normalized(tmp_path):
+    """RGB・RGBA・L 以外の形式はRGBに変換されることを確認"""
+    cache = DecodedImageCache()
+    path = tmp_path / "cmyk.jpg"
+    Image.new("CMYK", (8, 8)).save(path)
+
+    assert cache.get(str(path)).mode == "RGB"
+
+
+def test_memory_budget_evicts_least_recently_used(counting_cache, tmp_path):
+    """上限を超えた場合は長く使われていない画像から捨てることを確認"""
+    cache, decoded = counting_cache
+    # 40x20のRGB画像は2400バイト
+    cache.set_max_bytes(5000)
+    a = save_image(tmp_path / "a.png", color="red")
+    b = save_image(tmp_path / "b.png", color="green")
+    c = save_image(tmp_path / "c.png", color="blue")
+
+    cache.get(a)
+    cache.get(b)
+    cache.get(a)
+    cache.get(c)
+
+    assert cache.size_bytes <= 5000
+    decoded.clear()
+    cache.get(a)
+    cache.get(b)
+    assert decoded == [b]
+
+
+def test_zero_budget_keeps_nothing(counting_cache, tmp_path):
+    """上限が0の場合は保持せず、毎回デコードすることを確認"""
+    cache, decoded = counting_cache
+    cache.set_max_bytes(0)
+    path = save_image(tmp_path / "a.png")
+
+    cache.get(path)
+    cache.get(path)
+
+    assert len(decoded) == 2
+    assert cache.size_bytes == 0
+
+
+def test_retained_pages_are_bounded(counting_cache, tmp_path):
+    """保持するページの枚数が max_decoded_pages を超えないことを確認"""
+    cache, decoded = counting_cache
+    cache.set_max_pages(2)
+    tiff = tmp_path / "scan.tiff"
+    frames = [Image.new("RGB", (20, 20), c) for c in ("red", "green", "blue", "gray")]
+    frames[0].save(tiff, save_all=True, append_images=frames[1:])
+    refs = [f"{tiff}#page={page}" for page in range(1, 5)]
+
+    for ref in refs:
+        cache.get(ref)
+        assert cache.retained_pages <= 2
+    # 縮小画像はページの枚数に数えない
+    cache.thumbnail(refs[-1], (5, 5))
+
+    assert cache.retained_pages == 2
+    decoded.clear()
+    cache.get(refs[-1])
+    cache.get(refs[0])
+    assert decoded == [refs[0]]
+
+
+def test_grayscale_does_not_fill_cache(counting_cache, tmp_path):
+    """解析用のグレースケール画像は縮小して読み込み、キャッシュに入れないことを確認"""
+    cache, decoded = counting_cache
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    path = save_image(tmp_path / "big.jpg", size=(800, 400), exif=exif)
+
+    gray, size = cache.grayscale(path, 100)
+
+    assert size == (400, 800)
+    assert gray.mode == "L"
+    assert gray.width < gray.height <= 400
+    assert decoded == []
+    assert cache.size_bytes == 0
+
+    # デコード済みの画像があればそれを使う
+    cache.get(path)
+    assert cache.grayscale(path, 100)[0].size == (400, 800)
+    assert len(decoded) == 1
@@ -0,0 +1,114 @@
+import time
+from unittest.mock import patch
+
+import image_registry
+from image_registry import ImageEntry, ImageRegistry
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+class TestImageRegistry:
+    def test_same_name_with_different_content_is_added(self, tmp_path):
+        """ファイル名が同じでも内容が違えば追加されることを確認"""
+        registry = ImageRegistry()
+        first = write(tmp_path / "a" / "figure.png", b"first")
+        second = write(tmp_path / "b" / "figure.png", b"other")
+
+        added, skipped = registry.add_many([first, second])
+
+        assert [entry.path for entry in added] == [first, second]
+        assert skipped == 0
+        assert registry.paths == [first, second]
+
+    def test_same_content_is_skipped(self, tmp_path):
+        """内容が同じ画像は別名でも追加されないことを確認"""
+        registry = ImageRegistry()
+        original = write(tmp_path / "a.png", b"same")
+        copy = write(tmp_path / "copy.png", b"same")
+
+        added, skipped = registry.add_many([original, copy, original])
+
+        assert [entry.path for entry in added] == [original]
+        assert skipped == 2
+
+    def test_unreadable_files_are_skipped(self, tmp_path):
+        """存在しないファイルはスキップされることを確認"""
+        registry = ImageRegistry()
+        added, skipped = registry.add_many([str(tmp_path / "missing.png")])
+        assert added == []
+        assert skipped == 1
+
+    def test_remove_allows_adding_again(self, tmp_path):
+        """削除した画像と同じ内容の画像を再び追加できることを確認"""
+        registry = ImageRegistry()
+        original = write(tmp_path / "a.png", b"same")
+        copy = write(tmp_path / "b.png", b"same")
+        registry.add(original)
+        registry.remove(original)
+
+        assert registry.add(copy) is not None
+        assert original not in registry
+        assert copy in registry
+
+    def test_replace_keeps_given_paths(self, tmp_path):
+        """replace では指定したパスがそのまま（内容の重複も含めて）使われることを確認"""
+        first = write(tmp_path / "a.png", b"same")
+        second = write(tmp_path / "b.png", b"same")
+        registry = ImageRegistry([first])
+
+        registry.replace([first, second, first])
+
+        assert registry.paths == [first, second]
+
+    def test_restore_uses_saved_hashes(self, tmp_path):
+        """restore では保存したハッシュを使い、ファイルを読み込まずに重複を判定することを確認"""
+        first = write(tmp_path / "a.png", b"same")
+        second = write(tmp_path / "b.png", b"same")
+        registry = ImageRegistry()
+
+        with patch.object(image_registry, "file_digest") as digest:
+            registry.restore([ImageEntry(first, 4, "saved-hash")])
+            assert registry.paths == [first]
+            assert next(iter(registry)).content_hash == "saved-hash"
+        digest.assert_not_called()
+
+        # 保存したハッシュと同じ内容の画像は追加しない
+        with patch.object(image_registry, "file_digest", return_value="saved-hash"):
+            assert registry.add(second) is None
+
+    def test_pages_share_one_file_hash(self, tmp_path):
+        """同じファイルのページはファイルのハッシュを1回だけ計算することを確認"""
+        document = write(tmp_path / "doc.pdf", b"%PDF-1.4 dummy")
+        registry = ImageRegistry()
+
+        with patch(
+            "image_registry.file_digest", wraps=image_registry.file_digest
+        ) as digest:
+            added, skipped = registry.add_many(
+                f"{document}#page={page}" for page in range(1, 6)
+            )
+
+        assert len(added) == 5
+        assert skipped == 0
+        assert digest.call_count == 1
+
+    def test_adding_many_files_is_fast(self, tmp_path):
+        """2万件の追加が一覧の長さに比例する時間で終わることを確認"""
+        paths = []
+        for index in range(20000):
+            path = tmp_path / f"{index}.png"
+            path.write_bytes(b"x" * (index % 50 + 1) + str(index).encode())
+            paths.append(str(path))
+        registry = ImageRegistry()
+
+        start = time.perf_counter()
+        added, skipped = registry.add_many(paths)
+        elapsed = time.perf_counter() - start
+
+        assert len(added) == 20000
+        assert skipped == 0
+        assert elapsed < 5.0
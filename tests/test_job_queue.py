@@ -0,0 +1,140 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from job_queue import (
+    STATUS_CANCELLED,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    STATUS_SUCCEEDED,
+    DeckQueue,
+)
+
+
+class FakePipeline:
+    """run_pipelineの代わりに画像を1枚ずつ「抽出」するパイプライン"""
+
+    runs = []
+
+    def __init__(self):
+        self.uploaded_images = []
+        self.output_name = ""
+        self.on_progress = None
+        self.cancel_event = threading.Event()
+        self.last_failures = []
+
+    def run_pipeline(self, resume=False, append=False):
+        FakePipeline.runs.append(self.output_name)
+        if "broken" in self.output_name:
+            raise ValueError("extraction failed")
+        for done in range(1, len(self.uploaded_images) + 1):
+            if self.cancel_event.is_set():
+                raise RuntimeError("cancelled")
+            self.on_progress(done, len(self.uploaded_images))
+        return Path(f"{self.output_name}.pptx")
+
+
+@pytest.fixture(autouse=True)
+def reset_runs():
+    FakePipeline.runs = []
+
+
+def make_images(tmp_path, prefix, sizes):
+    paths = []
+    for index, size in enumerate(sizes):
+        path = tmp_path / f"{prefix}_{index}.png"
+        path.write_bytes(b"x" * size)
+        paths.append(str(path))
+    return paths
+
+
+def wait_finished(queue, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(job.finished for job in queue.jobs()):
+            return
+        time.sleep(0.01)
+    raise AssertionError("ジョブが終わりませんでした")
+
+
+def test_jobs_run_by_priority_then_largest_first(tmp_path):
+    """優先度の高い順、同じ優先度では画像の合計サイズが大きい順に実行することを確認"""
+    queue = DeckQueue(FakePipeline, max_parallel_jobs=1)
+    queue.submit("small", make_images(tmp_path, "small", [10]))
+    queue.submit("large", make_images(tmp_path, "large", [500, 500]))
+    queue.submit("urgent", make_images(tmp_path, "urgent", [10]), priority=5)
+
+    assert [job.output_name for job in queue.scheduled()] == [
+        "urgent",
+        "large",
+        "small",
+    ]
+    queue.start()
+    wait_finished(queue)
+    queue.stop()
+
+    assert FakePipeline.runs == ["urgent", "large", "small"]
+
+
+def test_progress_and_result_are_recorded(tmp_path):
+    """ジョブごとの進捗・出力先が記録され、変化が通知されることを確認"""
+    changes = []
+    queue = DeckQueue(
+        FakePipeline,
+        on_change=lambda job: changes.append((job.status, job.done, job.total)),
+    )
+    queue.start()
+    job = queue.submit("deck", make_images(tmp_path, "deck", [10, 20, 30]))
+    wait_finished(queue)
+    queue.stop()
+
+    assert job.status == STATUS_SUCCEEDED
+    assert job.output_path == Path("deck.pptx")
+    assert (job.done, job.total) == (3, 3)
+    assert changes[0] == (STATUS_QUEUED, 0, 3)
+    assert changes[-1] == (STATUS_SUCCEEDED, 3, 3)
+    assert "完了" in job.describe()
+
+
+def test_failed_job_does_not_stop_queue(tmp_path):
+    """失敗したジョブは記録され、後続のジョブは処理されることを確認"""
+    queue = DeckQueue(FakePipeline, max_parallel_jobs=1)
+    broken = queue.submit("broken", make_images(tmp_path, "broken", [10]), priority=1)
+    ok = queue.submit("ok", make_images(tmp_path, "ok", [10]))
+    queue.start()
+    wait_finished(queue)
+    queue.stop()
+
+    assert broken.status == STATUS_FAILED
+    assert broken.error == "extraction failed"
+    assert ok.status == STATUS_SUCCEEDED
+
+
+def test_cancelled_job_is_skipped(tmp_path):
+    """待機中に取り消したジョブは実行しないことを確認"""
+    queue = DeckQueue(FakePipeline, max_parallel_jobs=1)
+    job = queue.submit("cancelled", make_images(tmp_path, "cancelled", [10]))
+    kept = queue.submit("kept", make_images(tmp_path, "kept", [10]))
+
+    assert queue.cancel(job.id)
+    queue.start()
+    wait_finished(queue)
+    queue.stop()
+
+    assert job.status == STATUS_CANCELLED
+    assert kept.status == STATUS_SUCCEEDED
+    assert FakePipeline.runs == ["kept"]
+    assert not queue.cancel(job.id)
+
+
+def test_submit_rejects_duplicate_or_empty_jobs(tmp_path):
+    """画像のないジョブと、未完了のジョブと同じファイル名のジョブを拒否することを確認"""
+    queue = DeckQueue(FakePipeline)
+    queue.submit("deck", make_images(tmp_path, "deck", [10]))
+
+    with pytest.raises(ValueError, match="同じファイル名"):
+        queue.submit("deck", make_images(tmp_path, "other", [10]))
+    with pytest.raises(ValueError, match="画像がありません"):
+        queue.submit("empty", [])
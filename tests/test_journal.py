@@ -0,0 +1,128 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
+import pytest
+
+from journal import RunJournal, image_key, STATE_EXTRACTED, STATE_UPLOADED
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return tmp_path / "deck.journal.jsonl"
+
+
+def make_remote_file(name, expires_in=timedelta(hours=48)):
+    remote_file = Mock()
+    remote_file.name = name
+    remote_file.expiration_time = datetime.now(timezone.utc) + expires_in
+    return remote_file
+
+
+class TestImageKey:
+    def test_key_changes_when_file_changes(self, tmp_path):
+        """ファイル内容が変わるとキーも変わることを確認"""
+        image = tmp_path / "a.png"
+        image.write_bytes(b"one")
+        before = image_key(image)
+        image.write_bytes(b"longer content")
+        assert image_key(image) != before
+
+
+class TestRunJournal:
+    def test_replay_restores_state(self, journal_path):
+        """再開時にアップロード・抽出状態が復元されることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_upload("a", make_remote_file("files/a"))
+        journal.record_upload("b", make_remote_file("files/b"))
+        journal.record_extracted(["a"], [{"figure_name": "a", "token": ["1"]}])
+
+        restored = RunJournal(journal_path, resume=True)
+        assert restored.state("a") == STATE_EXTRACTED
+        assert restored.state("b") == STATE_UPLOADED
+        assert restored.remote_name("b") == "files/b"
+        assert restored.results(["a", "b"]) == [{"figure_name": "a", "token": ["1"]}]
+
+    def test_new_run_discards_previous_journal(self, journal_path):
+        """resume=Falseの場合は前回のジャーナルが破棄されることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_extracted(["a"], [])
+
+        fresh = RunJournal(journal_path, resume=False)
+        assert fresh.state("a") != STATE_EXTRACTED
+        assert not journal_path.exists()
+
+    def test_leftover_uploads(self, journal_path):
+        """削除が記録されていないアップロードだけが一覧されることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_upload("a", make_remote_file("files/a"), key_id="key0")
+        journal.record_upload("b", make_remote_file("files/b"))
+        journal.record_deleted(["b"])
+        assert journal.leftover_uploads() == [("files/a", "key0")]
+
+    def test_truncated_last_line_is_ignored(self, journal_path):
+        """書き込み途中の最終行があっても復元できることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_extracted(["a"], [{"figure_name": "a", "token": []}])
+        with open(journal_path, "a", encoding="utf-8") as f:
+            f.write('{"event": "extracted", "batch": 1, "ima')
+
+        restored = RunJournal(journal_path, resume=True)
+        assert restored.is_extracted("a")
+
+    def test_expired_remote_file_is_not_reused(self, journal_path):
+        """期限切れのリモートファイルは再利用されないことを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_upload("a", make_remote_file("files/a", timedelta(minutes=1)))
+        assert journal.remote_name("a") is None
+
+    def test_deleted_remote_file_is_not_reused(self, journal_path):
+        """削除済みのリモートファイルは再利用されないことを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_upload("a", make_remote_file("files/a"))
+        journal.record_deleted(["a"])
+        assert journal.remote_name("a") is None
+
+    def test_results_follow_image_order(self, journal_path):
+        """バッチ結果が画像順に1回ずつ連結されることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_extracted(["c"], [{"figure_name": "c", "token": []}])
+        journal.record_extracted(
+            ["a", "b"],
+            [{"figure_name": "a", "token": []}, {"figure_name": "b", "token": []}],
+        )
+
+        names = [f["figure_name"] for f in journal.results(["a", "b", "c"])]
+        assert names == ["a", "b", "c"]
+
+    def test_done_is_recorded(self, journal_path):
+        """完了イベントが記録されることを確認"""
+        journal = RunJournal(journal_path)
+        journal.record_done("out.pptx")
+
+        lines = journal_path.read_text(encoding="utf-8").splitlines()
+        assert json.loads(lines[-1])["event"] == "done"
+        assert RunJournal(journal_path, resume=True).completed
+
+
+def test_concurrent_extractions_get_distinct_batches(tmp_path):
+    """複数のスレッドから記録しても抽出結果が混ざらないことを確認"""
+    import threading
+
+    journal = RunJournal(tmp_path / "run.journal.jsonl")
+    threads = [
+        threading.Thread(
+            target=journal.record_extracted,
+            args=([f"key{index}"], [{"figure_name": str(index), "token": []}]),
+        )
+        for index in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = journal.results([f"key{index}" for index in range(20)])
+    assert [figure["figure_name"] for figure in results] == [
+        str(index) for index in range(20)
+    ]
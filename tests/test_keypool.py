@@ -0,0 +1,109 @@
+import threading
+from configparser import ConfigParser
+from unittest.mock import Mock
+
+import pytest
+
+from keypool import ApiKey, KeyPool, WINDOW_SECONDS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_pool(rpm=2, tpm=0, keys=2, clock=None):
+    return KeyPool(
+        [ApiKey(f"key{i}", f"api-{i}", rpm=rpm, tpm=tpm) for i in range(keys)],
+        client_factory=lambda api_key: Mock(api_key=api_key),
+        clock=clock or FakeClock(),
+    )
+
+
+class TestKeyPool:
+    def test_requests_are_spread_by_headroom(self):
+        """最も余裕のあるキーに順に割り当てられることを確認"""
+        pool = make_pool(rpm=2)
+        chosen = [pool.acquire() for _ in range(4)]
+        assert sorted(chosen) == ["key0", "key0", "key1", "key1"]
+
+    def test_try_acquire_does_not_wait(self):
+        """枠がない場合、try_acquireは待たずにNoneを返すことを確認"""
+        pool = make_pool(rpm=1, keys=1)
+        assert pool.try_acquire(key_id="key0") == "key0"
+        assert pool.try_acquire(key_id="key0") is None
+
+    def test_acquire_waits_until_window_expires(self):
+        """全キーが上限に達したら枠が空くまで待つことを確認"""
+        clock = FakeClock()
+        pool = make_pool(rpm=1, keys=1, clock=clock)
+        pool.acquire()
+
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.acquire()))
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+
+        clock.now = WINDOW_SECONDS
+        thread.join(timeout=2)
+        assert result == ["key0"]
+
+    def test_token_limit_is_tracked(self):
+        """TPMの消費量でキーが選ばれることを確認"""
+        pool = make_pool(rpm=0, tpm=1000)
+        first = pool.acquire(tokens=100)
+        pool.record_tokens(first, 900, reserved=100)
+        assert pool.acquire(tokens=100) != first
+
+    def test_affinity(self):
+        """ファイルをアップロードしたキーが記憶されることを確認"""
+        pool = make_pool()
+        pool.bind("files/a", "key1")
+        file_a = Mock()
+        file_a.name = "files/a"
+        assert pool.key_for_files([file_a]) == "key1"
+        assert pool.acquire(key_id="key1") == "key1"
+
+        file_b = Mock()
+        file_b.name = "files/b"
+        pool.bind("files/b", "key0")
+        with pytest.raises(ValueError):
+            pool.key_for_files([file_a, file_b])
+
+    def test_clients_are_reused_per_key(self):
+        """キーごとにクライアントが1つだけ作られることを確認"""
+        pool = make_pool()
+        assert pool.client("key0") is pool.client("key0")
+        assert pool.client("key0").api_key == "api-0"
+        assert pool.client("key1").api_key == "api-1"
+
+    def test_from_config(self):
+        """api_keys の設定からキーとモデルが読み込まれることを確認"""
+        config = ConfigParser(interpolation=None)
+        config.read_dict(
+            {
+                "GEMINI": {
+                    "api_keys": "aaa, bbb@gemini-2.5-flash",
+                    "rpm_limit": "5",
+                }
+            }
+        )
+        pool = KeyPool.from_config(config, client_factory=Mock)
+        assert len(pool) == 2
+        assert pool.keys["key0"].api_key == "aaa"
+        assert pool.model_for("key0", "default") == "default"
+        assert pool.model_for("key1", "default") == "gemini-2.5-flash"
+        assert pool.keys["key1"].rpm == 5
+
+    def test_set_limits(self):
+        """再読み込みした RPM/TPM 上限がすべてのキーに反映されることを確認"""
+        pool = KeyPool([ApiKey("a", "api-a"), ApiKey("b", "api-b")], Mock)
+        pool.set_limits(rpm=3, tpm=1000)
+        assert [(key.rpm, key.tpm) for key in pool.keys.values()] == [
+            (3, 1000),
+            (3, 1000),
+        ]
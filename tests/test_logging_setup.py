@@ -0,0 +1,105 @@
+import json
+import logging
+import logging.handlers
+import os
+import sys
+from dataclasses import replace
+
+import pytest
+
+from config import Settings
+from logging_setup import JsonFormatter, configure_logging, shutdown_logging
+
+
+@pytest.fixture
+def log_settings(tmp_path):
+    from configparser import ConfigParser
+
+    settings = Settings.from_config(ConfigParser()).logging
+    return replace(settings, log_file=str(tmp_path / "app.log"))
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+class TestConfigureLogging:
+    def test_root_logger_uses_queue_handler(self, log_settings, restore_root_logger):
+        """ルートロガーにはQueueHandlerだけが設定されることを確認"""
+        configure_logging(log_settings)
+        handlers = logging.getLogger().handlers
+        assert len(handlers) == 1
+        assert isinstance(handlers[0], logging.handlers.QueueHandler)
+
+    def test_records_are_written_by_listener(self, log_settings, restore_root_logger):
+        """リスナーを停止するとキューのログがファイルに書き出されることを確認"""
+        configure_logging(log_settings)
+        logging.getLogger("test").info("hello")
+        shutdown_logging()
+        with open(log_settings.log_file, encoding="utf-8") as f:
+            assert "hello" in f.read()
+
+    def test_size_rotation(self, log_settings, restore_root_logger):
+        """サイズ上限を超えるとファイルがローテーションされることを確認"""
+        settings = replace(log_settings, max_bytes=200, backup_count=2)
+        configure_logging(settings)
+        for index in range(50):
+            logging.getLogger("test").warning("line %d", index)
+        shutdown_logging()
+        assert os.path.exists(log_settings.log_file + ".1")
+        assert not os.path.exists(log_settings.log_file + ".3")
+
+    def test_json_format(self, log_settings, restore_root_logger):
+        """JSON形式で1行1レコード出力されることを確認"""
+        configure_logging(replace(log_settings, json=True))
+        logging.getLogger("test").error("失敗 %s", "x")
+        shutdown_logging()
+        with open(log_settings.log_file, encoding="utf-8") as f:
+            entry = json.loads(f.readline())
+        assert entry["message"] == "失敗 x"
+        assert entry["level"] == "ERROR"
+        assert entry["logger"] == "test"
+
+    def test_records_carry_trace_ids(self, log_settings, restore_root_logger):
+        """実行中のログには、ログを出したスレッドの実行IDとスパンIDが付くことを確認"""
+        import threading
+
+        import tracing
+
+        configure_logging(replace(log_settings, json=True))
+        with tracing.run("run") as run:
+            with tracing.span("upload") as span:
+                worker = threading.Thread(
+                    target=tracing.wrap(lambda: logging.getLogger("test").info("a"))
+                )
+                worker.start()
+                worker.join()
+        logging.getLogger("test").info("b")
+        shutdown_logging()
+        with open(log_settings.log_file, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f]
+        in_run = next(e for e in entries if e["message"] == "a")
+        assert (in_run["trace_id"], in_run["span_id"]) == (run.trace_id, span.span_id)
+        outside = next(e for e in entries if e["message"] == "b")
+        assert "trace_id" not in outside
+
+
+def test_json_formatter_includes_exception():
+    """例外情報がJSONに含まれることを確認"""
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        record = logging.getLogger("test").makeRecord(
+            "test", logging.ERROR, __file__, 1, "error", (), sys.exc_info()
+        )
+    entry = json.loads(JsonFormatter().format(record))
+    assert "RuntimeError: boom" in entry["exc_info"]
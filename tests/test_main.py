@@ -73,6 +73,8 @@ def config_params():
         "GUI_SETTINGS": {
             "window_size": "1170x450",
             "icon_name": "image-to-textbox.ico",
+            # 開発環境の作業状態を読み込まない
+            "restore_session": "false",
         },
         "LOGGING": {
             "log_file": "app.log",
@@ -284,6 +286,45 @@ class TestImageTextboxApp:
         assert isinstance(app.image_canvas, tk.Canvas)
         assert isinstance(app.images_frame, tk.Widget)
 
+    def test_start_runs_pipeline_in_worker_thread(self, app_with_mock_client):
+        """開始ボタンの処理がワーカースレッドで実行され、結果がTkのスレッドに返ることを確認"""
+        import threading
+
+        app = app_with_mock_client
+        for name in ("status_display", "start_button", "stop_button"):
+            setattr(app, name, Mock())
+        app.resume_var = Mock(get=Mock(return_value=False))
+        app.append_var = Mock(get=Mock(return_value=False))
+        app.image_registry.replace(["a.png"])
+        callbacks = []
+        app.root.after.side_effect = lambda delay, callback: callbacks.append(callback)
+        threads = []
+
+        def run_pipeline(resume=False, append=False):
+            threads.append(threading.current_thread())
+            return Path("deck.pptx")
+
+        with (
+            patch.object(app, "run_pipeline", side_effect=run_pipeline),
+            patch("main.messagebox") as mock_messagebox,
+        ):
+            app.on_start()
+            app._worker.join(timeout=5)
+            assert threads and threads[0] is not threading.main_thread()
+            # 完了の通知は root.after 経由でTkのスレッドで実行される
+            assert not mock_messagebox.showinfo.called
+            for callback in callbacks:
+                callback()
+            mock_messagebox.showinfo.assert_called_once()
+
+    def test_stop_requests_cancellation(self, app_with_mock_client):
+        """停止ボタンでパイプラインに中断が要求されることを確認"""
+        app = app_with_mock_client
+        app.status_display = Mock()
+        app.stop_button = Mock()
+        app.on_stop()
+        assert app.cancel_event.is_set()
+
     def test_app_initialize(self, app_with_mock_client, test_config_ini):
         """アプリケーションの初期化が正しく行われることを確認"""
         # 設定ファイルの内容が正しく読み込まれていることを確認
@@ -480,12 +521,17 @@ class TestGeminiCall:
         """並列実行が正しく行われることを確認（ThreadPoolExecutor使用）"""
         app_for_api_tests.uploaded_images = test_file_path_list
 
+        from concurrent.futures import Future
+
+        def submit(fn, *args):
+            # 完了済みのFutureを返す（画像ごとにアップロードを投入）
+            future = Future()
+            future.set_result(Mock())
+            return future
+
         with patch("main.ThreadPoolExecutor") as MockExecutor:
             mock_executor_instance = Mock()
-            # mapは各ファイルに対して結果を返すイテレータを返す
-            mock_executor_instance.map.return_value = iter(
-                [None] * len(test_file_path_list)
-            )
+            mock_executor_instance.submit.side_effect = submit
             MockExecutor.return_value.__enter__.return_value = mock_executor_instance
 
             with patch("main.genai.Client"):
@@ -495,8 +541,8 @@ class TestGeminiCall:
             MockExecutor.assert_called_once_with(
                 max_workers=min(10, len(test_file_path_list))
             )
-            # mapが呼ばれたことを確認
-            assert mock_executor_instance.map.called
+            # 画像ごとにsubmitされたことを確認
+            assert mock_executor_instance.submit.call_count == len(test_file_path_list)
             # 結果のリストが正しい長さであることを確認
             assert len(result) == len(test_file_path_list)
 
@@ -580,6 +626,67 @@ class TestGeminiCall:
             assert upload_count == len(test_file_path_list)
             assert len(result) == len(test_file_path_list)
 
+    def test_file_upload_starts_with_largest_file(self, app_for_api_tests, tmp_path):
+        """大きいファイルから先にアップロードし、結果は入力順に返すことを確認"""
+        paths = []
+        for name, size in [("small.png", 10), ("large.png", 1000), ("mid.png", 100)]:
+            path = tmp_path / name
+            path.write_bytes(b"x" * size)
+            paths.append(str(path))
+        app_for_api_tests.uploaded_images = paths
+
+        from concurrent.futures import Future
+
+        submitted = []
+
+        def submit(fn, upload, description):
+            submitted.append(upload.args[0])
+            future = Future()
+            future.set_result(upload.args[0])
+            return future
+
+        with patch("main.ThreadPoolExecutor") as MockExecutor:
+            MockExecutor.return_value.__enter__.return_value.submit.side_effect = submit
+            result = app_for_api_tests.file_upload_to_gemini()
+
+        assert [Path(p).name for p in submitted] == [
+            "large.png",
+            "mid.png",
+            "small.png",
+        ]
+        assert result == paths
+
+    def test_request_slots_limit_concurrent_uploads(
+        self, app_for_api_tests, monkeypatch
+    ):
+        """共有のリクエスト枠を超えて同時にアップロードしないことを確認"""
+        import threading
+        import time
+
+        monkeypatch.setattr(
+            app_for_api_tests, "request_slots", threading.BoundedSemaphore(2)
+        )
+        app_for_api_tests.uploaded_images = test_file_path_list
+        lock = threading.Lock()
+        active, peak = 0, 0
+
+        def slow_upload(file):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+            return Mock()
+
+        with patch("main.genai.Client") as MockClient:
+            MockClient.return_value.files.upload.side_effect = slow_upload
+            result = app_for_api_tests.file_upload_to_gemini()
+
+        assert len(result) == len(test_file_path_list)
+        assert peak == 2
+
     def test_extract_text(self, app_for_api_tests, mock_genai_client):
         """extract_textメソッドが正しい引数で呼ばれることを確認"""
         app_for_api_tests.uploaded_images = test_file_path_list
@@ -611,6 +718,40 @@ class TestGeminiCall:
             assert "token" in item
             assert isinstance(item["token"], list)
 
+    def test_extract_text_request_deadline(self, app_for_api_tests, mock_genai_client):
+        """request_timeoutの残り時間がHTTPのタイムアウトとして渡されることを確認"""
+        app_for_api_tests.uploaded_images = test_file_path_list
+        files = app_for_api_tests.file_upload_to_gemini()
+        samples = len(app_for_api_tests.latency._samples)
+        app_for_api_tests.extract_text(files)
+
+        _, called_kwargs = mock_genai_client.models.generate_content.call_args
+        timeout_ms = called_kwargs["config"].http_options.timeout
+        assert (
+            0 < timeout_ms <= app_for_api_tests.settings.gemini.request_timeout * 1000
+        )
+        # 所要時間がヘッジの待ち時間の計算に使われる
+        assert len(app_for_api_tests.latency._samples) == samples + 1
+
+    def test_extract_text_uses_backend(
+        self, app_for_api_tests, mock_genai_client, monkeypatch
+    ):
+        """差し替えたバックエンドで抽出し、Geminiの生成APIは呼ばないことを確認"""
+        from backends import StubBackend
+
+        monkeypatch.setattr(app_for_api_tests, "backend", StubBackend())
+        app_for_api_tests.uploaded_images = test_file_path_list
+        files = app_for_api_tests.file_upload_to_gemini()
+
+        results = app_for_api_tests.extract_text(
+            files, image_paths=app_for_api_tests.uploaded_images
+        )
+
+        assert mock_genai_client.models.generate_content.call_count == 0
+        assert [figure["figure_name"] for figure in results] == [
+            Path(path).name for path in test_file_path_list
+        ]
+
     def test_extract_text_no_files(self, app_for_api_tests):
         """extract_textメソッドがファイル無しで呼ばれたときの挙動を確認"""
         # 空のファイルリストを渡す
@@ -871,3 +1012,1163 @@ class Test_generate_pptx:
         pptx_files = list(tmp_path.glob("*.pptx"))
         assert len(pptx_files) == 1
         assert pptx_files[0].name == "test_output.pptx"
+
+
+class TestRunPipeline:
+    def test_resume_skips_extracted_images(self, app_for_api_tests, tmp_path):
+        """再開時に抽出済みの画像が再処理されないことを確認"""
+        app_for_api_tests.output_dir = tmp_path
+        app_for_api_tests.file_name.set("resume_deck")
+        images = []
+        for name in ("a.png", "b.png"):
+            image = tmp_path / name
+            image.write_bytes(name.encode())
+            images.append(str(image))
+        app_for_api_tests.uploaded_images = images
+
+        with patch("main.genai.Client") as MockClient:
+            mock_instance = Mock()
+            MockClient.return_value = mock_instance
+            mock_file = Mock()
+            mock_file.name = "files/test"
+            mock_file.expiration_time = None
+            mock_instance.files.upload.return_value = mock_file
+            mock_response = Mock()
+            mock_response.text = json.dumps([{"figure_name": "a", "token": ["1"]}])
+            mock_instance.models.generate_content.return_value = mock_response
+            app_for_api_tests.generate_client = mock_instance
+
+            app_for_api_tests.run_pipeline()
+            assert mock_instance.models.generate_content.call_count == 1
+
+            # 2回目は抽出済みのためAPIを呼ばずにスライドのみ再生成する
+            output_path = app_for_api_tests.run_pipeline(resume=True)
+            assert mock_instance.models.generate_content.call_count == 1
+            assert output_path.exists()
+            assert (tmp_path / "resume_deck.journal.jsonl").exists()
+
+    def test_new_run_deletes_previous_uploads(self, app_for_api_tests, tmp_path):
+        """再開しない場合、前回のジャーナルに残ったアップロードが削除されることを確認"""
+        from journal import RunJournal
+
+        app_for_api_tests.output_dir = tmp_path
+        app_for_api_tests.file_name.set("orphans")
+        previous = RunJournal(tmp_path / "orphans.journal.jsonl")
+        leftover = Mock()
+        leftover.name = "files/leftover"
+        leftover.expiration_time = None
+        previous.record_upload("old-image", leftover)
+
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a")
+        app_for_api_tests.uploaded_images = [str(image)]
+        with patch("main.genai.Client") as MockClient:
+            mock_instance = MockClient.return_value
+            mock_file = Mock()
+            mock_file.name = "files/new"
+            mock_file.expiration_time = None
+            mock_instance.files.upload.return_value = mock_file
+            mock_instance.models.generate_content.return_value.text = json.dumps(
+                [{"figure_name": "a", "token": ["1"]}]
+            )
+            app_for_api_tests.generate_client = mock_instance
+            app_for_api_tests.run_pipeline()
+
+        deleted = [c.kwargs["name"] for c in mock_instance.files.delete.call_args_list]
+        assert "files/leftover" in deleted
+
+    def test_prefetched_uploads_are_used(
+        self, app_for_api_tests, tmp_path, monkeypatch
+    ):
+        """先にアップロードしたファイルを使い、開始時にはアップロードしないことを確認"""
+        from upload_prefetch import UploadPrefetcher
+
+        app_for_api_tests.output_dir = tmp_path
+        app_for_api_tests.file_name.set("prefetched_deck")
+        images = []
+        for name in ["a.png", "b.png"]:
+            (tmp_path / name).write_bytes(name.encode())
+            images.append(str(tmp_path / name))
+        app_for_api_tests.uploaded_images = images
+
+        prefetched, deleted = {}, []
+
+        def upload(file_path):
+            file = Mock()
+            file.name = f"files/{Path(file_path).stem}"
+            file.expiration_time = None
+            prefetched[file_path] = file
+            return file
+
+        prefetcher = UploadPrefetcher(upload, deleted.append)
+        monkeypatch.setattr(app_for_api_tests, "prefetcher", prefetcher)
+        prefetcher.submit(images)
+
+        with patch("main.genai.Client") as MockClient:
+            mock_instance = MockClient.return_value
+            mock_instance.models.generate_content.return_value.text = json.dumps(
+                [{"figure_name": "fig", "token": ["1"]}]
+            )
+            app_for_api_tests.generate_client = mock_instance
+            app_for_api_tests.run_pipeline()
+
+        assert mock_instance.files.upload.call_count == 0
+        _, kwargs = mock_instance.models.generate_content.call_args
+        assert kwargs["contents"][:2] == [prefetched[p] for p in images]
+        # 使ったファイルは通常どおり抽出後に削除される
+        deleted_names = {
+            c.kwargs["name"] for c in mock_instance.files.delete.call_args_list
+        }
+        assert deleted_names == {"files/a", "files/b"}
+        assert deleted == []
+        assert len(prefetcher) == 0
+
+    def test_near_duplicates_reuse_representative_tokens(
+        self, app_for_api_tests, tmp_path, monkeypatch
+    ):
+        """近似重複の画像は代表だけが抽出され、結果が使い回されることを確認"""
+        from dataclasses import replace
+        from PIL import Image, ImageDraw
+
+        pytest.importorskip("numpy")
+        settings = app_for_api_tests._settings
+        monkeypatch.setattr(
+            app_for_api_tests,
+            "_settings",
+            replace(settings, dedupe=replace(settings.dedupe, enabled=True)),
+        )
+        app_for_api_tests.output_dir = tmp_path
+        app_for_api_tests.file_name.set("dedupe_deck")
+        large = Image.new("RGB", (800, 600), "white")
+        draw = ImageDraw.Draw(large)
+        draw.rectangle([200, 200, 400, 600], fill="blue")
+        draw.line([0, 0, 800, 300], fill="black", width=3)
+        large.save(tmp_path / "large.png")
+        # 縮小して書き出し直した画像
+        large.resize((200, 150), Image.Resampling.LANCZOS).save(tmp_path / "small.png")
+        images = [str(tmp_path / "small.png"), str(tmp_path / "large.png")]
+        app_for_api_tests.uploaded_images = images
+
+        with patch("main.genai.Client") as MockClient:
+            mock_instance = Mock()
+            MockClient.return_value = mock_instance
+            mock_file = Mock()
+            mock_file.name = "files/test"
+            mock_file.expiration_time = None
+            mock_instance.files.upload.return_value = mock_file
+            mock_response = Mock()
+            mock_response.text = json.dumps([{"figure_name": "fig", "token": ["1"]}])
+            mock_instance.models.generate_content.return_value = mock_response
+            app_for_api_tests.generate_client = mock_instance
+
+            app_for_api_tests.run_pipeline()
+
+        assert mock_instance.files.upload.call_count == 1
+        assert mock_instance.models.generate_content.call_count == 1
+        assert app_for_api_tests.last_results == [
+            {"figure_name": "fig", "token": ["1"]},
+            {"figure_name": "fig", "token": ["1"]},
+        ]
+
+
+class TestTextboxPipeline:
+    def test_generate_pptx_writes_profiles(self, test_config_ini, tmp_path):
+        """プロファイル中はレイアウト・保存とメモリの記録が書き出されることを確認"""
+        import profiling
+        from main import TextboxPipeline, parse_args
+
+        assert parse_args(["--profile"]).profile
+        with patch("main.genai.Client"):
+            pipeline = TextboxPipeline(test_config_ini)
+        pipeline.output_dir = tmp_path
+        pipeline.output_name = "profiled"
+
+        profiler = profiling.start(tmp_path / "profiles", top=5)
+        try:
+            pipeline.generate_pptx([{"figure_name": "fig", "token": ["1", "2"]}])
+        finally:
+            profiling.stop()
+
+        run_dir = profiler.run_dir
+        assert (run_dir / "layout.pstats").exists()
+        assert (run_dir / "save.pstats").exists()
+        assert (run_dir / "generate_pptx.001.memory.txt").exists()
+
+    def test_run_pipeline_writes_trace(self, test_config_ini, tmp_path):
+        """トレース中はアップロード・抽出・削除・スライド生成が1つの実行として記録されることを確認"""
+        import tracing
+        from main import TextboxPipeline, parse_args
+
+        assert parse_args(["--trace"]).trace
+        images = []
+        for name in ["a.png", "b.png"]:
+            (tmp_path / name).write_bytes(name.encode())
+            images.append(str(tmp_path / name))
+
+        def upload(file):
+            uploaded = Mock()
+            uploaded.name = f"files/{Path(file).stem}"
+            uploaded.expiration_time = None
+            return uploaded
+
+        tracing.start(tmp_path / "traces")
+        try:
+            with patch("main.genai.Client") as MockClient:
+                client = MockClient.return_value
+                client.files.upload.side_effect = upload
+                client.models.generate_content.return_value.text = json.dumps(
+                    [{"figure_name": "fig", "token": ["1"]}]
+                )
+                pipeline = TextboxPipeline(test_config_ini)
+                pipeline.output_dir = tmp_path
+                pipeline.output_name = "traced"
+                pipeline.uploaded_images = images
+                pipeline.run_pipeline()
+        finally:
+            tracing.stop()
+
+        [path] = (tmp_path / "traces").glob("*.trace.json")
+        events = json.loads(path.read_text(encoding="utf-8"))["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span["name"], []).append(span)
+        assert by_name["run_pipeline"][0]["args"]["output"] == "traced"
+        assert sorted(s["args"]["image"] for s in by_name["upload"]) == [
+            "a.png",
+            "b.png",
+        ]
+        assert by_name["extract"][0]["args"]["images"] == ["a.png", "b.png"]
+        assert len(by_name["generate"]) == 1
+        assert sorted(s["args"]["file"] for s in by_name["delete"]) == [
+            "files/a",
+            "files/b",
+        ]
+        assert len(by_name["generate_pptx"]) == 1
+
+    def test_watch_skips_existing_unextracted_files(self, test_config_ini, tmp_path):
+        """process_existing = false では、ジャーナルに結果のない既存の画像を処理しないことを確認"""
+        from main import TextboxPipeline
+        from watcher import WatchDaemon
+
+        watch_dir = tmp_path / "watch"
+        watch_dir.mkdir()
+        for name in ["old1.png", "old2.png"]:
+            (watch_dir / name).write_bytes(name.encode())
+
+        uploaded = []
+
+        def upload(file):
+            uploaded.append(Path(file).name)
+            remote = Mock()
+            remote.name = f"files/{Path(file).stem}"
+            remote.expiration_time = None
+            return remote
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            client.files.upload.side_effect = upload
+            client.models.generate_content.return_value.text = json.dumps(
+                [{"figure_name": "new.png", "token": ["1"]}]
+            )
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.output_dir = tmp_path / "out"
+            daemon = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+            assert daemon.processed == []
+
+            new = watch_dir / "new.png"
+            new.write_bytes(b"new")
+            daemon.process_batch([new])
+
+            # 抽出済みになった画像だけが再起動後のデッキに残る
+            restarted = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+
+        assert uploaded == ["new.png"]
+        assert client.models.generate_content.call_count == 1
+        assert daemon.processed == [str(new)]
+        assert restarted.processed == [str(new)]
+
+    def test_headless_pipeline_uses_output_name(self, test_config_ini, tmp_path):
+        """GUI無しのパイプラインでoutput_nameがファイル名に使われることを確認"""
+        from main import TextboxPipeline
+
+        with patch("main.genai.Client"):
+            pipeline = TextboxPipeline(test_config_ini)
+        pipeline.output_dir = tmp_path
+        pipeline.output_name = "headless"
+
+        output_path = pipeline.generate_pptx(
+            [{"figure_name": "test1.jpg", "token": ["token1"]}]
+        )
+        assert output_path == tmp_path / "headless.pptx"
+        assert output_path.exists()
+
+    def test_system_instruction_is_reloaded_when_file_changes(self, test_config_ini):
+        """システムプロンプトのファイルが更新されたら読み込み直すことを確認"""
+        from main import TextboxPipeline
+
+        mtime = [1]
+        prompt = ["first"]
+        with (
+            patch("main.genai.Client"),
+            patch("main.get_instruction_mtime", side_effect=lambda: mtime[0]),
+            patch("main.get_system_instructions", side_effect=lambda: prompt[0]),
+        ):
+            pipeline = TextboxPipeline(test_config_ini)
+            assert pipeline.system_instruction == "first"
+
+            prompt[0] = "second"
+            assert pipeline.system_instruction == "first"
+            mtime[0] = 2
+            assert pipeline.system_instruction == "second"
+
+            # 明示的に設定したプロンプトは置き換えない
+            pipeline.system_instruction = "manual"
+            mtime[0] = 3
+            assert pipeline.system_instruction == "manual"
+
+    def test_settings_reload_updates_pipeline(self, test_config_ini, tmp_path):
+        """設定の再読み込みでモデル・出力先・ページ展開の設定が反映されることを確認"""
+        from config import Settings
+        from main import BASE_DIR, TextboxPipeline
+
+        with patch("main.genai.Client"):
+            pipeline = TextboxPipeline(test_config_ini)
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["model"] = "gemini-2.5-pro"
+        params["PPTX_SETTINGS"]["output_dir"] = "reloaded_output"
+        params.setdefault("INPUT", {})["max_decoded_pages"] = "7"
+        reloaded = MockConfigParser(params)
+
+        with patch("main.pages.configure") as configure:
+            pipeline._on_settings_reloaded(Settings.from_config(reloaded), reloaded)
+        assert pipeline.gemini_model == "gemini-2.5-pro"
+        assert pipeline.output_dir == BASE_DIR / "reloaded_output"
+        assert configure.call_args.kwargs["max_decoded_pages"] == 7
+
+        # 呼び出し側が上書きした出力先は変更しない
+        pipeline.output_dir = tmp_path
+        with patch("main.pages.configure"):
+            pipeline._on_settings_reloaded(
+                Settings.from_config(test_config_ini), test_config_ini
+            )
+        assert pipeline.output_dir == tmp_path
+        assert pipeline.gemini_model == test_config_ini.get("GEMINI", "model")
+
+    def test_job_pipelines_reuse_input_resources(self, test_config_ini):
+        """ジョブ用のパイプラインを作ってもページの枠・キャッシュを設定し直さないことを確認"""
+        from main import TextboxPipeline
+
+        with patch("main.genai.Client"):
+            TextboxPipeline(test_config_ini)
+            params = {
+                section: dict(values)
+                for section, values in test_config_ini._config.items()
+            }
+            params.setdefault("INPUT", {})["max_decoded_pages"] = "7"
+            with (
+                patch("main.pages.configure") as configure,
+                patch("main.image_cache.configure") as configure_cache,
+            ):
+                TextboxPipeline(MockConfigParser(params))
+        assert not configure.called
+        assert not configure_cache.called
+
+    def test_key_pool_keeps_file_affinity(self, test_config_ini, tmp_path):
+        """複数キーの場合、アップロードしたキーで生成・削除されることを確認"""
+        from main import TextboxPipeline
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["api_keys"] = "key-a, key-b"
+        clients = {}
+
+        def make_client(api_key):
+            if api_key not in clients:
+                client = Mock()
+                counter = iter(range(100))
+
+                def upload(file):
+                    uploaded = Mock()
+                    uploaded.name = f"{api_key}/{next(counter)}"
+                    uploaded.expiration_time = None
+                    return uploaded
+
+                client.files.upload.side_effect = upload
+                response = Mock()
+                response.text = json.dumps([{"figure_name": api_key, "token": []}])
+                client.models.generate_content.return_value = response
+                clients[api_key] = client
+            return clients[api_key]
+
+        with patch(
+            "main.genai.Client", side_effect=lambda api_key: make_client(api_key)
+        ):
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "pooled"
+            images = []
+            for index in range(4):
+                image = tmp_path / f"{index}.png"
+                image.write_bytes(bytes([index]))
+                images.append(str(image))
+            pipeline.uploaded_images = images
+            pipeline.run_pipeline()
+
+        for api_key in ("key-a", "key-b"):
+            client = clients[api_key]
+            for call in client.models.generate_content.call_args_list:
+                names = [f.name for f in call.kwargs["contents"][:-1]]
+                assert all(name.startswith(api_key) for name in names)
+            for call in client.files.delete.call_args_list:
+                assert call.kwargs["name"].startswith(api_key)
+
+    def test_cache_stats_are_counted_across_threads(self, test_config_ini):
+        """並列に抽出してもキャッシュの集計が欠けないことを確認"""
+        import sys
+        from concurrent.futures import ThreadPoolExecutor
+
+        from main import TextboxPipeline
+
+        with patch("main.genai.Client") as MockClient:
+            response = MockClient.return_value.models.generate_content.return_value
+            response.text = json.dumps([{"figure_name": "fig", "token": []}])
+            response.usage_metadata.prompt_token_count = 10
+            response.usage_metadata.cached_content_token_count = 0
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.latency.delay = lambda: None
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+            try:
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(
+                        executor.map(
+                            lambda _: pipeline.generate_with_gemini([Mock()]),
+                            range(200),
+                        )
+                    )
+            finally:
+                sys.setswitchinterval(interval)
+
+        assert pipeline._cache_stats["requests"] == 200
+        assert pipeline._cache_stats["prompt_tokens"] == 2000
+
+    def test_race_loser_is_not_sent_or_counted(self, test_config_ini):
+        """競争に負けた抽出は、送信前なら送らず、送信済みなら集計に含めないことを確認"""
+        import threading
+
+        from backends import ExtractionCancelled
+        from main import TextboxPipeline
+
+        cancel = threading.Event()
+        with patch("main.genai.Client") as MockClient:
+            generate_content = MockClient.return_value.models.generate_content
+
+            def respond(**kwargs):
+                cancel.set()
+                response = Mock()
+                response.text = json.dumps([{"figure_name": "fig", "token": []}])
+                return response
+
+            generate_content.side_effect = respond
+            pipeline = TextboxPipeline(test_config_ini)
+
+            with pytest.raises(ExtractionCancelled) as excinfo:
+                pipeline.generate_with_gemini([Mock()], cancel=cancel)
+            assert excinfo.value.sent
+            assert generate_content.call_count == 1
+
+            with pytest.raises(ExtractionCancelled) as excinfo:
+                pipeline.generate_with_gemini([Mock()], cancel=cancel)
+            assert not excinfo.value.sent
+            assert generate_content.call_count == 1
+
+        assert pipeline._cache_stats["requests"] == 0
+
+    def test_hedge_loser_is_accounted_when_it_finishes(self, test_config_ini):
+        """負けたヘッジの複製は、実際に終わった時点でキーのトークン数が記録されることを確認"""
+        import threading
+        import time
+
+        from main import TextboxPipeline
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["api_keys"] = "key-a, key-b"
+        release = threading.Event()
+        calls = []
+
+        def generate_content(**kwargs):
+            calls.append(kwargs)
+            response = Mock()
+            response.text = json.dumps([{"figure_name": "fig", "token": []}])
+            if len(calls) == 1:
+                release.wait(5)
+                response.usage_metadata.total_token_count = 700
+            else:
+                response.usage_metadata.total_token_count = 300
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            MockClient.return_value.models.generate_content.side_effect = (
+                generate_content
+            )
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.latency.delay = lambda: 0.05
+            pipeline.hedge_budget.try_acquire = lambda: True
+            recorded = []
+            pipeline.key_pool.record_tokens = (
+                lambda key_id, used, reserved=0: recorded.append(used)
+            )
+
+            try:
+                result = pipeline.generate_with_gemini([Mock(name="files/a")])
+                assert result == [{"figure_name": "fig", "token": []}]
+                assert recorded == [300]
+            finally:
+                release.set()
+        for _ in range(100):
+            if len(recorded) == 2:
+                break
+            time.sleep(0.05)
+        assert recorded == [300, 700]
+
+    def test_panels_are_extracted_in_parallel_requests(self, test_config_ini, tmp_path):
+        """複数パネルの図がパネルごとのリクエストに分割されることを確認"""
+        from PIL import Image, ImageDraw
+
+        from main import TextboxPipeline
+
+        pytest.importorskip("numpy")
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["PANELS"] = {"enabled": "true"}
+        image = Image.new("RGB", (600, 400), "white")
+        draw = ImageDraw.Draw(image)
+        for x, y in ((20, 20), (320, 20), (20, 220), (320, 220)):
+            draw.rectangle([x, y, x + 260, y + 160], outline="black", width=2)
+        image.save(tmp_path / "grid.png")
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            uploaded = Mock()
+            uploaded.name = "files/panel"
+            uploaded.expiration_time = None
+            client.files.upload.return_value = uploaded
+            response = Mock()
+            response.text = json.dumps([{"figure_name": "Fig. 1", "token": ["x"]}])
+            client.models.generate_content.return_value = response
+
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "panels"
+            pipeline.uploaded_images = [str(tmp_path / "grid.png")]
+            pipeline.run_pipeline()
+
+        assert client.models.generate_content.call_count == 4
+        assert [f["figure_name"] for f in pipeline.last_results] == [
+            "Fig. 1 (a)",
+            "Fig. 1 (b)",
+            "Fig. 1 (c)",
+            "Fig. 1 (d)",
+        ]
+        assert all(f["token"] == ["x"] for f in pipeline.last_results)
+
+    def test_failed_panel_falls_back_to_whole_image(self, test_config_ini, tmp_path):
+        """パネルの抽出に失敗した画像は画像全体として抽出され、パネルのファイルが削除されることを確認"""
+        from PIL import Image, ImageDraw
+
+        from main import TextboxPipeline
+
+        pytest.importorskip("numpy")
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["max_retries"] = "0"
+        params["PANELS"] = {"enabled": "true"}
+        image = Image.new("RGB", (600, 400), "white")
+        draw = ImageDraw.Draw(image)
+        for x, y in ((20, 20), (320, 20), (20, 220), (320, 220)):
+            draw.rectangle([x, y, x + 260, y + 160], outline="black", width=2)
+        image.save(tmp_path / "grid.png")
+
+        def upload(file):
+            uploaded = Mock()
+            uploaded.name = f"files/{Path(file).stem}"
+            uploaded.expiration_time = None
+            return uploaded
+
+        def generate_content(model, config, contents):
+            if contents[0].name == "files/grid_b":
+                raise RuntimeError("panel failed")
+            response = Mock()
+            response.text = json.dumps(
+                [{"figure_name": contents[0].name, "token": ["x"]}]
+            )
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            client.files.upload.side_effect = upload
+            client.models.generate_content.side_effect = generate_content
+
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "panels"
+            pipeline.uploaded_images = [str(tmp_path / "grid.png")]
+            pipeline.run_pipeline()
+
+        assert pipeline.last_failures == []
+        assert [f["figure_name"] for f in pipeline.last_results] == ["files/grid"]
+        deleted = {c.kwargs["name"] for c in client.files.delete.call_args_list}
+        assert {"files/grid_a", "files/grid_b", "files/grid_c", "files/grid_d"} <= (
+            deleted
+        )
+        assert "files/grid" in deleted
+
+    def test_large_image_is_extracted_in_tiles(self, test_config_ini, tmp_path):
+        """巨大な画像はタイルごとに抽出され、重なりの重複をまとめた1つの図になることを確認"""
+        from PIL import Image
+
+        from main import TextboxPipeline
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["TILES"] = {"enabled": "true", "max_side": "256"}
+        Image.new("RGB", (700, 300), "white").save(tmp_path / "poster.png")
+        Image.new("RGB", (200, 100), "white").save(tmp_path / "small.png")
+
+        def upload(file):
+            uploaded = Mock()
+            uploaded.name = f"files/{Path(file).stem}"
+            uploaded.expiration_time = None
+            return uploaded
+
+        def generate_content(model, config, contents):
+            names = [file.name for file in contents[:-1]]
+            response = Mock()
+            response.text = json.dumps(
+                [{"figure_name": "Poster", "token": [name, "shared"]} for name in names]
+            )
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            client.files.upload.side_effect = upload
+            client.models.generate_content.side_effect = generate_content
+
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "tiles"
+            pipeline.uploaded_images = [
+                str(tmp_path / "poster.png"),
+                str(tmp_path / "small.png"),
+            ]
+            pipeline.run_pipeline()
+
+        tiles = [f"files/poster_tile{index:02d}" for index in range(1, 7)]
+        assert pipeline.last_results[0] == {
+            "figure_name": "Poster",
+            "token": [tiles[0], "shared", *tiles[1:]],
+        }
+        # 小さな画像は分割せずに抽出する
+        assert pipeline.last_results[1]["token"] == ["files/small", "shared"]
+        deleted = {c.kwargs["name"] for c in client.files.delete.call_args_list}
+        assert set(tiles) <= deleted
+
+    def test_stopped_tiles_are_journaled_and_reused(self, test_config_ini, tmp_path):
+        """タイルの処理中に停止した場合、アップロードがジャーナルに残り再開時に再利用されることを確認"""
+        from PIL import Image
+
+        from journal import RunJournal
+        from main import PipelineCancelled, TextboxPipeline
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["TILES"] = {"enabled": "true", "max_side": "256"}
+        Image.new("RGB", (700, 300), "white").save(tmp_path / "poster.png")
+        uploads = []
+
+        def upload(file):
+            uploads.append(Path(file).stem)
+            if len(uploads) == 3:
+                # アップロード中に停止ボタンが押された
+                pipeline.cancel_event.set()
+            uploaded = Mock()
+            uploaded.name = f"files/{Path(file).stem}"
+            uploaded.expiration_time = None
+            return uploaded
+
+        def get(name):
+            remote = Mock()
+            remote.name = name
+            return remote
+
+        def generate_content(model, config, contents):
+            response = Mock()
+            response.text = json.dumps(
+                [{"figure_name": "Poster", "token": [f.name for f in contents[:-1]]}]
+            )
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            client.files.upload.side_effect = upload
+            client.files.get.side_effect = get
+            client.models.generate_content.side_effect = generate_content
+
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "tiles"
+            pipeline.uploaded_images = [str(tmp_path / "poster.png")]
+            with pytest.raises(PipelineCancelled):
+                pipeline.run_pipeline()
+
+            assert client.models.generate_content.call_count == 0
+            journal = RunJournal(tmp_path / "tiles.journal.jsonl", resume=True)
+            leftovers = sorted(name for name, _ in journal.leftover_uploads())
+            assert leftovers == [f"files/poster_tile{i:02d}" for i in range(1, 7)]
+
+            uploads.clear()
+            pipeline.run_pipeline(resume=True)
+
+        assert uploads == []
+        assert client.files.get.call_count == 6
+        assert len(pipeline.last_results[0]["token"]) == 6
+        journal = RunJournal(tmp_path / "tiles.journal.jsonl", resume=True)
+        assert journal.leftover_uploads() == []
+
+    def test_cascade_escalates_only_suspicious_images(self, test_config_ini, tmp_path):
+        """カスケードでは疑わしい結果の画像だけ通常のモデルで抽出し直すことを確認"""
+        import threading
+
+        from main import TextboxPipeline
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["CASCADE"] = {
+            "enabled": "true",
+            "model": "fast-model",
+            "tokens_per_complexity": "0",
+        }
+        params["DEDUPE"] = {"enabled": "false"}
+        images = []
+        for name in ("good", "hard"):
+            image = tmp_path / f"{name}.png"
+            image.write_bytes(name.encode())
+            images.append(str(image))
+        # 2枚の高速なモデルのリクエストが同時に実行されないと通過できない
+        barrier = threading.Barrier(2, timeout=5)
+
+        def generate_content(model, config, contents):
+            response = Mock()
+            file_name = contents[0].name
+            if model == "fast-model":
+                barrier.wait()
+            if model == "fast-model" and file_name == "files/hard":
+                figures = [{"figure_name": "hard", "token": []}]
+            else:
+                figures = [{"figure_name": file_name, "token": [model]}]
+            response.text = json.dumps(figures)
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+
+            def upload(file, config=None):
+                uploaded = Mock()
+                uploaded.name = f"files/{Path(file).stem}"
+                uploaded.expiration_time = None
+                return uploaded
+
+            client.files.upload.side_effect = upload
+            client.models.generate_content.side_effect = generate_content
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "cascade"
+            pipeline.uploaded_images = images
+            pipeline.run_pipeline()
+
+        models = [
+            c.kwargs["model"] for c in client.models.generate_content.call_args_list
+        ]
+        assert sorted(models) == ["fast-model", "fast-model", pipeline.gemini_model]
+        assert [f["token"] for f in pipeline.last_results] == [
+            ["fast-model"],
+            [pipeline.gemini_model],
+        ]
+        assert pipeline.last_cascade_stats["escalated"] == 1
+        assert pipeline.last_cascade_stats["escalated_ratio"] == 0.5
+        assert pipeline.last_cascade_stats["wall_seconds"] is not None
+        # 各ファイルは判定が終わってから一度だけ削除される
+        assert client.files.delete.call_count == 2
+
+    def test_failed_images_do_not_sink_the_run(self, test_config_ini, tmp_path):
+        """失敗した画像だけが報告され、成功した画像でデッキが作られることを確認"""
+        from main import TextboxPipeline
+        from results_store import read_results
+
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["max_retries"] = "1"
+        params["GEMINI"]["retry_backoff"] = "0"
+        params["DEDUPE"] = {"enabled": "false"}
+        images = []
+        for name in ("good", "bad_upload", "bad_json"):
+            image = tmp_path / f"{name}.png"
+            image.write_bytes(name.encode())
+            images.append(str(image))
+
+        def upload(file, config=None):
+            if "bad_upload" in str(file):
+                raise OSError("upload failed")
+            uploaded = Mock()
+            uploaded.name = f"files/{Path(file).stem}"
+            uploaded.expiration_time = None
+            return uploaded
+
+        def generate_content(model, config, contents):
+            response = Mock()
+            names = [f.name for f in contents[:-1]]
+            if "files/bad_json" in names:
+                response.text = "{broken"
+            else:
+                response.text = json.dumps(
+                    [{"figure_name": name, "token": ["1"]} for name in names]
+                )
+            return response
+
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            client.files.upload.side_effect = upload
+            client.models.generate_content.side_effect = generate_content
+            pipeline = TextboxPipeline(MockConfigParser(params))
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "partial"
+            pipeline.uploaded_images = images
+            output_path = pipeline.run_pipeline()
+
+        assert output_path.exists()
+        assert [f["figure_name"] for f in pipeline.last_results] == ["files/good"]
+        assert [(f["image"], f["stage"]) for f in pipeline.last_failures] == [
+            (images[1], "upload"),
+            (images[2], "extract"),
+        ]
+        assert len(read_results(tmp_path / "partial.failures.jsonl")) == 2
+        # 失敗した画像のアップロードも削除される
+        deleted = {c.kwargs["name"] for c in client.files.delete.call_args_list}
+        assert deleted == {"files/good", "files/bad_json"}
+
+    def test_results_sidecar_and_offline_render(self, test_config_ini, tmp_path):
+        """抽出結果がPPTXの横に保存され、APIを使わずに再生成できることを確認"""
+        from main import TextboxPipeline
+        from results_store import read_results
+
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a")
+        figures = [{"figure_name": "fig", "token": ["1", "2"]}]
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            uploaded = Mock()
+            uploaded.name = "files/a"
+            uploaded.expiration_time = None
+            client.files.upload.return_value = uploaded
+            client.models.generate_content.return_value.text = json.dumps(figures)
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "deck"
+            pipeline.uploaded_images = [str(image)]
+            output_path = pipeline.run_pipeline()
+
+        sidecar = tmp_path / "deck.results.jsonl"
+        assert read_results(sidecar) == figures
+
+        # APIキーなしで再生成できる
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GEMINI"]["api_key"] = ""
+        params["PPTX_SETTINGS"]["font_size"] = "20"
+        output_path.unlink()
+        with patch("main.genai.Client") as MockClient:
+            offline = TextboxPipeline(MockConfigParser(params), offline=True)
+            assert offline.render_results(sidecar) == output_path
+            assert not MockClient.called
+        assert output_path.exists()
+
+    def test_append_adds_only_new_images(self, test_config_ini, tmp_path):
+        """追記モードで既存のデッキにまだ含まれていない画像の図だけが追加されることを確認"""
+        from pptx import Presentation
+        from main import TextboxPipeline
+        from results_store import read_results, read_sources
+
+        first = [{"figure_name": "fig1", "token": ["1"]}]
+        second = [{"figure_name": "fig2", "token": ["2"]}]
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            uploaded = Mock()
+            uploaded.name = "files/a"
+            uploaded.expiration_time = None
+            client.files.upload.return_value = uploaded
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "deck"
+
+            images = []
+            # 3枚目は2枚目と同じ結果になる別の画像なので追加される
+            for index, figures in enumerate([first, second, second]):
+                image = tmp_path / f"{index}.png"
+                image.write_bytes(str(index).encode())
+                images.append(str(image))
+                client.models.generate_content.return_value.text = json.dumps(figures)
+                pipeline.uploaded_images = [str(image)]
+                output_path = pipeline.run_pipeline(append=True)
+
+            # 既にデッキに含まれる画像は、結果が変わっても抽出・追加されない
+            calls = client.models.generate_content.call_count
+            client.models.generate_content.return_value.text = json.dumps(
+                [{"figure_name": "changed", "token": ["x"]}]
+            )
+            pipeline.uploaded_images = images[:2]
+            pipeline.run_pipeline(append=True)
+            assert client.models.generate_content.call_count == calls
+
+        assert len(Presentation(str(output_path)).slides) == 3
+        sidecar = tmp_path / "deck.results.jsonl"
+        assert read_results(sidecar) == first + second + second
+        assert len(read_sources(sidecar)) == 3
+
+    def test_results_are_streamed_before_the_deck_is_saved(
+        self, test_config_ini, tmp_path
+    ):
+        """デッキの保存前に落ちても抽出済みの図が結果ファイルに残り、
+        追記し直しても図が重複しないことを確認"""
+        from pptx import Presentation
+        from main import TextboxPipeline
+        from results_store import read_results, read_sources
+
+        first = [{"figure_name": "fig1", "token": ["1"]}]
+        second = [{"figure_name": "fig2", "token": ["2"]}]
+        images = []
+        for index in range(2):
+            image = tmp_path / f"{index}.png"
+            image.write_bytes(str(index).encode())
+            images.append(str(image))
+        sidecar = tmp_path / "deck.results.jsonl"
+        with patch("main.genai.Client") as MockClient:
+            client = MockClient.return_value
+            uploaded = Mock()
+            uploaded.name = "files/a"
+            uploaded.expiration_time = None
+            client.files.upload.return_value = uploaded
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "deck"
+
+            client.models.generate_content.return_value.text = json.dumps(first)
+            pipeline.uploaded_images = images[:1]
+            with patch.object(
+                pipeline, "generate_pptx", side_effect=OSError("disk full")
+            ):
+                with pytest.raises(OSError):
+                    pipeline.run_pipeline()
+            # 抽出元のキーはデッキを保存するまで記録しない
+            assert read_results(sidecar) == first
+            assert read_sources(sidecar) == set()
+
+            pipeline.run_pipeline(resume=True)
+            assert read_results(sidecar) == first
+            assert len(read_sources(sidecar)) == 1
+
+            client.models.generate_content.return_value.text = json.dumps(second)
+            pipeline.uploaded_images = images
+            with patch.object(
+                pipeline, "generate_pptx", side_effect=OSError("disk full")
+            ):
+                with pytest.raises(OSError):
+                    pipeline.run_pipeline(append=True)
+            assert read_results(sidecar) == first + second
+            assert len(read_sources(sidecar)) == 1
+
+            output_path = pipeline.run_pipeline(append=True)
+
+        assert len(Presentation(str(output_path)).slides) == 2
+        assert read_results(sidecar) == first + second
+        assert len(read_sources(sidecar)) == 2
+
+    def test_append_without_sidecar_is_rejected(self, test_config_ini, tmp_path):
+        """含まれる画像の記録がないデッキには追記しないことを確認"""
+        from main import TextboxPipeline
+
+        (tmp_path / "deck.pptx").write_bytes(b"pptx")
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a")
+        with patch("main.genai.Client") as MockClient:
+            pipeline = TextboxPipeline(test_config_ini)
+            pipeline.output_dir = tmp_path
+            pipeline.output_name = "deck"
+            pipeline.uploaded_images = [str(image)]
+            with pytest.raises(ValueError, match="追記できません"):
+                pipeline.run_pipeline(append=True)
+            assert not MockClient.return_value.files.upload.called
+
+    def test_deferred_initialization(self, test_config_ini):
+        """defer_init=Trueの場合、初期化がバックグラウンドで完了することを確認"""
+        from main import TextboxPipeline
+
+        with patch("main.genai.Client") as MockClient:
+            pipeline = TextboxPipeline(test_config_ini, defer_init=True)
+            assert pipeline.generate_client is MockClient.return_value
+            assert pipeline.system_instruction
+
+
+class TestSession:
+    @staticmethod
+    def create_app(test_config_ini, session_dir):
+        """作業状態を session_dir に保存するアプリ（UIの部品はモック）"""
+        params = {
+            section: dict(values) for section, values in test_config_ini._config.items()
+        }
+        params["GUI_SETTINGS"].update(
+            {"restore_session": "true", "session_dir": str(session_dir)}
+        )
+
+        def setup_ui(app):
+            app.file_name = Mock()
+            app.file_listbox = Mock()
+            app.status_display = Mock()
+
+        with (
+            patch("main.genai.Client"),
+            patch.object(ImageTextboxApp, "setup_ui", autospec=True) as mock_setup,
+            patch.object(ImageTextboxApp, "display_images"),
+        ):
+            mock_setup.side_effect = setup_ui
+            return ImageTextboxApp(Mock(spec=tk.Tk), MockConfigParser(params))
+
+    def test_workspace_is_restored_without_decoding_images(
+        self, test_config_ini, tmp_path
+    ):
+        """閉じたときの画像一覧・出力ファイル名・縮小画像・アップロードが復元されることを確認"""
+        import image_cache
+        from PIL import Image
+
+        images = []
+        for name, color in (("a.png", "red"), ("b.png", "blue")):
+            Image.new("RGB", (400, 200), color).save(tmp_path / name)
+            images.append(str(tmp_path / name))
+
+        app = self.create_app(test_config_ini, tmp_path / "session")
+        app.image_registry.add_many(images)
+        app.file_name.get.return_value = "deck"
+        uploaded = Mock()
+        uploaded.name = "files/a"
+        uploaded.expiration_time = None
+        app.prefetcher.adopt(images[0], lambda: uploaded)
+        app.prefetcher._futures[images[0]].result(timeout=5)
+        # プレビューを表示した画像の縮小画像だけが保存される
+        app._thumbnail(images[0])
+        app.on_close()
+
+        assert app.prefetcher.detach() == {}
+        app.root.destroy.assert_called_once()
+        decodes = image_cache.shared_image_cache.decodes
+
+        # 保存したアップロードは取得し直して先行アップロードとして使う
+        with patch.object(
+            ImageTextboxApp, "_get_remote_file", return_value=uploaded
+        ) as get_remote_file:
+            restored = self.create_app(test_config_ini, tmp_path / "session")
+            assert restored.prefetcher.take(images) == {images[0]: uploaded}
+        get_remote_file.assert_called_once_with("files/a", None)
+
+        assert restored.uploaded_images == images
+        restored.file_name.set.assert_called_with("deck")
+        assert list(restored._session_thumbnails) == [images[0]]
+        assert restored._thumbnail(images[0]).size == (325, 163)
+        assert image_cache.shared_image_cache.decodes == decodes
+
+    def test_reset_workspace_is_saved_empty(self, test_config_ini, tmp_path):
+        """画像をリセットして閉じた場合は、次回は何も復元しないことを確認"""
+        from PIL import Image
+
+        Image.new("RGB", (10, 10)).save(tmp_path / "a.png")
+        app = self.create_app(test_config_ini, tmp_path / "session")
+        app.image_registry.add(str(tmp_path / "a.png"))
+        app.file_name.get.return_value = ""
+        app.on_close()
+        app.image_registry.clear()
+        app.on_close()
+
+        restored = self.create_app(test_config_ini, tmp_path / "session")
+        assert restored.uploaded_images == []
+
+
+class TestPreview:
+    def test_only_added_images_are_rendered(self, test_config_ini, tmp_path):
+        """画像を追加したとき、表示済みのプレビューを作り直さず追加分だけ描画することを確認"""
+        from PIL import Image
+
+        images = []
+        for index in range(3):
+            Image.new("RGB", (20, 10), (index, 0, 0)).save(tmp_path / f"{index}.png")
+            images.append(str(tmp_path / f"{index}.png"))
+        app = TestSession.create_app(test_config_ini, tmp_path / "session")
+        app.images_frame = Mock()
+        app.image_canvas = Mock()
+        with (
+            patch("main.ttk") as mock_ttk,
+            patch("main.tk.Label"),
+            patch("main.ImageTk"),
+            patch.object(app, "_thumbnail") as thumbnail,
+        ):
+            app.image_registry.add_many(images[:2])
+            app.display_images()
+            app.image_registry.add_many(images[2:])
+            app.display_images()
+
+            assert [c.args[0] for c in thumbnail.call_args_list] == images
+            assert not app.images_frame.winfo_children.called
+            # 2列レイアウトなので、3枚目で2行目の行フレームを作る
+            rows = [
+                c
+                for c in mock_ttk.Frame.call_args_list
+                if c.args == (app.images_frame,)
+            ]
+            assert len(rows) == 2
+
+            app.images_frame.winfo_children.return_value = []
+            app._clear_selection()
+            app.image_registry.add_many(images[:1])
+            app.display_images()
+        assert thumbnail.call_count == 4
+        assert len(app.image_references) == 1
+
+
+def test_main_reports_settings_errors(capsys):
+    """設定に誤りがある場合は標準エラーに表示し、ログ設定を中途半端にせず終了することを確認"""
+    import main
+    from config import SettingsError
+
+    error = SettingsError(["[LOGGING] when は S, M のいずれかにしてください"])
+    with (
+        patch("main.Settings.from_config", side_effect=error),
+        patch("logging_setup.configure_logging") as configure_logging,
+        patch("main.run_mode") as run_mode,
+    ):
+        with pytest.raises(SystemExit) as excinfo:
+            main.main(["--serve"])
+
+    assert excinfo.value.code == 2
+    assert "[LOGGING] when" in capsys.readouterr().err
+    configure_logging.assert_not_called()
+    run_mode.assert_not_called()
@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip("numpy")
+from PIL import Image, ImageDraw, ImageFont
+
+from near_duplicates import cluster_near_duplicates, difference_hash
+
+
+def draw_chart(path, size=(400, 300), bars=(0.3, 0.8, 0.5, 0.9), labels=None, fmt=None):
+    """棒グラフ風の画像を作成する"""
+    width, height = size
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    bar_width = width // (len(bars) * 2)
+    font = ImageFont.load_default(size=max(8, height // 15))
+    for index, value in enumerate(bars):
+        left = bar_width * (index * 2 + 1)
+        draw.rectangle(
+            [left, height - int(height * value), left + bar_width, height - 1],
+            fill=(40 + 50 * index, 80, 160),
+        )
+        if labels:
+            draw.text((left, 5), labels[index], fill="black", font=font)
+    draw.line([0, height // 2, width, height // 3], fill="black", width=3)
+    img.save(path, format=fmt)
+    return str(path)
+
+
+def reexport(source, path, size, fmt=None):
+    """画像を縮小して別の形式で書き出し直す"""
+    with Image.open(source) as img:
+        img.convert("RGB").resize(size, Image.Resampling.LANCZOS).save(path, format=fmt)
+    return str(path)
+
+
+class TestNearDuplicates:
+    def test_resized_reexport_is_clustered(self, tmp_path):
+        """解像度・形式が違う同じ図が1つのクラスタになることを確認"""
+        large = draw_chart(tmp_path / "large.png", size=(800, 600))
+        small = reexport(large, tmp_path / "small.jpg", (200, 150), fmt="JPEG")
+        other = draw_chart(tmp_path / "other.png", bars=(0.9, 0.1, 0.9, 0.1))
+
+        clusters = cluster_near_duplicates([small, large, other])
+
+        # 高解像度の画像が代表になる
+        assert clusters == [[large, small], [other]]
+
+    def test_charts_with_different_labels_are_not_clustered(self, tmp_path):
+        """ハッシュが一致しても、ラベルが違うグラフはまとめないことを確認"""
+        charts = [
+            draw_chart(tmp_path / f"{name}.png", labels=labels)
+            for name, labels in (
+                ("q1", ("Jan", "Feb", "Mar", "Apr")),
+                ("q2", ("May", "Jun", "Jul", "Aug")),
+                ("q3", ("Sep", "Oct", "Nov", "Dec")),
+            )
+        ]
+        # ハッシュだけでは同じ図と判定されてしまう
+        hashes = [difference_hash(chart)[0] for chart in charts]
+        assert all((h == hashes[0]).mean() >= 0.97 for h in hashes)
+
+        clusters = cluster_near_duplicates(charts)
+        assert clusters == [[chart] for chart in charts]
+
+    def test_different_aspect_ratio_is_not_clustered(self, tmp_path):
+        """縦横比が大きく違う画像はまとめないことを確認"""
+        wide = draw_chart(tmp_path / "wide.png", size=(800, 300))
+        normal = draw_chart(tmp_path / "normal.png", size=(400, 300))
+        assert cluster_near_duplicates([wide, normal]) == [[wide], [normal]]
+
+    def test_unreadable_images_are_singletons(self, tmp_path):
+        """読み込めない画像は単独のクラスタになることを確認"""
+        broken = tmp_path / "broken.png"
+        broken.write_bytes(b"not an image")
+        image = draw_chart(tmp_path / "a.png")
+
+        assert difference_hash(broken) is None
+        assert cluster_near_duplicates([str(broken), image]) == [
+            [str(broken)],
+            [image],
+        ]
@@ -0,0 +1,122 @@
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+import pages
+from image_registry import ImageRegistry
+from journal import image_key
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """3ページのPDFを作成する"""
+    images = [Image.new("RGB", (200, 100), color) for color in ("red", "green", "blue")]
+    path = tmp_path / "paper.pdf"
+    images[0].save(path, save_all=True, append_images=images[1:])
+    return str(path)
+
+
+@pytest.fixture
+def tiff_path(tmp_path):
+    """2ページのTIFFを作成する"""
+    images = [Image.new("L", (50, 40), 0), Image.new("L", (50, 40), 255)]
+    path = tmp_path / "scan.tiff"
+    images[0].save(path, save_all=True, append_images=images[1:])
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def restore_limits():
+    yield
+    pages.configure()
+
+
+class TestPageRefs:
+    def test_expand_inputs(self, pdf_path, tiff_path, tmp_path):
+        """PDF・TIFFがページ参照に展開されることを確認"""
+        broken = tmp_path / "broken.pdf"
+        broken.write_bytes(b"not a pdf")
+
+        expanded, failed = pages.expand_inputs(
+            ["a.png", pdf_path, tiff_path, str(broken)]
+        )
+
+        assert expanded == [
+            "a.png",
+            f"{pdf_path}#page=1",
+            f"{pdf_path}#page=2",
+            f"{pdf_path}#page=3",
+            f"{tiff_path}#page=1",
+            f"{tiff_path}#page=2",
+        ]
+        assert failed == 1
+
+    def test_split_ref_ignores_plain_images(self):
+        """画像のパスはページ参照として扱われないことを確認"""
+        assert pages.split_ref("fig#page=2.png") == ("fig#page=2.png", None)
+        assert pages.split_ref("doc.pdf#page=2") == ("doc.pdf", 2)
+        assert pages.display_name("dir/doc.pdf#page=2") == "doc.pdf (p.2)"
+
+    def test_open_page(self, pdf_path, tiff_path):
+        """ページを1枚の画像として開けることを確認"""
+        with pages.open_image(f"{pdf_path}#page=2") as img:
+            assert img.getpixel((100, 50))[1] > 100  # green
+        with pages.open_image(f"{tiff_path}#page=2") as img:
+            assert img.size == (50, 40)
+            assert img.getpixel((0, 0)) == 255
+
+    def test_upload_source_writes_temporary_png(self, pdf_path):
+        """ページは一時的なPNGとして書き出され、終了後に削除されることを確認"""
+        with pages.upload_source(f"{pdf_path}#page=1") as source:
+            assert source.endswith(".png")
+            with Image.open(source) as img:
+                assert img.format == "PNG"
+        assert not os.path.exists(source)
+
+        with pages.upload_source("plain.png") as source:
+            assert source == "plain.png"
+
+    def test_decoded_pages_are_bounded(self, tiff_path):
+        """同時にデコードされるページ数が上限を超えないことを確認"""
+        pages.configure(max_decoded_pages=1)
+        opened = threading.Event()
+
+        def open_second_page():
+            with pages.open_image(f"{tiff_path}#page=2"):
+                opened.set()
+
+        with pages.open_image(f"{tiff_path}#page=1"):
+            thread = threading.Thread(target=open_second_page)
+            thread.start()
+            assert not opened.wait(0.2)
+        assert opened.wait(2)
+        thread.join()
+
+    def test_unchanged_limit_keeps_page_slots(self):
+        """上限が変わらない再設定ではデコード中のページの枠を置き換えないことを確認"""
+        pages.configure(max_decoded_pages=2)
+        slots = pages._page_slots
+        pages.configure(pdf_dpi=300, max_decoded_pages=2)
+        assert pages._page_slots is slots
+        pages.configure(max_decoded_pages=3)
+        assert pages._page_slots is not slots
+
+
+class TestPagesInRegistryAndJournal:
+    def test_pages_of_same_file_are_distinct(self, pdf_path):
+        """同じファイルの別ページが重複として扱われないことを確認"""
+        refs, _ = pages.expand_inputs([pdf_path])
+        registry = ImageRegistry()
+        added, skipped = registry.add_many(refs + refs[:1])
+        assert len(added) == 3
+        assert skipped == 1
+        assert registry.paths == refs
+
+    def test_image_key_includes_page(self, pdf_path):
+        """ジャーナルのキーがページごとに異なることを確認"""
+        first = image_key(f"{pdf_path}#page=1")
+        second = image_key(f"{pdf_path}#page=2")
+        assert first != second
+        assert first.endswith("#page=1")
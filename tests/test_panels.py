@@ -0,0 +1,68 @@
+import pytest
+
+pytest.importorskip("numpy")
+from PIL import Image, ImageDraw
+
+from panels import combine_panel_results, find_panels, split_panels
+
+
+def draw_grid(origins, size=(600, 400), panel=(260, 160), label=False):
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for x, y in origins:
+        draw.rectangle([x, y, x + panel[0], y + panel[1]], outline="black", width=2)
+        if label:
+            draw.text((x, y - 15), "(a)", fill="black")
+    return img
+
+
+class TestFindPanels:
+    def test_grid_is_split_in_reading_order(self):
+        """2×2のパネルが左上から行ごとに検出されることを確認"""
+        img = draw_grid([(20, 30), (320, 30), (20, 230), (320, 230)])
+        boxes = find_panels(img)
+        assert len(boxes) == 4
+        lefts_tops = [(left, top) for left, top, _, _ in boxes]
+        assert lefts_tops == sorted(lefts_tops, key=lambda p: (p[1], p[0]))
+
+    def test_single_figure_is_not_split(self):
+        """1つの図は分割されず画像全体が返されることを確認"""
+        img = draw_grid([(50, 50)], panel=(500, 300))
+        assert find_panels(img) == [(0, 0, 600, 400)]
+
+    def test_small_labels_are_kept_with_panels(self):
+        """余白で離れたサブラベルが隣のパネルに含まれることを確認"""
+        img = draw_grid([(20, 60), (320, 60)], panel=(260, 300), label=True)
+        boxes = find_panels(img)
+        assert len(boxes) == 2
+        assert all(top <= 45 for _, top, _, _ in boxes)
+
+    def test_blank_image(self):
+        """空白の画像は分割されないことを確認"""
+        assert find_panels(Image.new("L", (100, 100), 255)) == [(0, 0, 100, 100)]
+
+
+def test_split_panels_saves_crops(tmp_path):
+    """パネル画像が保存されることを確認"""
+    source = tmp_path / "fig.png"
+    draw_grid([(20, 30), (320, 30)], panel=(260, 340)).save(source)
+
+    crops = split_panels(source, tmp_path / "out")
+
+    assert [p.rsplit("/", 1)[-1] for p in crops] == ["fig_a.png", "fig_b.png"]
+    assert split_panels(tmp_path / "missing.png", tmp_path / "out") == []
+
+
+def test_combine_panel_results():
+    """パネルごとの結果がパネルごとに1つの図にまとめられることを確認"""
+    combined = combine_panel_results(
+        "fig",
+        [
+            [{"figure_name": "Figure 2", "token": ["1", "2"]}, {"token": ["3"]}],
+            [],
+        ],
+    )
+    assert combined == [
+        {"figure_name": "Figure 2 (a)", "token": ["1", "2", "3"]},
+        {"figure_name": "fig (b)", "token": []},
+    ]
@@ -0,0 +1,103 @@
+import json
+import pstats
+import threading
+
+import profiling
+from profiling import RunProfiler
+
+
+def busy(n=20000):
+    return sum(i * i for i in range(n))
+
+
+def test_stage_profiles_are_merged_across_threads(tmp_path):
+    """並列に実行した同じ段階の計測を1つにまとめて書き出すことを確認"""
+    # スレッドの起動処理の関数が上位に並ぶため、一覧は多めに書き出す
+    profiler = RunProfiler(tmp_path / "run", top=100)
+    try:
+        barrier = threading.Barrier(3)
+
+        def upload():
+            with profiler.profile("upload"):
+                barrier.wait(5)
+                busy()
+
+        threads = [threading.Thread(target=upload) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with profiler.profile("extract"):
+            busy()
+        profiler.flush()
+    finally:
+        profiler.close()
+
+    run_dir = tmp_path / "run"
+    stats = pstats.Stats(str(run_dir / "upload.pstats"))
+    assert any(func[2] == "busy" for func in stats.stats)
+    assert "busy" in (run_dir / "upload.txt").read_text(encoding="utf-8")
+    summary = json.loads((run_dir / "summary.json").read_text(encoding="utf-8"))
+    assert summary["stages"]["upload"]["calls"] == 3
+    assert summary["stages"]["extract"]["calls"] == 1
+
+
+def test_nested_stage_is_counted_in_outer_stage(tmp_path):
+    """同じスレッドで計測中の段階の内側は外側の段階に含めることを確認"""
+    profiler = RunProfiler(tmp_path, top=5)
+    try:
+        with profiler.profile("extract"):
+            with profiler.profile("upload"):
+                busy()
+        profiler.flush()
+    finally:
+        profiler.close()
+
+    summary = json.loads((tmp_path / "summary.json").read_text(encoding="utf-8"))
+    assert summary["stages"]["upload"]["overlapped"] == 1
+    assert not (tmp_path / "upload.pstats").exists()
+    assert any(
+        func[2] == "busy"
+        for func in pstats.Stats(str(tmp_path / "extract.pstats")).stats
+    )
+
+
+def test_memory_report_lists_allocations(tmp_path):
+    """メモリのスナップショットの差分から割り当て元を書き出すことを確認"""
+    profiler = RunProfiler(tmp_path, top=5)
+    try:
+        with profiler.memory("generate_pptx"):
+            kept = [bytearray(1024) for _ in range(1000)]
+        profiler.flush()
+    finally:
+        profiler.close()
+
+    report = (tmp_path / "generate_pptx.001.memory.txt").read_text(encoding="utf-8")
+    assert "test_profiling.py" in report
+    summary = json.loads((tmp_path / "summary.json").read_text(encoding="utf-8"))
+    assert summary["memory"]["generate_pptx"][0]["retained_bytes"] >= 1000 * 1024
+    assert len(kept) == 1000
+
+
+def test_module_functions_do_nothing_when_disabled(tmp_path):
+    """プロファイルを開始していない場合は何も書き出さないことを確認"""
+    assert profiling.active() is None
+    with profiling.profile("upload"), profiling.memory("display_images"):
+        busy()
+    profiling.flush()
+    profiling.stop()
+
+
+def test_start_creates_run_directory(tmp_path):
+    """開始すると実行ごとのディレクトリに書き出し、終了で閉じることを確認"""
+    profiler = profiling.start(tmp_path, top=5)
+    try:
+        assert profiling.start(tmp_path) is profiler
+        with profiling.profile("save"):
+            busy()
+    finally:
+        profiling.stop()
+
+    assert profiling.active() is None
+    assert profiler.run_dir.parent == tmp_path
+    assert (profiler.run_dir / "save.pstats").exists()
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+from prompt_cache import PromptCache, REFRESH_MARGIN_SECONDS, RETRY_AFTER_SECONDS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client():
+    client = Mock()
+    counter = iter(range(100))
+    client.caches.create.side_effect = lambda **kwargs: SimpleNamespace(
+        name=f"cachedContents/{next(counter)}"
+    )
+    return client
+
+
+class TestPromptCache:
+    def test_cache_is_reused_per_model(self):
+        """同じキーとモデルではキャッシュが1回だけ作成されることを確認"""
+        client = make_client()
+        cache = PromptCache(clock=FakeClock())
+
+        first = cache.get(client, "key", "flash", "prompt", ttl=600)
+        second = cache.get(client, "key", "flash", "prompt", ttl=600)
+        other = cache.get(client, "key", "pro", "prompt", ttl=600)
+
+        assert first == second == "cachedContents/0"
+        assert other == "cachedContents/1"
+        assert client.caches.create.call_count == 2
+
+    def test_prompt_change_invalidates_cache(self):
+        """プロンプトが変わると古いキャッシュを削除して作り直すことを確認"""
+        client = make_client()
+        cache = PromptCache(clock=FakeClock())
+
+        cache.get(client, "key", "flash", "old prompt", ttl=600)
+        name = cache.get(client, "key", "flash", "new prompt", ttl=600)
+
+        assert name == "cachedContents/1"
+        client.caches.delete.assert_called_once_with(name="cachedContents/0")
+
+    def test_cache_is_refreshed_before_expiry(self):
+        """期限が近づいたらTTLが延長されることを確認"""
+        clock = FakeClock()
+        client = make_client()
+        cache = PromptCache(clock=clock)
+
+        cache.get(client, "key", "flash", "prompt", ttl=600)
+        clock.now = 600 - REFRESH_MARGIN_SECONDS / 2
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) == (
+            "cachedContents/0"
+        )
+        client.caches.update.assert_called_once()
+        assert client.caches.create.call_count == 1
+
+    def test_expired_cache_is_recreated(self):
+        """期限切れのキャッシュは作り直されることを確認"""
+        clock = FakeClock()
+        client = make_client()
+        cache = PromptCache(clock=clock)
+
+        cache.get(client, "key", "flash", "prompt", ttl=600)
+        clock.now = 1000
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) == (
+            "cachedContents/1"
+        )
+
+    def test_failed_creation_is_not_retried(self):
+        """4xxエラーで作成に失敗した場合はNoneを返し、再試行しないことを確認"""
+        error = RuntimeError("too few tokens")
+        error.code = 400
+        client = Mock()
+        client.caches.create.side_effect = error
+        clock = FakeClock()
+        cache = PromptCache(clock=clock)
+
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) is None
+        clock.now = RETRY_AFTER_SECONDS * 10
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) is None
+        assert client.caches.create.call_count == 1
+
+    def test_transient_failure_is_retried(self):
+        """一時的なエラーの場合は一定時間後に再試行することを確認"""
+        client = make_client()
+        create = client.caches.create.side_effect
+        client.caches.create.side_effect = [ConnectionError("reset"), create()]
+        clock = FakeClock()
+        cache = PromptCache(clock=clock)
+
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) is None
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) is None
+        assert client.caches.create.call_count == 1
+
+        clock.now = RETRY_AFTER_SECONDS
+        assert cache.get(client, "key", "flash", "prompt", ttl=600) == (
+            "cachedContents/0"
+        )
+
+    def test_disabled_when_ttl_is_zero(self):
+        """TTLが0の場合はキャッシュを使わないことを確認"""
+        client = make_client()
+        cache = PromptCache(clock=FakeClock())
+        assert cache.get(client, "key", "flash", "prompt", ttl=0) is None
+        assert not client.caches.create.called
+
+    def test_usage_is_recorded(self):
+        """キャッシュから読み込まれたトークン数が集計されることを確認"""
+        cache = PromptCache()
+        response = SimpleNamespace(
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=1500, cached_content_token_count=1200
+            )
+        )
+        assert cache.record_usage(response, cached=True) == (1500, 1200)
+        assert cache.record_usage(SimpleNamespace(), cached=False) == (0, 0)
+        assert cache.stats() == {
+            "requests": 2,
+            "cached_requests": 1,
+            "prompt_tokens": 1500,
+            "cached_tokens": 1200,
+        }
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+from results_store import (
+    append_results,
+    deck_path,
+    iter_results,
+    read_results,
+    read_sources,
+    sidecar_path,
+    with_sources,
+    write_results,
+)
+
+
+def test_sidecar_and_deck_paths():
+    """PPTXと結果ファイルのパスが相互に変換できることを確認"""
+    assert sidecar_path("out/deck.pptx") == Path("out/deck.results.jsonl")
+    assert deck_path("out/deck.results.jsonl") == Path("out/deck.pptx")
+    assert deck_path("out/other.jsonl") == Path("out/other.pptx")
+
+
+def test_round_trip(tmp_path):
+    """書き出した結果が同じ内容で読み込めることを確認"""
+    figures = [
+        {"figure_name": "図1", "token": ["−1.0", "mA cm⁻²"]},
+        {"figure_name": "Fig. 2", "token": []},
+    ]
+    path = write_results(tmp_path / "deck.results.jsonl", iter(figures))
+
+    assert read_results(path) == figures
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    assert not (tmp_path / "deck.results.jsonl.tmp").exists()
+
+
+def test_corrupt_lines_are_skipped(tmp_path):
+    """壊れた行や空行は読み飛ばされることを確認"""
+    path = tmp_path / "deck.results.jsonl"
+    path.write_text(
+        '{"figure_name": "a", "token": []}\n\n{"figure_name": "b", "tok\n',
+        encoding="utf-8",
+    )
+    assert [f["figure_name"] for f in iter_results(path)] == ["a"]
+
+
+def test_sources_are_kept_apart_from_figures(tmp_path):
+    """抽出元の画像のキーは図とは別に読み込めることを確認"""
+    figures = [{"figure_name": "a", "token": []}, {"figure_name": "b", "token": []}]
+    path = write_results(
+        tmp_path / "deck.results.jsonl",
+        with_sources(figures, [["key1"], ["key1", "key2"]]),
+    )
+
+    assert read_results(path) == figures
+    assert read_sources(path) == {"key1", "key2"}
+
+
+def test_append_after_torn_line(tmp_path):
+    """途切れた最後の行の後ろに書き足しても、書き足した図が読み込めることを確認"""
+    path = tmp_path / "deck.results.jsonl"
+    path.write_text('{"figure_name": "a", "token": []}\n{"figure_na', encoding="utf-8")
+    append_results(path, [{"figure_name": "b", "token": ["1"]}])
+    append_results(path, [{"figure_name": "c", "token": []}])
+
+    assert [f["figure_name"] for f in iter_results(path)] == ["a", "b", "c"]
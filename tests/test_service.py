@@ -0,0 +1,247 @@
+import base64
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from service import (
+    STATUS_FAILED,
+    STATUS_SUCCEEDED,
+    ExtractionService,
+    JobRejected,
+    ServiceLimits,
+    create_server,
+)
+
+
+class FakePipeline:
+    """run_pipelineの代わりにダミーのPPTXを書き出すパイプライン"""
+
+    instances = 0
+
+    def __init__(self):
+        FakePipeline.instances += 1
+        self.uploaded_images = []
+        self.output_name = ""
+        self.output_dir = None
+        self.shared_client = None
+        self.generate_client = None
+        self.key_pool = None
+        self.last_results = None
+
+    def run_pipeline(self, resume=False):
+        if any("broken" in path for path in self.uploaded_images):
+            raise ValueError("extraction failed")
+        self.last_results = [
+            {"figure_name": Path(path).name, "token": ["1"]}
+            for path in self.uploaded_images
+        ]
+        output_path = Path(self.output_dir) / f"{self.output_name}.pptx"
+        output_path.write_bytes(b"pptx")
+        return output_path
+
+
+@pytest.fixture
+def service(tmp_path):
+    shared_client = object()
+    service = ExtractionService(
+        FakePipeline,
+        tmp_path / "jobs",
+        workers=2,
+        queue_size=4,
+        limits=ServiceLimits(max_images=2, max_image_bytes=100),
+        shared_client=shared_client,
+    )
+    service.start()
+    yield service
+    service.stop()
+
+
+@pytest.fixture
+def base_url(service):
+    server = create_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=data, method="POST" if data else "GET")
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def wait_for(service, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = service.get(job_id)
+        if job.status in (STATUS_SUCCEEDED, STATUS_FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def image_payload(*names, data=b"png"):
+    return [{"name": name, "data": base64.b64encode(data).decode()} for name in names]
+
+
+class TestExtractionService:
+    def test_submit_status_and_download(self, service, base_url):
+        """ジョブの投入・状態確認・ダウンロードができることを確認"""
+        status, body = request(
+            f"{base_url}/jobs",
+            {"output_name": "deck", "images": image_payload("a.png")},
+        )
+        assert status == 202
+        job_id = json.loads(body)["id"]
+
+        job = wait_for(service, job_id)
+        assert job.status == STATUS_SUCCEEDED
+
+        status, body = request(f"{base_url}/jobs/{job_id}")
+        assert json.loads(body)["status"] == STATUS_SUCCEEDED
+
+        status, body = request(f"{base_url}/jobs/{job_id}/tokens")
+        assert json.loads(body)[0]["token"] == ["1"]
+
+        status, body = request(f"{base_url}/jobs/{job_id}/pptx")
+        assert status == 200
+        assert body == b"pptx"
+
+    def test_limits_are_enforced(self, base_url):
+        """ジョブごとの上限を超えると拒否されることを確認"""
+        status, _ = request(
+            f"{base_url}/jobs", {"images": image_payload("a.png", "b.png", "c.png")}
+        )
+        assert status == 413
+
+        status, _ = request(
+            f"{base_url}/jobs", {"images": image_payload("a.png", data=b"x" * 101)}
+        )
+        assert status == 413
+
+        status, _ = request(f"{base_url}/jobs", {"images": image_payload("a.gif")})
+        assert status == 415
+
+    def test_malformed_content_length_is_rejected(self, base_url):
+        """Content-Length が数値でない・負の場合は 400 で拒否されることを確認"""
+        host, port = base_url.removeprefix("http://").split(":")
+        for value in ("abc", "-1"):
+            connection = http.client.HTTPConnection(host, int(port), timeout=5)
+            try:
+                connection.putrequest("POST", "/jobs")
+                connection.putheader("Content-Length", value)
+                connection.endheaders()
+                response = connection.getresponse()
+                assert response.status == 400
+                assert "error" in json.loads(response.read())
+            finally:
+                connection.close()
+
+    def test_failed_job_reports_error(self, service):
+        """失敗したジョブがエラー内容を保持することを確認"""
+        job = service.submit([("broken.png", b"png")])
+        job = wait_for(service, job.id)
+        assert job.status == STATUS_FAILED
+        assert "extraction failed" in job.error
+
+    def test_workers_share_client(self, service):
+        """ワーカーのパイプラインが共有クライアントを使うことを確認"""
+        pipeline = service._create_pipeline()
+        assert pipeline.shared_client is service.shared_client
+        assert pipeline.generate_client is service.shared_client
+
+    def test_workers_share_key_pool(self, tmp_path):
+        """ワーカーのパイプラインが1つのキープールを共有することを確認"""
+        key_pool = object()
+        service = ExtractionService(FakePipeline, tmp_path, shared_key_pool=key_pool)
+        first = service._create_pipeline()
+        second = service._create_pipeline()
+        assert first.key_pool is key_pool
+        assert second.key_pool is key_pool
+
+    def test_output_name_is_sanitized(self, service):
+        """出力名からパス成分が取り除かれることを確認"""
+        job = service.submit([("a.png", b"png")], output_name="../../evil")
+        assert job.output_name == "evil"
+        wait_for(service, job.id)
+
+
+def test_multi_page_tiff_is_expanded(service):
+    """TIFFのジョブがページごとの画像として処理されることを確認"""
+    import io
+
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    frames = [Image.new("RGB", (10, 10), color) for color in ("red", "blue")]
+    frames[0].save(buffer, format="TIFF", save_all=True, append_images=frames[1:])
+    service.limits = ServiceLimits(max_image_bytes=len(buffer.getvalue()))
+
+    job = wait_for(service, service.submit([("scan.tiff", buffer.getvalue())]).id)
+    assert job.status == STATUS_SUCCEEDED
+    assert [figure["figure_name"] for figure in job.results] == [
+        "0000_scan.tiff#page=1",
+        "0000_scan.tiff#page=2",
+    ]
+
+
+def test_queue_full_is_rejected(tmp_path):
+    """キューが満杯の場合に503で拒否されることを確認"""
+    service = ExtractionService(FakePipeline, tmp_path, queue_size=1)
+    service.submit([("a.png", b"png")])
+    with pytest.raises(JobRejected) as excinfo:
+        service.submit([("b.png", b"png")])
+    assert excinfo.value.status == 503
+
+
+def test_expired_jobs_are_removed(tmp_path):
+    """保持期間を過ぎた完了済みジョブと作業フォルダが削除されることを確認"""
+    now = [1000.0]
+    service = ExtractionService(
+        FakePipeline, tmp_path, job_retention=60.0, clock=lambda: now[0]
+    )
+    service.start()
+    try:
+        job = wait_for(service, service.submit([("a.png", b"png")]).id)
+        # 時刻はすべて注入した時計で記録される
+        assert job.created_at == job.started_at == job.finished_at == now[0]
+        assert job.work_dir.is_dir()
+
+        assert service.purge_expired() == 0
+        now[0] += 61.0
+        assert service.purge_expired() == 1
+        assert service.get(job.id) is None
+        assert not job.work_dir.exists()
+    finally:
+        service.stop()
+
+
+def test_body_limit_follows_reloaded_limits(tmp_path):
+    """再読み込みした受付上限がリクエスト本文の上限にも反映されることを確認"""
+    service = ExtractionService(
+        FakePipeline, tmp_path, limits=ServiceLimits(max_total_bytes=1)
+    )
+    server = create_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        service.limits = ServiceLimits()
+        payload = {"images": image_payload("a.png", data=b"x" * 100 * 1024)}
+        status, _ = request(f"{base_url}/jobs", payload)
+        assert status == 202
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,90 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image
+
+from image_registry import ImageEntry
+from session import RemoteHandle, SessionStore
+
+
+def make_images(tmp_path, names=("a.png", "b.png")):
+    paths = []
+    for name in names:
+        Image.new("RGB", (40, 20), "white").save(tmp_path / name)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def entries(paths):
+    return [ImageEntry(path, os.path.getsize(path)) for path in paths]
+
+
+def test_save_and_load(tmp_path):
+    """画像一覧・出力ファイル名・縮小画像・アップロードを保存して読み込めることを確認"""
+    paths = make_images(tmp_path)
+    store = SessionStore(tmp_path / "session")
+    expires = datetime.now(timezone.utc) + timedelta(hours=40)
+    remote = RemoteHandle("files/a", expires.isoformat(), "key1")
+
+    store.save(
+        "deck",
+        entries(paths),
+        uploads={paths[0]: remote},
+        thumbnails={paths[1]: Image.new("RGB", (10, 5))},
+    )
+    session = SessionStore(tmp_path / "session").load()
+
+    assert session.output_name == "deck"
+    assert [image.path for image in session.images] == paths
+    assert session.images[0].remote == remote
+    assert session.images[1].remote is None
+    assert store.thumbnail_path(session.images[0]) is None
+    assert store.open_thumbnail(store.thumbnail_path(session.images[1])).size == (
+        10,
+        5,
+    )
+
+
+def test_changed_images_and_expiring_uploads_are_dropped(tmp_path):
+    """削除・更新された画像と期限が迫ったアップロードは復元しないことを確認"""
+    paths = make_images(tmp_path, ("a.png", "b.png", "c.png"))
+    store = SessionStore(tmp_path / "session")
+    soon = datetime.now(timezone.utc) + timedelta(minutes=1)
+    store.save(
+        "",
+        entries(paths),
+        uploads={paths[0]: RemoteHandle("files/a", soon.isoformat())},
+    )
+    os.remove(paths[1])
+    Image.new("RGB", (80, 20), "black").save(paths[2])
+
+    session = store.load()
+
+    assert [image.path for image in session.images] == [paths[0]]
+    assert session.images[0].remote is None
+
+
+def test_unused_thumbnails_are_removed(tmp_path):
+    """一覧から外した画像の縮小画像は次の保存で削除されることを確認"""
+    paths = make_images(tmp_path)
+    store = SessionStore(tmp_path / "session")
+    thumbnails = {path: Image.new("RGB", (10, 5)) for path in paths}
+    store.save("", entries(paths), thumbnails=thumbnails)
+    assert len(list(store.thumbnail_dir.glob("*.png"))) == 2
+
+    # 保存済みの縮小画像は、縮小画像を渡さなくても引き継がれる
+    store.save("", entries(paths[:1]))
+
+    assert len(list(store.thumbnail_dir.glob("*.png"))) == 1
+    assert store.load().images[0].thumbnail is not None
+
+
+def test_missing_or_broken_snapshot(tmp_path):
+    """作業状態がない・壊れている・形式が違う場合はNoneを返すことを確認"""
+    store = SessionStore(tmp_path)
+    assert store.load() is None
+    store.path.write_text("{", encoding="utf-8")
+    assert store.load() is None
+    store.path.write_text(json.dumps({"version": 0}), encoding="utf-8")
+    assert store.load() is None
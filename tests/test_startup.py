@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# import main にかかる時間の上限（秒）。遅延importの退行を検出するためのもの
+IMPORT_TIME_BUDGET = 0.5
+
+HEAVY_MODULES = ("google.genai", "pptx", "pydantic", "PIL")
+
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "elapsed": elapsed,
+    "loaded": [m for m in %r if m in sys.modules],
+    "handlers": len(__import__("logging").getLogger().handlers),
+}))
+""" % (HEAVY_MODULES,)
+
+
+@pytest.fixture(scope="module")
+def import_stats():
+    """新しいプロセスで import main を計測する（最速の3回分）"""
+    runs = []
+    for _ in range(3):
+        completed = subprocess.run(
+            [sys.executable, "-c", MEASURE_SCRIPT],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda run: run["elapsed"])
+
+
+class TestStartup:
+    def test_heavy_modules_are_not_imported(self, import_stats):
+        """import main で重いモジュールが読み込まれないことを確認"""
+        assert import_stats["loaded"] == []
+
+    def test_logging_is_not_configured_at_import(self, import_stats):
+        """import時にログハンドラ（ファイルI/O）が設定されないことを確認"""
+        assert import_stats["handlers"] == 0
+
+    def test_import_time_budget(self, import_stats):
+        """import main が時間内に完了することを確認"""
+        assert import_stats["elapsed"] < IMPORT_TIME_BUDGET
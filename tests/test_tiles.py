@@ -0,0 +1,76 @@
+from PIL import Image
+
+from tiles import find_tiles, merge_tile_results, split_tiles
+
+
+class TestFindTiles:
+    def test_small_image_is_not_split(self):
+        """長辺が max_side 以下の画像は分割されないことを確認"""
+        assert find_tiles(800, 600, max_side=1000) == [(0, 0, 800, 600)]
+
+    def test_tiles_cover_image_with_overlap(self):
+        """タイルが読む順に並び、重なりを持って画像全体を覆うことを確認"""
+        boxes = find_tiles(2500, 900, max_side=1000, overlap_ratio=0.1)
+
+        assert len(boxes) == 3
+        assert [top for _, top, _, _ in boxes] == [0, 0, 0]
+        assert boxes[0][0] == 0 and boxes[-1][2] == 2500
+        assert all(bottom == 900 for _, _, _, bottom in boxes)
+        for (_, _, right, _), (left, _, _, _) in zip(boxes, boxes[1:]):
+            assert right - left >= 100
+        assert all(right - left <= 1000 for left, _, right, _ in boxes)
+
+    def test_grid_in_reading_order(self):
+        """縦横に分割したタイルが行ごとに左から並ぶことを確認"""
+        boxes = find_tiles(2000, 2000, max_side=1000, overlap_ratio=0.1)
+
+        assert len(boxes) == 9
+        lefts_tops = [(left, top) for left, top, _, _ in boxes]
+        assert lefts_tops == sorted(lefts_tops, key=lambda p: (p[1], p[0]))
+
+    def test_tile_count_is_limited(self):
+        """タイルの数が max_tiles 以下に抑えられることを確認"""
+        boxes = find_tiles(10000, 3000, max_side=1000, max_tiles=8)
+
+        assert 2 <= len(boxes) <= 8
+        assert boxes[-1][2:] == (10000, 3000)
+
+
+def test_split_tiles_saves_crops(tmp_path):
+    """巨大な画像だけがタイルに分割されて保存されることを確認"""
+    Image.new("RGB", (1200, 300), "white").save(tmp_path / "poster.png")
+    Image.new("RGB", (400, 300), "white").save(tmp_path / "small.png")
+
+    crops = split_tiles(tmp_path / "poster.png", tmp_path / "out", max_side=512)
+
+    assert [p.rsplit("/", 1)[-1] for p in crops] == [
+        "poster_tile01.png",
+        "poster_tile02.png",
+        "poster_tile03.png",
+    ]
+    with Image.open(crops[0]) as tile:
+        assert max(tile.size) <= 512
+    assert split_tiles(tmp_path / "small.png", tmp_path / "out", max_side=512) == []
+    assert split_tiles(tmp_path / "missing.png", tmp_path / "out") == []
+
+
+def test_merge_tile_results():
+    """重なりで重複したトークンをまとめ、タイル内の繰り返しは残すことを確認"""
+    merged = merge_tile_results(
+        "poster",
+        [
+            [{"figure_name": "Figure 1", "token": ["Time (s)", "0", "0", "Signal"]}],
+            [{"figure_name": "", "token": ["Signal", "time  (S)", "Legend"]}],
+            [{"figure_name": "Figure 1", "token": ["0", "0", "0"]}],
+        ],
+    )
+
+    assert merged == [
+        {
+            "figure_name": "Figure 1",
+            "token": ["Time (s)", "0", "0", "Signal", "Legend", "0"],
+        }
+    ]
+    assert merge_tile_results("poster", [[], []]) == [
+        {"figure_name": "poster", "token": []}
+    ]
@@ -0,0 +1,120 @@
+import json
+import threading
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    def start(format="chrome"):
+        return tracing.start(tmp_path / "traces", format=format)
+
+    yield start
+    tracing.stop()
+
+
+def trace_files(tmp_path):
+    return sorted((tmp_path / "traces").glob("*.json"))
+
+
+def test_spans_are_propagated_to_worker_threads(tmp_path, recorder):
+    """ワーカースレッドのスパンが実行の子として記録され、Chrome形式で書き出されることを確認"""
+    recorder()
+
+    def upload(name):
+        with tracing.span("upload", image=name):
+            pass
+
+    with tracing.run("run_pipeline", images=2) as run:
+        threads = [
+            threading.Thread(target=tracing.wrap(upload), args=(name,))
+            for name in ("a.png", "b.png")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with tracing.span("generate_pptx"):
+            assert tracing.current_ids()[0] == run.trace_id
+
+    [path] = trace_files(tmp_path)
+    assert path.name.endswith(f"_{run.trace_id[:8]}.trace.json")
+    trace = json.loads(path.read_text(encoding="utf-8"))
+    assert trace["otherData"]["trace_id"] == run.trace_id
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert sorted(e["name"] for e in spans) == [
+        "generate_pptx",
+        "run_pipeline",
+        "upload",
+        "upload",
+    ]
+    uploads = [e for e in spans if e["name"] == "upload"]
+    assert {e["args"]["image"] for e in uploads} == {"a.png", "b.png"}
+    assert all(e["args"]["parent_id"] == run.span_id for e in uploads)
+    assert len({e["tid"] for e in uploads}) == 2
+    # スレッド名のメタデータでタイムラインの行に名前が付く
+    assert any(e["ph"] == "M" for e in trace["traceEvents"])
+
+
+def test_otlp_export_records_errors(tmp_path, recorder):
+    """OTLP/JSON形式で書き出し、失敗したスパンはエラーになることを確認"""
+    recorder("otlp")
+
+    with pytest.raises(RuntimeError):
+        with tracing.run("run_pipeline", resume=False) as run:
+            with tracing.span("extract", images=["a.png"], files=1):
+                raise RuntimeError("quota")
+
+    [path] = trace_files(tmp_path)
+    assert path.name.endswith(".otlp.json")
+    trace = json.loads(path.read_text(encoding="utf-8"))
+    resource = trace["resourceSpans"][0]
+    assert resource["resource"]["attributes"][0]["value"] == {
+        "stringValue": "image-to-textbox"
+    }
+    spans = {s["name"]: s for s in resource["scopeSpans"][0]["spans"]}
+    assert spans["run_pipeline"]["traceId"] == run.trace_id
+    assert len(run.trace_id) == 32 and len(run.span_id) == 16
+    extract = spans["extract"]
+    assert extract["parentSpanId"] == run.span_id
+    assert extract["status"] == {"code": 2, "message": "RuntimeError: quota"}
+    attributes = {a["key"]: a["value"] for a in extract["attributes"]}
+    assert attributes["files"] == {"intValue": "1"}
+    assert attributes["images"] == {
+        "arrayValue": {"values": [{"stringValue": "a.png"}]}
+    }
+    assert int(extract["endTimeUnixNano"]) >= int(extract["startTimeUnixNano"])
+
+
+def test_spans_outside_a_run_are_not_recorded(tmp_path, recorder):
+    """実行の外のスパンと、実行の終了後に終わったスパンは記録しないことを確認"""
+    recorder()
+    with tracing.span("upload") as span:
+        assert span is None
+        assert tracing.current_ids() == (None, None)
+
+    release = threading.Event()
+
+    def late():
+        with tracing.span("delete"):
+            release.wait(5)
+
+    with tracing.run("run_pipeline"):
+        worker = threading.Thread(target=tracing.wrap(late))
+        worker.start()
+    release.set()
+    worker.join()
+
+    [path] = trace_files(tmp_path)
+    trace = json.loads(path.read_text(encoding="utf-8"))
+    names = [e["name"] for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert names == ["run_pipeline"]
+
+
+def test_run_without_recorder_only_assigns_ids(tmp_path):
+    """トレースを有効にしていない場合もログ用の実行IDは割り当てることを確認"""
+    with tracing.run("run_pipeline") as run:
+        assert tracing.current_ids() == (run.trace_id, run.span_id)
+    assert not (tmp_path / "traces").exists()
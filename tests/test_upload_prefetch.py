@@ -0,0 +1,92 @@
+import threading
+
+from upload_prefetch import UploadPrefetcher
+
+
+class FakeFiles:
+    """アップロードしたファイルと削除したファイルを記録する"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.uploaded = []
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def upload(self, file_path):
+        if file_path in self.fail:
+            raise OSError("upload failed")
+        with self.lock:
+            self.uploaded.append(file_path)
+        return f"files/{file_path}"
+
+    def delete(self, file):
+        with self.lock:
+            self.deleted.append(file)
+
+
+def test_take_returns_prefetched_uploads():
+    """先に始めたアップロードの結果を受け取り、同じ画像は二重にアップロードしないことを確認"""
+    files = FakeFiles(fail={"broken.png"})
+    prefetcher = UploadPrefetcher(files.upload, files.delete)
+    prefetcher.submit(["a.png", "b.png", "broken.png"])
+    prefetcher.submit(["a.png"])
+
+    taken = prefetcher.take(["a.png", "broken.png", "unknown.png"])
+
+    # 失敗した画像と先にアップロードしていない画像は呼び出し側でアップロードする
+    assert taken == {"a.png": "files/a.png"}
+    assert "a.png" not in prefetcher
+    assert "b.png" in prefetcher
+    assert sorted(files.uploaded) == ["a.png", "b.png"]
+
+
+def test_discard_deletes_finished_and_cancels_pending_uploads():
+    """取り消した画像のうち、完了したアップロードは削除し、未開始のものは実行しないことを確認"""
+    files = FakeFiles()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_upload(file_path):
+        started.set()
+        release.wait(5)
+        return files.upload(file_path)
+
+    prefetcher = UploadPrefetcher(slow_upload, files.delete, max_workers=1)
+    prefetcher.submit(["running.png", "queued.png"])
+    assert started.wait(5)
+
+    prefetcher.discard()
+    release.set()
+    prefetcher._executor.shutdown(wait=True)
+
+    assert len(prefetcher) == 0
+    assert files.uploaded == ["running.png"]
+    assert files.deleted == ["files/running.png"]
+
+
+def test_discard_only_given_paths():
+    """指定した画像のアップロードだけを削除することを確認"""
+    files = FakeFiles()
+    prefetcher = UploadPrefetcher(files.upload, files.delete)
+    prefetcher.submit(["keep.png", "drop.png"])
+    prefetcher._executor.shutdown(wait=True)
+
+    prefetcher.discard(["drop.png"])
+
+    assert files.deleted == ["files/drop.png"]
+    assert prefetcher.take(["keep.png"]) == {"keep.png": "files/keep.png"}
+
+
+def test_adopt_and_detach():
+    """以前のアップロードを取り込み、完了したものだけを削除せずに取り出せることを確認"""
+    files = FakeFiles()
+    prefetcher = UploadPrefetcher(files.upload, files.delete)
+    prefetcher.adopt("restored.png", lambda: "files/restored")
+    prefetcher.submit(["restored.png", "new.png"])
+    prefetcher._executor.shutdown(wait=True)
+
+    assert prefetcher.detach(["restored.png"]) == {"restored.png": "files/restored"}
+    assert files.uploaded == ["new.png"]
+    assert prefetcher.detach() == {"new.png": "files/new.png"}
+    assert len(prefetcher) == 0
+    assert files.deleted == []
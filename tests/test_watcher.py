@@ -0,0 +1,269 @@
+import sys
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+
+from watcher import Batcher, Debouncer, PollingSource, WatchDaemon, create_source
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def watch_dir(tmp_path):
+    directory = tmp_path / "watch"
+    directory.mkdir()
+    return directory
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = Mock()
+    pipeline.run_pipeline.return_value = Path("out.pptx")
+    pipeline.extracted_images.return_value = []
+    return pipeline
+
+
+class TestDebouncer:
+    def test_file_is_ready_after_settle_time(self, watch_dir):
+        """サイズが変化しなくなってから一定時間後に通過することを確認"""
+        image = watch_dir / "a.png"
+        image.write_bytes(b"partial")
+        debouncer = Debouncer(settle_seconds=2.0)
+        debouncer.touch(image, 0.0)
+
+        assert debouncer.ready(0.0) == []
+        assert debouncer.ready(1.0) == []
+        assert debouncer.ready(2.5) == [image]
+        assert len(debouncer) == 0
+
+    def test_growing_file_is_held_back(self, watch_dir):
+        """書き込み中（サイズが変化中）のファイルは通過しないことを確認"""
+        image = watch_dir / "a.png"
+        image.write_bytes(b"1")
+        debouncer = Debouncer(settle_seconds=1.0)
+        debouncer.touch(image, 0.0)
+        debouncer.ready(0.0)
+
+        image.write_bytes(b"12345")
+        assert debouncer.ready(1.5) == []
+        assert debouncer.ready(3.0) == [image]
+
+    def test_empty_file_is_held_back(self, watch_dir):
+        """空ファイルは通過しないことを確認"""
+        image = watch_dir / "a.png"
+        image.touch()
+        debouncer = Debouncer(settle_seconds=0.0)
+        debouncer.touch(image, 0.0)
+        debouncer.ready(0.0)
+        assert debouncer.ready(10.0) == []
+
+
+class TestBatcher:
+    def test_batch_released_when_full(self):
+        """最大バッチサイズに達したら確定することを確認"""
+        batcher = Batcher(max_batch_size=2, max_latency=60)
+        batcher.add(Path("a"), 0)
+        assert batcher.pop_ready(0) == []
+        batcher.add(Path("b"), 0)
+        assert batcher.pop_ready(0) == [Path("a"), Path("b")]
+
+    def test_batch_released_after_max_latency(self):
+        """最大待ち時間を超えたら確定することを確認"""
+        batcher = Batcher(max_batch_size=10, max_latency=5)
+        batcher.add(Path("a"), 0)
+        assert batcher.pop_ready(4) == []
+        assert batcher.pop_ready(5) == [Path("a")]
+
+
+class TestWatchDaemon:
+    def test_new_files_are_processed_in_rolling_deck(self, watch_dir, pipeline):
+        """rollingモードで新しい画像が同じデッキに追加されることを確認"""
+        clock = FakeClock()
+        daemon = WatchDaemon(
+            pipeline,
+            watch_dir,
+            settle_seconds=1.0,
+            max_batch_size=10,
+            max_latency=5.0,
+            use_inotify=False,
+            clock=clock,
+        )
+        image = watch_dir / "a.png"
+        image.write_bytes(b"data")
+
+        daemon.step(daemon.source.scan())
+        clock.now = 2.0
+        daemon.step(daemon.source.scan())
+        assert not pipeline.run_pipeline.called
+
+        clock.now = 8.0
+        assert daemon.step(daemon.source.scan()) == [image]
+        pipeline.run_pipeline.assert_called_once_with(resume=True)
+        assert pipeline.output_name == "watch"
+        assert pipeline.uploaded_images == [str(image)]
+
+        second = watch_dir / "b.png"
+        second.write_bytes(b"data")
+        daemon.step(daemon.source.scan())
+        clock.now = 20.0
+        daemon.step(daemon.source.scan(), flush=True)
+        assert pipeline.uploaded_images == [str(image), str(second)]
+
+    def test_rolling_drops_removed_and_failed_images(self, watch_dir, pipeline):
+        """rollingモードで削除された画像・失敗した画像が以降のバッチから外れることを確認"""
+        daemon = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+        first, bad, second = (watch_dir / n for n in ("a.png", "bad.png", "b.png"))
+        for image in (first, bad, second):
+            image.write_bytes(b"data")
+
+        pipeline.last_failures = [{"image": str(bad), "stage": "extract", "error": ""}]
+        daemon.process_batch([first, bad])
+        assert daemon.processed == [str(first)]
+
+        pipeline.last_failures = []
+        first.unlink()
+        daemon.process_batch([second])
+        assert pipeline.uploaded_images == [str(second)]
+        assert daemon.processed == [str(second)]
+
+    def test_batch_error_is_retried_with_backoff(self, watch_dir, pipeline):
+        """バッチ全体が失敗した画像は、待ち時間を倍にしながら再試行されることを確認"""
+        clock = FakeClock()
+        daemon = WatchDaemon(
+            pipeline,
+            watch_dir,
+            settle_seconds=0.0,
+            use_inotify=False,
+            clock=clock,
+            retry_backoff=5.0,
+        )
+        image = watch_dir / "a.png"
+        image.write_bytes(b"data")
+        pipeline.run_pipeline.side_effect = RuntimeError("network down")
+
+        daemon.step(daemon.source.scan())
+        assert daemon.step(daemon.source.scan(), flush=True) == [image]
+        assert daemon.processed == []
+
+        clock.now = 4.0
+        assert daemon.step(daemon.source.scan(), flush=True) == []
+        clock.now = 5.0
+        assert daemon.step(daemon.source.scan(), flush=True) == [image]
+        assert pipeline.run_pipeline.call_count == 2
+
+        # 2回目の失敗の後は10秒待つ
+        pipeline.run_pipeline.side_effect = None
+        clock.now = 14.0
+        assert daemon.step(daemon.source.scan(), flush=True) == []
+        clock.now = 15.0
+        assert daemon.step(daemon.source.scan(), flush=True) == [image]
+        assert daemon.processed == [str(image)]
+        assert daemon.step(daemon.source.scan(), flush=True) == []
+
+    def test_per_batch_decks(self, watch_dir, pipeline):
+        """per_batchモードではバッチごとに別のデッキになることを確認"""
+        daemon = WatchDaemon(
+            pipeline, watch_dir, deck_mode="per_batch", use_inotify=False
+        )
+        image = watch_dir / "a.png"
+        image.write_bytes(b"data")
+        daemon.process_batch([image])
+
+        pipeline.run_pipeline.assert_called_once_with(resume=False)
+        assert pipeline.output_name.startswith("watch_")
+        assert pipeline.uploaded_images == [str(image)]
+
+    def test_append_deck(self, watch_dir, pipeline):
+        """appendモードでは同じデッキに新しいバッチだけを追加することを確認"""
+        daemon = WatchDaemon(pipeline, watch_dir, deck_mode="append", use_inotify=False)
+        image = watch_dir / "a.png"
+        image.write_bytes(b"data")
+        daemon.process_batch([image])
+
+        pipeline.run_pipeline.assert_called_once_with(resume=False, append=True)
+        assert pipeline.output_name == "watch"
+        assert pipeline.uploaded_images == [str(image)]
+
+    def test_existing_files_are_ignored_by_default(self, watch_dir, pipeline):
+        """起動時に存在したファイルは処理対象にならないことを確認"""
+        (watch_dir / "old.png").write_bytes(b"data")
+        daemon = WatchDaemon(pipeline, watch_dir, settle_seconds=0.0, use_inotify=False)
+        daemon.step(daemon.source.scan(), flush=True)
+        daemon.step(daemon.source.scan(), flush=True)
+        assert not pipeline.run_pipeline.called
+
+    def test_pipeline_errors_do_not_stop_daemon(self, watch_dir, pipeline):
+        """バッチの処理に失敗してもデーモンが継続することを確認"""
+        pipeline.run_pipeline.side_effect = RuntimeError("boom")
+        daemon = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+        assert daemon.process_batch([watch_dir / "a.png"]) is None
+
+    def test_multi_page_files_are_expanded(self, watch_dir, pipeline):
+        """PDF・TIFFがページごとの画像として処理されることを確認"""
+        from PIL import Image
+
+        daemon = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+        tiff = watch_dir / "scan.tiff"
+        frames = [Image.new("RGB", (20, 20), color) for color in ("red", "blue")]
+        frames[0].save(tiff, save_all=True, append_images=frames[1:])
+        assert daemon.source.scan() == [tiff]
+
+        daemon.process_batch([tiff])
+        assert pipeline.uploaded_images == [f"{tiff}#page=1", f"{tiff}#page=2"]
+        assert daemon.processed == [f"{tiff}#page=1", f"{tiff}#page=2"]
+
+        # 再起動後は既存のファイルのうち抽出済みのページがデッキに残る
+        pipeline.extracted_images.side_effect = lambda paths: paths[1:]
+        restarted = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+        assert restarted.processed == [f"{tiff}#page=2"]
+        pipeline.extracted_images.side_effect = lambda paths: paths
+        restarted = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+        assert restarted.processed == [f"{tiff}#page=1", f"{tiff}#page=2"]
+
+    def test_non_image_files_are_ignored(self, watch_dir):
+        """対象外の拡張子は検出されないことを確認"""
+        (watch_dir / "notes.txt").write_text("x")
+        (watch_dir / "figure.PNG").write_bytes(b"x")
+        assert PollingSource(watch_dir).scan() == [watch_dir / "figure.PNG"]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linuxのみ")
+def test_inotify_source_reports_new_files(watch_dir):
+    """inotifyで新しいファイルが検出されることを確認"""
+    source = create_source(watch_dir)
+    try:
+        (watch_dir / "a.png").write_bytes(b"data")
+        assert watch_dir / "a.png" in source.wait(1.0)
+    finally:
+        source.close()
+
+
+def test_apply_settings_updates_running_daemon(watch_dir, pipeline):
+    """再読み込みした設定が実行中のデーモンに反映されることを確認"""
+    from config import WatchSettings
+
+    daemon = WatchDaemon(pipeline, watch_dir, use_inotify=False)
+    daemon.apply_settings(
+        WatchSettings(
+            directory=str(watch_dir),
+            patterns=("*.png",),
+            settle_seconds=5.0,
+            poll_interval=0.5,
+            max_batch_size=3,
+            max_latency=10.0,
+            deck_mode="rolling",
+            deck_name="watch",
+            process_existing=False,
+        )
+    )
+    assert daemon.debouncer.settle_seconds == 5.0
+    assert daemon.batcher.max_batch_size == 3
+    assert daemon.batcher.max_latency == 10.0
+    assert daemon.poll_interval == 0.5
@@ -0,0 +1,139 @@
+# 非常に大きな画像を重なりのあるタイルに分割する
+#
+# ポスターやつなぎ合わせた図などの巨大な画像は、そのまま送ると縮小されて
+# 小さな軸ラベルが読めなくなるため、長辺が max_side 以下のタイルに分けて
+# タイルごとに抽出し、重なりで重複したトークンをまとめて1つの図にする。
+import logging
+from collections import Counter
+from math import ceil
+from pathlib import Path
+
+import pages
+from image_cache import open_image
+
+logger = logging.getLogger(__name__)
+
+
+def _grid(length: int, count: int, overlap: int) -> list[tuple[int, int]]:
+    """長さ length を、隣と overlap だけ重なる count 個の区間 [start, end) に分ける"""
+    if count <= 1:
+        return [(0, length)]
+    size = ceil((length + (count - 1) * overlap) / count)
+    step = size - overlap
+    segments = []
+    for index in range(count):
+        # 最後の区間は端にそろえる（丸めで端が欠けないように）
+        start = min(index * step, length - size)
+        segments.append((start, start + size))
+    return segments
+
+
+def find_tiles(
+    width: int,
+    height: int,
+    max_side: int = 3072,
+    overlap_ratio: float = 0.1,
+    max_tiles: int = 16,
+) -> list[tuple[int, int, int, int]]:
+    """タイルの領域 (left, top, right, bottom) を読む順（行ごとに左から）に返す
+
+    長辺が max_side 以下の画像は分割せず、画像全体を1つだけ返す。
+    タイルの数が max_tiles を超える場合は、分割数の多い方向から減らす
+    （タイルは max_side より大きくなる）。隣り合うタイルはタイルの辺の
+    overlap_ratio だけ重ね、境界の文字が両方のタイルに含まれるようにする。
+    """
+    if max(width, height) <= max_side:
+        return [(0, 0, width, height)]
+    overlap = int(max_side * overlap_ratio)
+    step = max(1, max_side - overlap)
+    columns = max(1, ceil((width - overlap) / step))
+    rows = max(1, ceil((height - overlap) / step))
+    while columns * rows > max_tiles:
+        if columns >= rows:
+            columns -= 1
+        else:
+            rows -= 1
+    if columns * rows < 2:
+        return [(0, 0, width, height)]
+    return [
+        (left, top, right, bottom)
+        for top, bottom in _grid(height, rows, overlap)
+        for left, right in _grid(width, columns, overlap)
+    ]
+
+
+def split_tiles(
+    path,
+    out_dir,
+    max_side: int = 3072,
+    overlap_ratio: float = 0.1,
+    max_tiles: int = 16,
+) -> list[str]:
+    """長辺が max_side を超える画像をタイルに分割して out_dir に保存し、パスを返す
+
+    分割しない画像（または読み込めない場合）は空リスト。
+    """
+    try:
+        # 大きさはヘッダーから調べ、分割する画像だけをデコードする
+        with pages.open_image(path) as img:
+            width, height = img.size
+        if max(width, height) <= max_side:
+            return []
+        with open_image(path) as img:
+            boxes = find_tiles(*img.size, max_side, overlap_ratio, max_tiles)
+            if len(boxes) < 2:
+                return []
+            out_dir = Path(out_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            stem = Path(path).stem
+            crops = []
+            for index, box in enumerate(boxes):
+                crop_path = out_dir / f"{stem}_tile{index + 1:02d}.png"
+                img.crop(box).save(crop_path)
+                crops.append(str(crop_path))
+    except Exception as e:
+        logger.warning("タイルの分割に失敗しました: %s (%s)", path, e)
+        return []
+    logger.info("タイルに分割しました: %s (%d tiles)", path, len(crops))
+    return crops
+
+
+def _normalize(token: str) -> str:
+    return " ".join(token.split()).casefold()
+
+
+def merge_tile_results(figure_name: str, tile_results: list[list]) -> list:
+    """タイルごとの抽出結果を1つの図にまとめる
+
+    重なりの部分の文字は隣り合うタイルの両方から返されるため、空白と大文字・
+    小文字の違いを無視して同じトークンは、1つのタイルの中で現れた最大の回数
+    だけ残す（同じタイルの中で繰り返される目盛りの数値などは残る）。
+    順序は最初に現れたタイルの順（読む順）。
+
+    Args:
+        figure_name: 図の名前（モデルが名前を返さない場合）
+        tile_results: タイル順の抽出結果（figure_name/token の辞書のリスト）
+    """
+    names = Counter(
+        f["figure_name"]
+        for result in tile_results
+        for f in result
+        if f.get("figure_name")
+    )
+    kept = Counter()
+    tokens = []
+    for result in tile_results:
+        counts = Counter()
+        for f in result:
+            for token in f.get("token", []):
+                key = _normalize(token)
+                counts[key] += 1
+                if counts[key] > kept[key]:
+                    kept[key] += 1
+                    tokens.append(token)
+    return [
+        {
+            "figure_name": names.most_common(1)[0][0] if names else figure_name,
+            "token": tokens,
+        }
+    ]
@@ -0,0 +1,286 @@
+# 実行ごとのトレース（--trace または [TRACE] enabled = true）
+#
+# 1回の run_pipeline を1つのトレースとし、そのIDを実行IDとして使う。画像ごとの
+# アップロード・抽出・削除・スライド生成はスパンとして記録する。現在のスパンは
+# contextvars で受け渡し（ワーカースレッドには wrap で引き継ぐ）、ログの各行にも
+# 実行IDとスパンIDを付ける。トレースを有効にした場合は、実行ごとに Chrome の
+# トレース形式（chrome://tracing・Perfetto で開ける）または OTLP/JSON で書き出す。
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("chrome", "otlp")
+SERVICE_NAME = "image-to-textbox"
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    attributes: dict = field(default_factory=dict)
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    thread_id: int = field(default_factory=threading.get_ident)
+    thread_name: str = field(default_factory=lambda: threading.current_thread().name)
+    error: Optional[str] = None
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def current_ids() -> tuple[Optional[str], Optional[str]]:
+    """現在の (実行ID, スパンID)（実行中でなければ (None, None)）"""
+    span = _current.get()
+    if span is None:
+        return None, None
+    return span.trace_id, span.span_id
+
+
+def _chrome_trace(spans: list[Span]) -> dict:
+    pid = os.getpid()
+    events = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": thread_id,
+            "args": {"name": thread_name},
+        }
+        for thread_id, thread_name in sorted(
+            {(span.thread_id, span.thread_name) for span in spans}
+        )
+    ]
+    for span in spans:
+        args = {**span.attributes, "span_id": span.span_id}
+        if span.parent_id:
+            args["parent_id"] = span.parent_id
+        if span.error:
+            args["error"] = span.error
+        events.append(
+            {
+                "name": span.name,
+                "cat": "pipeline",
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": args,
+            }
+        )
+    return {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {"trace_id": spans[0].trace_id if spans else None},
+    }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(v)} for key, v in attributes.items()]
+
+
+def _otlp_trace(spans: list[Span]) -> dict:
+    otlp_spans = []
+    for span in spans:
+        attributes = {**span.attributes, "thread.name": span.thread_name}
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": _otlp_attributes(attributes),
+            # STATUS_CODE_UNSET / STATUS_CODE_ERROR
+            "status": {"code": 2, "message": span.error} if span.error else {},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": _otlp_attributes({"service.name": SERVICE_NAME})
+                },
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+            }
+        ]
+    }
+
+
+class TraceRecorder:
+    """実行ごとのスパンを集め、実行が終わったらトレースファイルに書き出す
+
+    Args:
+        output_dir: 出力先のディレクトリ
+        format: chrome（Chrome のトレース形式）または otlp（OTLP/JSON）
+    """
+
+    def __init__(self, output_dir, format: str = "chrome"):
+        if format not in FORMATS:
+            raise ValueError(f"不明なトレースの形式です: {format}")
+        self.output_dir = Path(output_dir)
+        self.format = format
+        self._spans: dict[str, list[Span]] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, trace_id: str):
+        with self._lock:
+            self._spans[trace_id] = []
+
+    def record(self, span: Span):
+        """終了したスパンを記録する（実行の終了後に終わったスパンは捨てる）"""
+        with self._lock:
+            spans = self._spans.get(span.trace_id)
+            if spans is not None:
+                spans.append(span)
+
+    def finish(self, root: Span) -> Path:
+        """実行のスパンをまとめてトレースファイルに書き出し、そのパスを返す"""
+        with self._lock:
+            spans = self._spans.pop(root.trace_id, [])
+        spans.append(root)
+        spans.sort(key=lambda span: span.start_ns)
+        if self.format == "otlp":
+            trace, suffix = _otlp_trace(spans), ".otlp.json"
+        else:
+            trace, suffix = _chrome_trace(spans), ".trace.json"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.fromtimestamp(root.start_ns / 1e9).strftime("%Y%m%d_%H%M%S")
+        path = self.output_dir / f"{stamp}_{root.trace_id[:8]}{suffix}"
+        path.write_text(json.dumps(trace, ensure_ascii=False), encoding="utf-8")
+        return path
+
+
+_recorder: Optional[TraceRecorder] = None
+
+
+def start(directory, format: str = "chrome") -> TraceRecorder:
+    """トレースの書き出しを開始する"""
+    global _recorder
+    if _recorder is None:
+        _recorder = TraceRecorder(directory, format=format)
+        logger.info("トレースを記録します: %s (%s)", directory, format)
+    return _recorder
+
+
+def stop():
+    global _recorder
+    _recorder = None
+
+
+def active() -> Optional[TraceRecorder]:
+    return _recorder
+
+
+@contextmanager
+def _activate(span: Span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current.reset(token)
+
+
+@contextmanager
+def run(name: str, **attributes):
+    """新しい実行（トレース）を始める。終了時にトレースファイルを書き出す"""
+    root = Span(name, trace_id=_new_id(16), span_id=_new_id(8), attributes=attributes)
+    recorder = _recorder
+    if recorder is not None:
+        recorder.begin(root.trace_id)
+    try:
+        with _activate(root):
+            yield root
+    finally:
+        if recorder is not None:
+            try:
+                path = recorder.finish(root)
+                logger.info("トレースを書き出しました: %s", path)
+            except OSError as e:
+                logger.warning("トレースを書き出せませんでした: %s", e)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """現在の実行の中にスパンを作る（実行中でなければ何もしない）"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(
+        name,
+        trace_id=parent.trace_id,
+        span_id=_new_id(8),
+        parent_id=parent.span_id,
+        attributes=attributes,
+    )
+    try:
+        with _activate(child):
+            yield child
+    finally:
+        recorder = _recorder
+        if recorder is not None:
+            recorder.record(child)
+
+
+def wrap(func):
+    """現在のスパンを引き継いで func を実行する関数（ワーカースレッドに渡す）"""
+    parent = _current.get()
+    if parent is None:
+        return func
+
+    @functools.wraps(func)
+    def traced(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return traced
+
+
+class TraceContextFilter(logging.Filter):
+    """ログに実行ID（trace_id）とスパンID（span_id）を付ける（実行中でなければ "-"）"""
+
+    def filter(self, record):
+        trace_id, span_id = current_ids()
+        record.trace_id = trace_id or "-"
+        record.span_id = span_id or "-"
+        return True
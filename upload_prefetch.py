@@ -0,0 +1,139 @@
+# 選択された画像を「開始」前にバックグラウンドでアップロードしておく（GUIで使用）
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UploadPrefetcher:
+    """画像ごとのアップロードを先に始め、処理の開始時に結果を受け取る
+
+    受け取られなかったアップロードは discard で取り消し、完了済みのものは削除する。
+
+    Args:
+        upload: 1枚の画像をアップロードしてリモートファイルを返す関数
+        delete: リモートファイルを削除する関数
+        max_workers: 同時にアップロードする画像数
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[str], object],
+        delete: Callable[[object], None],
+        max_workers: int = 4,
+    ):
+        self._upload = upload
+        self._delete = delete
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._futures)
+
+    def __contains__(self, file_path):
+        with self._lock:
+            return file_path in self._futures
+
+    def submit(self, file_paths):
+        """まだアップロードしていない画像のアップロードを始める"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="prefetch"
+                )
+            for file_path in file_paths:
+                if file_path not in self._futures:
+                    self._futures[file_path] = self._executor.submit(
+                        self._upload, file_path
+                    )
+
+    def adopt(self, file_path, load: Callable[[], object]):
+        """以前のアップロードを load で取得し直して、先行アップロードとして扱う
+
+        （保存した作業状態から復元する場合など。まだ扱っていない画像だけ）
+        """
+        with self._lock:
+            if file_path in self._futures:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="prefetch"
+                )
+            self._futures[file_path] = self._executor.submit(load)
+
+    def detach(self, file_paths=None) -> dict:
+        """完了したアップロードを {パス: リモートファイル} として取り出す
+
+        取り出したファイルは削除しない（作業状態に保存して次回に使う場合など）。
+        実行中・失敗したアップロードはそのまま残す。
+
+        Args:
+            file_paths: 取り出す画像（Noneの場合はすべて）
+        """
+        with self._lock:
+            done = {
+                file_path: future
+                for file_path, future in self._futures.items()
+                if (file_paths is None or file_path in file_paths)
+                and future.done()
+                and not future.cancelled()
+                and future.exception() is None
+            }
+            for file_path in done:
+                del self._futures[file_path]
+        return {file_path: future.result() for file_path, future in done.items()}
+
+    def take(self, file_paths) -> dict:
+        """画像のアップロードの完了を待って {パス: リモートファイル} を返す
+
+        先にアップロードしていない画像と、アップロードに失敗した画像は含まない
+        （呼び出し側で通常どおりアップロードする）。受け取ったファイルの削除は
+        呼び出し側が行う。
+        """
+        with self._lock:
+            futures = {
+                file_path: self._futures.pop(file_path)
+                for file_path in file_paths
+                if file_path in self._futures
+            }
+        taken = {}
+        for file_path, future in futures.items():
+            try:
+                taken[file_path] = future.result()
+            except Exception as e:
+                logger.info("先行アップロードに失敗しました: %s (%s)", file_path, e)
+        return taken
+
+    def discard(self, file_paths=None):
+        """アップロードを取り消し、完了したものはリモートから削除する
+
+        Args:
+            file_paths: 取り消す画像（Noneの場合はすべて）
+        """
+        with self._lock:
+            if file_paths is None:
+                file_paths = list(self._futures)
+            futures = [
+                self._futures.pop(file_path)
+                for file_path in file_paths
+                if file_path in self._futures
+            ]
+        for future in futures:
+            if not future.cancel():
+                # 実行中・完了済みのアップロードは完了後に削除する
+                future.add_done_callback(self._delete_result)
+        if futures:
+            logger.info("先行アップロードを %d 件取り消しました", len(futures))
+
+    def _delete_result(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        try:
+            self._delete(future.result())
+        except Exception as e:
+            logger.warning("先行アップロードの削除に失敗しました: %s", e)
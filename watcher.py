@@ -0,0 +1,371 @@
+# フォルダ監視デーモン（新しい画像を自動的に処理する）
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+import pages
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.pdf", "*.tif", "*.tiff")
+DECK_MODES = ("rolling", "append", "per_batch")
+
+# inotify のイベントマスク（linux/inotify.h）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _matches(name: str, patterns) -> bool:
+    lowered = name.lower()
+    return any(fnmatch.fnmatch(lowered, pattern) for pattern in patterns)
+
+
+class PollingSource:
+    """ディレクトリを定期的に走査して新しいファイルを検出する"""
+
+    def __init__(self, directory: Path, patterns=DEFAULT_PATTERNS):
+        self.directory = Path(directory)
+        self.patterns = patterns
+
+    def scan(self) -> list[Path]:
+        try:
+            with os.scandir(self.directory) as entries:
+                return [
+                    Path(entry.path)
+                    for entry in entries
+                    if entry.is_file() and _matches(entry.name, self.patterns)
+                ]
+        except FileNotFoundError:
+            logger.warning("監視ディレクトリが存在しません: %s", self.directory)
+            return []
+
+    def wait(self, timeout: float) -> list[Path]:
+        time.sleep(timeout)
+        return self.scan()
+
+    def close(self):
+        pass
+
+
+class InotifySource(PollingSource):
+    """inotify でファイルの作成・書き込み完了を待つ（Linuxのみ）"""
+
+    def __init__(self, directory: Path, patterns=DEFAULT_PATTERNS):
+        super().__init__(directory, patterns)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = libc.inotify_add_watch(self._fd, os.fsencode(self.directory), mask)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout: float) -> list[Path]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if name:
+                decoded = os.fsdecode(name)
+                if _matches(decoded, self.patterns):
+                    paths.append(self.directory / decoded)
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+def create_source(directory: Path, patterns=DEFAULT_PATTERNS, use_inotify=True):
+    """Linuxではinotify、それ以外（または失敗時）はポーリングを使用する"""
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            return InotifySource(directory, patterns)
+        except (OSError, AttributeError):
+            logger.warning("inotifyを使用できないためポーリングで監視します")
+    return PollingSource(directory, patterns)
+
+
+class Debouncer:
+    """サイズと更新時刻が一定時間変化しなくなったファイルだけを通す
+
+    書き込み途中のファイルを処理しないためのもの。
+    """
+
+    def __init__(self, settle_seconds: float = 2.0):
+        self.settle_seconds = settle_seconds
+        self._pending: dict[Path, tuple[int, int, float]] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, path: Path, now: float):
+        if path not in self._pending:
+            self._pending[path] = (-1, -1, now)
+
+    def ready(self, now: float) -> list[Path]:
+        settled = []
+        for path, (size, mtime_ns, since) in list(self._pending.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif stat.st_size > 0 and now - since >= self.settle_seconds:
+                del self._pending[path]
+                settled.append(path)
+        return sorted(settled)
+
+
+class Batcher:
+    """最大バッチサイズまたは最大待ち時間に達したらバッチを確定する"""
+
+    def __init__(self, max_batch_size: int = 20, max_latency: float = 60.0):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max_latency
+        self._items: list[Path] = []
+        self._oldest: Optional[float] = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, path: Path, now: float):
+        if not self._items:
+            self._oldest = now
+        self._items.append(path)
+
+    def pop_ready(self, now: float, flush: bool = False) -> list[Path]:
+        if not self._items:
+            return []
+        if (
+            flush
+            or len(self._items) >= self.max_batch_size
+            or now - self._oldest >= self.max_latency
+        ):
+            batch = self._items[: self.max_batch_size]
+            self._items = self._items[self.max_batch_size :]
+            self._oldest = now if self._items else None
+            return batch
+        return []
+
+
+class WatchDaemon:
+    """監視ディレクトリに追加された画像をバッチ単位でスライド化する
+
+    deck_mode:
+        rolling: 1つのデッキに追記し続ける（ジャーナルで抽出済み画像を再利用）
+        append: 1つのデッキの末尾に新しいバッチのスライドだけを追加する
+        per_batch: バッチごとに新しいデッキを作成する
+    """
+
+    def __init__(
+        self,
+        pipeline,
+        directory,
+        patterns=DEFAULT_PATTERNS,
+        settle_seconds: float = 2.0,
+        poll_interval: float = 1.0,
+        max_batch_size: int = 20,
+        max_latency: float = 60.0,
+        deck_mode: str = "rolling",
+        deck_name: str = "watch",
+        process_existing: bool = False,
+        use_inotify: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        retry_backoff: float = 5.0,
+        max_retry_backoff: float = 300.0,
+    ):
+        if deck_mode not in DECK_MODES:
+            raise ValueError(f"不正なdeck_modeです: {deck_mode}")
+        self.pipeline = pipeline
+        self.directory = Path(directory)
+        self.poll_interval = poll_interval
+        self.deck_mode = deck_mode
+        self.deck_name = deck_name
+        self.clock = clock
+        self.source = create_source(self.directory, patterns, use_inotify)
+        self.debouncer = Debouncer(settle_seconds)
+        self.batcher = Batcher(max_batch_size, max_latency)
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.processed: list[str] = []
+        self._seen: set[Path] = set()
+        # バッチ全体が失敗した画像（_retry_at 以降に再試行する）
+        self._retry: list[Path] = []
+        self._retry_at = 0.0
+        self._retry_delay = 0.0
+        self._stop_event = threading.Event()
+
+        existing = sorted(self.source.scan())
+        if process_existing:
+            now = self.clock()
+            for path in existing:
+                self.debouncer.touch(path, now)
+        else:
+            self._seen.update(existing)
+            if self.deck_mode == "rolling":
+                # 再起動後は、ジャーナルに抽出結果がある既存の画像だけをデッキに残す
+                # （未抽出の既存の画像は process_existing = false のとおり処理しない）
+                self.pipeline.output_name = self.deck_name
+                self.processed.extend(
+                    self.pipeline.extracted_images(pages.expand_inputs(existing)[0])
+                )
+
+    @classmethod
+    def from_config(cls, pipeline, config_ini, directory=None):
+        """[WATCH] セクションの設定からデーモンを作成する"""
+        from config import Settings
+
+        return cls.from_settings(
+            pipeline, Settings.from_config(config_ini).watch, directory
+        )
+
+    @classmethod
+    def from_settings(cls, pipeline, watch, directory=None):
+        """検証済みの WatchSettings からデーモンを作成する"""
+        return cls(
+            pipeline,
+            directory or watch.directory,
+            patterns=watch.patterns,
+            settle_seconds=watch.settle_seconds,
+            poll_interval=watch.poll_interval,
+            max_batch_size=watch.max_batch_size,
+            max_latency=watch.max_latency,
+            deck_mode=watch.deck_mode,
+            deck_name=watch.deck_name,
+            process_existing=watch.process_existing,
+        )
+
+    def apply_settings(self, watch):
+        """再読み込みした設定のうち、実行中に変更できる値を反映する
+
+        監視フォルダ・対象パターン・デッキの作り方は再起動時に反映される。
+        """
+        self.debouncer.settle_seconds = watch.settle_seconds
+        self.batcher.max_batch_size = watch.max_batch_size
+        self.batcher.max_latency = watch.max_latency
+        self.poll_interval = watch.poll_interval
+        logger.info("監視設定を再読み込みしました")
+
+    def step(self, new_paths=(), flush: bool = False):
+        """検出したファイルを取り込み、確定したバッチがあれば処理する"""
+        now = self.clock()
+        for path in new_paths:
+            if path not in self._seen:
+                self.debouncer.touch(path, now)
+        for path in self.debouncer.ready(now):
+            if path not in self._seen:
+                self._seen.add(path)
+                self.batcher.add(path, now)
+        if self._retry and now >= self._retry_at:
+            for path in self._retry:
+                if path.exists():
+                    self.batcher.add(path, now)
+            self._retry = []
+        batch = self.batcher.pop_ready(now, flush=flush)
+        if batch:
+            self.process_batch(batch)
+        return batch
+
+    def process_batch(self, batch: list[Path]):
+        """1バッチ分の画像を抽出し、デッキを保存する（例外はログに記録して継続）
+
+        バッチ全体が失敗した場合（通信障害など）は、待ち時間を倍にしながら
+        同じ画像を再試行する。画像ごとの失敗（last_failures）は再試行しない。
+        """
+        # PDF・TIFFはページごとに1枚の画像として扱う
+        paths, unreadable = pages.expand_inputs(str(path) for path in batch)
+        if unreadable:
+            logger.warning("読み込めないファイル %d 件をスキップします", unreadable)
+        if not paths:
+            return None
+        logger.info("新しい画像 %d 件を処理します", len(paths))
+        if self.deck_mode == "rolling":
+            # 監視フォルダから削除された画像はデッキから外す
+            self.processed = [
+                p for p in self.processed if os.path.exists(pages.split_ref(p)[0])
+            ]
+            self.pipeline.uploaded_images = self.processed + paths
+            self.pipeline.output_name = self.deck_name
+            resume = True
+        elif self.deck_mode == "append":
+            self.pipeline.uploaded_images = paths
+            self.pipeline.output_name = self.deck_name
+            resume = False
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            self.pipeline.uploaded_images = paths
+            self.pipeline.output_name = f"{self.deck_name}_{timestamp}"
+            resume = False
+        try:
+            if self.deck_mode == "append":
+                output_path = self.pipeline.run_pipeline(resume=resume, append=True)
+            else:
+                output_path = self.pipeline.run_pipeline(resume=resume)
+        except Exception:
+            logger.exception("バッチの処理中にエラーが発生しました")
+            self._schedule_retry(batch)
+            return None
+        self._retry_delay = 0.0
+        if self.deck_mode == "rolling":
+            # 失敗した画像は以降のバッチで処理し直さない（失敗レポートに記録される）
+            failures = getattr(self.pipeline, "last_failures", None)
+            failed = (
+                {f["image"] for f in failures} if isinstance(failures, list) else set()
+            )
+            self.processed.extend(p for p in paths if p not in failed)
+            self.processed = [p for p in self.processed if p not in failed]
+        logger.info("デッキを保存しました: %s", output_path)
+        return output_path
+
+    def _schedule_retry(self, batch: list[Path]):
+        self._retry_delay = min(
+            self.max_retry_backoff, max(self.retry_backoff, self._retry_delay * 2)
+        )
+        self._retry_at = self.clock() + self._retry_delay
+        self._retry.extend(path for path in batch if path not in self._retry)
+        logger.warning(
+            "%d 件の画像を %.0f 秒後に再試行します", len(batch), self._retry_delay
+        )
+
+    def run(self):
+        """stop() が呼ばれるまで監視を続ける"""
+        logger.info("フォルダ監視を開始しました: %s", self.directory)
+        try:
+            while not self._stop_event.is_set():
+                self.step(self.source.wait(self.poll_interval))
+            # 停止時は確定済みの残りを処理する
+            while self.step(flush=True):
+                pass
+        finally:
+            self.source.close()
+            logger.info("フォルダ監視を終了しました")
+
+    def stop(self):
+        self._stop_event.set()